@@ -0,0 +1,9 @@
+"""Benchmark de extremo a extremo del consumer.
+
+Reproduce una carga con semilla sobre InsectDataStore y el servidor de consultas y guarda
+eventos/s de ingesta, latencias p50/p95/p99 por tipo de consulta y el pico de RSS en un
+JSON comparable entre commits. Se ejecuta desde model/:
+
+    python -m benchmark --sizes 10k,100k,1M --output bench.json
+    python -m benchmark --sizes 10k,100k --compare bench.json
+"""
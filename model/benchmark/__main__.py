@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import consumer
+from consumer import InsectDataStore, ResultCache, _ingest_batch
+from mapreduce import MapReduce
+from protocol import QueryClient
+from transition_matrix import Matrix_Transition
+from benchmark.workload import FULL_SCANS, QUERIES, Workload, parse_size
+
+
+def percentile(samples, q):
+    """Percentil exacto (interpolación lineal) de una lista ya ordenada"""
+    if not samples:
+        return None
+    k = (len(samples) - 1) * q / 100
+    low = int(k)
+    high = min(low + 1, len(samples) - 1)
+    return samples[low] + (samples[high] - samples[low]) * (k - low)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ingest(store, workload, count, batch_size):
+    """Ingiere `count` eventos por el camino del consumer; devuelve segundos de ingesta.
+
+    Solo se cronometra decodificar e indexar: generar los payloads queda fuera.
+    """
+    elapsed = 0.0
+    for payloads in workload.batches(count, batch_size):
+        started = time.perf_counter()
+        _ingest_batch(store, payloads, workload.decode)
+        elapsed += time.perf_counter() - started
+    return elapsed
+
+
+def run_mapreduce(client, params):
+    """Como consultas.query_mapreduce: las páginas del cursor van a los workers de mapeo"""
+    pages = client.iter_pages("insects", page_size=consumer.PAGE_SIZE)
+    return MapReduce().run_chunks(pages, params["map"], params["reduce"])
+
+
+def run_markov(client, params):
+    """Como consultas.query_markov: lectura por cursor y matriz de transición"""
+    data = {}
+    for page in client.iter_pages("insects", page_size=consumer.PAGE_SIZE):
+        for insect in page:
+            data[insect["_id"]] = {"eventTime": insect["eventTime"], "event": insect["event"]}
+    return Matrix_Transition().analyze_transitions(data, output_format="transition_matrix")
+
+
+# Consultas cuyo trabajo se hace en el cliente, sobre los registros leídos por cursor
+CLIENT_SIDE = {"mapreduce": run_mapreduce, "markov": run_markov}
+
+
+def time_query(client, kind, params):
+    """Latencia de extremo a extremo de una consulta, incluido el procesamiento en el cliente"""
+    started = time.perf_counter()
+    if kind in CLIENT_SIDE:
+        CLIENT_SIDE[kind](client, params)
+    else:
+        response = client.request({"type": kind, "params": params})
+        if response["status"] != "ok":
+            raise RuntimeError(f"{kind}: {response.get('message')}")
+    return time.perf_counter() - started
+
+
+def measure_queries(client, reps, heavy_reps):
+    results = {}
+    for kind, params in QUERIES:
+        n = heavy_reps if kind in FULL_SCANS else reps
+        time_query(client, kind, params)  # calentamiento
+        results[kind] = summarize([time_query(client, kind, params) for _ in range(n)])
+    return results
+
+
+def wait_for_socket(path, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"El servidor de consultas no arrancó en {path}")
+        time.sleep(0.05)
+
+
+def run(args):
+    sizes = sorted(parse_size(s) for s in args.sizes.split(","))
+    if not args.cache:
+        # Sin tolerancia ninguna consulta se cachea: se mide el coste real de cada una
+        consumer.result_cache = ResultCache(tolerance={})
+
+    store = InsectDataStore(backend=args.backend)
+    workload = Workload(seed=args.seed, encoding=args.format)
+    threading.Thread(target=consumer.query_server, args=(store, args.socket), daemon=True).start()
+    wait_for_socket(args.socket)
+    client = QueryClient(args.socket)
+
+    results = []
+    loaded = 0
+    for size in sizes:
+        count = size - loaded
+        print(f"⏱️ Ingiriendo {count} eventos (hasta {size})...")
+        seconds = ingest(store, workload, count, args.batch)
+        loaded = size
+        print(f"⏱️ Midiendo consultas con {size} eventos...")
+        queries = measure_queries(client, args.reps, args.heavy_reps)
+        entry = {
+            "size": size,
+            "ingest": {"events": count, "seconds": round(seconds, 3),
+                       "events_per_sec": round(count / seconds) if seconds else None},
+            "queries": queries,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        results.append(entry)
+        print_entry(entry)
+
+    client.close()
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "params": {"seed": args.seed, "batch": args.batch, "backend": args.backend,
+                   "format": args.format, "reps": args.reps, "heavy_reps": args.heavy_reps,
+                   "cache": args.cache},
+        "results": results,
+    }
+
+
+def print_entry(entry):
+    ingest_stats = entry["ingest"]
+    print(f"📊 {entry['size']} eventos · ingesta {ingest_stats['events_per_sec']} ev/s · "
+          f"RSS pico {entry['peak_rss_mb']} MB")
+    for kind, stats in entry["queries"].items():
+        print(f"   {kind:<14} p50 {stats['p50_ms']:>10.3f} ms  p95 {stats['p95_ms']:>10.3f} ms  "
+              f"p99 {stats['p99_ms']:>10.3f} ms")
+
+
+def compare(report, path):
+    """Imprime la relación nuevo/anterior de cada métrica para los tamaños comunes"""
+    with open(path) as f:
+        previous = {entry["size"]: entry for entry in json.load(f)["results"]}
+    print(f"\n🔍 Comparación con {path} (nuevo / anterior; <1 es mejor en latencia y RSS)")
+    for entry in report["results"]:
+        old = previous.get(entry["size"])
+        if old is None:
+            continue
+        new_rate, old_rate = entry["ingest"]["events_per_sec"], old["ingest"]["events_per_sec"]
+        print(f"📊 {entry['size']} eventos · ingesta x{new_rate / old_rate:.2f} · "
+              f"RSS x{entry['peak_rss_mb'] / old['peak_rss_mb']:.2f}")
+        for kind, stats in entry["queries"].items():
+            before = old["queries"].get(kind)
+            if before and before["p50_ms"] and before["p99_ms"]:
+                print(f"   {kind:<14} p50 x{stats['p50_ms'] / before['p50_ms']:.2f}  "
+                      f"p99 x{stats['p99_ms'] / before['p99_ms']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta y consultas del consumer")
+    parser.add_argument("--sizes", default="10k,100k,1M,10M",
+                        help="Tamaños del almacén a medir, separados por comas (10k, 1M...)")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla de la carga")
+    parser.add_argument("--batch", type=int, default=consumer.BATCH_SIZE,
+                        help="Eventos por lote de ingesta")
+    parser.add_argument("--backend", choices=["dict", "columnar"], default="dict",
+                        help="Backend del almacén: dict, o columnar (añade una proyección numpy para eco_density)")
+    parser.add_argument("--format", choices=["json", "binary"], default="binary",
+                        help="Codificación de los eventos de la carga")
+    parser.add_argument("--reps", type=int, default=200,
+                        help="Repeticiones de cada consulta ligera por tamaño")
+    parser.add_argument("--heavy-reps", type=int, default=3,
+                        help="Repeticiones de las consultas de recorrido completo por tamaño")
+    parser.add_argument("--cache", action="store_true",
+                        help="Mantener la caché de resultados (por defecto se desactiva)")
+    parser.add_argument("--socket", default=os.path.join(tempfile.gettempdir(),
+                                                         f"insect-bench-{os.getpid()}.sock"),
+                        help="Socket Unix del servidor de consultas del benchmark")
+    parser.add_argument("--output", default="benchmark.json", help="Fichero JSON de resultados")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior con el que comparar")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Resultados guardados en {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+from codec import ENCODINGS
+from producer import EventPools, seed_generators
+from record import decode_record
+
+# Consultas que se miden en cada tamaño: (tipo, parámetros). mapreduce y markov leen el
+# almacén por cursor y se procesan en el cliente, como en consultas.py.
+QUERIES = (
+    ("stats", {}),
+    ("species", {"species": "bee", "limit": 10}),
+    ("habitat_event", {"habitat": "forest", "event": "birth", "limit": 10}),
+    ("random_walk", {"window": 300, "start": "forest", "steps": 5}),
+    ("mapreduce", {"map": 2, "reduce": 2}),
+    ("markov", {}),
+)
+FULL_SCANS = {"random_walk", "mapreduce", "markov"}
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1M' -> 1000000, '2500' -> 2500"""
+    text = text.strip()
+    factor = {"k": 1000, "m": 1000000}.get(text[-1:].lower(), 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+class Workload:
+    """Flujo de eventos reproducible: misma semilla, mismas especies, hábitats y valores"""
+
+    def __init__(self, seed=42, encoding="binary"):
+        seed_generators(seed)
+        self.pools = EventPools()
+        self.encoding = ENCODINGS[encoding]
+
+    def batches(self, count, batch_size):
+        """Lotes de payloads serializados, como llegarían del transporte"""
+        while count > 0:
+            n = min(batch_size, count)
+            yield [payload for _, payload in self.pools.build_batch(n, encoding=self.encoding)]
+            count -= n
+
+    def decode(self, payload):
+        return decode_record(payload, self.encoding)
@@ -1,35 +1,188 @@
 import math
-from collections import defaultdict
+import struct
 
 import mmh3
 
+from windows import MAX_FUTURE_SKEW
+
+# Cabecera de BloomFilter.to_bytes: número de bits (u64) y de funciones hash (u8)
+HEADER = struct.Struct("<QB")
+MASK64 = (1 << 64) - 1
+
+
 class BloomFilter:
+    """Filtro de Bloom sobre un bytearray (un bit por posición).
+
+    Los k índices de cada item salen de una sola llamada a mmh3.hash128 por doble hashing
+    (Kirsch-Mitzenmacher): índice_i = h1 + i·h2 módulo el tamaño.
+    """
 
     def __init__(self, expected_elements, false_positive_rate):  # Constructor
         self.size = self.optimal_size(expected_elements, false_positive_rate)
         self.hash_count = self.optimal_hash(self.size, expected_elements)
-        self.bit_array = [0] * self.size
+        self.bit_array = bytearray((self.size + 7) // 8)
 
-    def optimal_size(self, m, p):     # Calcula el tamaño óptimo del filtro
-        return int(-m * math.log(p) / (math.log(2) ** 2))
+    @staticmethod
+    def optimal_size(n, p):     # Bits para n elementos con tasa de falsos positivos p: -n·ln(p) / ln(2)²
+        return max(1, int(-n * math.log(p) / (math.log(2) ** 2)))
 
-    def optimal_hash(self, n, m):     # Calcula el número óptimo de funciones hash
-        return int((n / m) * math.log(2))
+    @staticmethod
+    def optimal_hash(m, n):     # Funciones hash óptimas para m bits y n elementos: (m / n)·ln(2), al menos 1
+        return max(1, round(m / max(n, 1) * math.log(2)))
 
-    def hash(self, item, seed):    # Función hash usando mmh3
-        return mmh3.hash(item, seed) % self.size
+    @classmethod
+    def _empty(cls, size, hash_count, bits=None):
+        bloom = cls.__new__(cls)
+        bloom.size = size
+        bloom.hash_count = hash_count
+        bloom.bit_array = bytearray(bits) if bits is not None else bytearray((size + 7) // 8)
+        return bloom
+
+    def _indexes(self, item):   # Los k índices del item a partir de un único hash de 128 bits
+        h = mmh3.hash128(item, 0, True, False)
+        # h2 impar: con un tamaño potencia de 2 un paso par repetiría índices
+        h1, h2 = h & MASK64, (h >> 64) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hash_count)]
 
     def add(self, item):    # Agrega un item al filtro.
-        for i in range(self.hash_count):
-            index = self.hash(item, i)
-            self.bit_array[index] = 1
+        bits = self.bit_array
+        for index in self._indexes(item):
+            bits[index >> 3] |= 1 << (index & 7)
+
+    def add_many(self, items):
+        for item in items:
+            self.add(item)
 
     def contains(self, item):   # Verifica si un item probablemente existe en el conjunto.
-        for i in range(self.hash_count):
-            index = self.hash(item, i)
-            if self.bit_array[index] == 0:
+        bits = self.bit_array
+        for index in self._indexes(item):
+            if not bits[index >> 3] & (1 << (index & 7)):
                 return False
         return True
 
+    def contains_many(self, items):
+        return [self.contains(item) for item in items]
+
+    def __contains__(self, item):
+        return self.contains(item)
+
+    def _check_compatible(self, other):
+        if (self.size, self.hash_count) != (other.size, other.hash_count):
+            raise ValueError("Los filtros deben tener el mismo tamaño y número de funciones hash")
+
+    def _combine(self, other, op):
+        self._check_compatible(other)
+        a = int.from_bytes(self.bit_array, "little")
+        b = int.from_bytes(other.bit_array, "little")
+        return self._empty(self.size, self.hash_count, op(a, b).to_bytes(len(self.bit_array), "little"))
+
+    def union(self, other):     # Filtro de los items de ambos conjuntos (OR de bits)
+        return self._combine(other, int.__or__)
+
+    def intersection(self, other):  # Aproximación de la intersección (AND de bits)
+        return self._combine(other, int.__and__)
+
+    def to_bytes(self):
+        return HEADER.pack(self.size, self.hash_count) + bytes(self.bit_array)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER.size:
+            raise ValueError("Datos demasiado cortos para la cabecera del filtro")
+        size, hash_count = HEADER.unpack_from(data)
+        bits = data[HEADER.size:]
+        if len(bits) != (size + 7) // 8:
+            raise ValueError("Longitud de bits inconsistente con la cabecera del filtro")
+        return cls._empty(size, hash_count, bits)
+
     def bloom_key(self, species: str, role: str, event: str) -> str:
-        return f"{species}_{role}_{event}"
\ No newline at end of file
+        return f"{species}_{role}_{event}"
+
+
+class RotatingBloomFilter:
+    """Generaciones de BloomFilter por franja de tiempo del evento, sobre un ring.
+
+    Cada franja de `slice_seconds` tiene su propio filtro; las que salen del horizonte se
+    reutilizan, así que la memoria queda acotada a horizon / slice_seconds + 1 filtros. Una
+    ventana se responde con la unión (OR) de las generaciones que la cubren, redondeada a
+    franjas completas.
+
+    Con `track_keys` cada generación recuerda sus claves para no re-hashear las repetidas;
+    solo conviene si el universo de claves es pequeño.
+
+    Cada generación cuenta sus claves. Pasado `expected_elements` su tasa de falsos positivos
+    ya no está acotada: deja de recibir bits y `contains` no la consulta.
+    """
+
+    def __init__(self, expected_elements, false_positive_rate, slice_seconds=60, horizon=3600,
+                 track_keys=True):
+        self.slice_seconds = slice_seconds
+        self.horizon = horizon
+        self.slots = horizon // slice_seconds + 1
+        shape = BloomFilter(expected_elements, false_positive_rate)
+        self.size, self.hash_count = shape.size, shape.hash_count
+        self.capacity = expected_elements
+        self._stamps = [None] * self.slots
+        self._filters = [None] * self.slots
+        self._counts = [0] * self.slots
+        self.track_keys = track_keys
+        self._seen = [None] * self.slots  # claves ya añadidas a cada generación
+
+    def add(self, epoch, key, now):
+        if epoch <= now - self.horizon or epoch > now + MAX_FUTURE_SKEW:
+            return False
+        stamp = epoch // self.slice_seconds
+        i = stamp % self.slots
+        if self._stamps[i] != stamp:
+            if self._stamps[i] is not None and self._stamps[i] > stamp:
+                # El slot ya pertenece a una franja más reciente
+                return False
+            self._stamps[i] = stamp
+            self._filters[i] = BloomFilter._empty(self.size, self.hash_count)
+            self._seen[i] = set() if self.track_keys else None
+            self._counts[i] = 0
+        # Una clave repetida en la misma franja no vuelve a calcular sus hashes
+        seen = self._seen[i]
+        if seen is not None:
+            if key in seen:
+                return True
+            seen.add(key)
+        self._counts[i] += 1
+        if self._counts[i] <= self.capacity:
+            self._filters[i].add(key)
+        return True
+
+    def _usable(self, i):
+        return self._counts[i] <= self.capacity
+
+    def contains(self, key, now):
+        """Si la clave está (probablemente) en alguna generación dentro del horizonte"""
+        first = (now - self.horizon + 1) // self.slice_seconds
+        live = [self._filters[i] for i, stamp in enumerate(self._stamps)
+                if stamp is not None and stamp >= first and self._usable(i)]
+        if not live:
+            return False
+        # Todas las generaciones tienen la misma forma: los índices se calculan una vez
+        indexes = live[0]._indexes(key)
+        return any(all(f.bit_array[i >> 3] & (1 << (i & 7)) for i in indexes) for f in live)
+
+    def window(self, seconds, now):
+        """Filtro con la unión de las generaciones de los últimos `seconds` segundos"""
+        first = (now - min(seconds, self.horizon) + 1) // self.slice_seconds
+        bits = 0
+        for stamp in range(first, now // self.slice_seconds + 1):
+            i = stamp % self.slots
+            if self._stamps[i] == stamp and self._usable(i):
+                bits |= int.from_bytes(self._filters[i].bit_array, "little")
+        return BloomFilter._empty(self.size, self.hash_count, bits.to_bytes((self.size + 7) // 8, "little"))
+
+    def contains_many(self, keys, seconds, now):
+        return self.window(seconds, now).contains_many(keys)
+
+    def generations(self):
+        return sum(stamp is not None for stamp in self._stamps)
+
+    def saturated(self):
+        """Generaciones que superaron su capacidad y ya no se consultan"""
+        return sum(stamp is not None and not self._usable(i) for i, stamp in enumerate(self._stamps))
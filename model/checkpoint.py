@@ -0,0 +1,105 @@
+import json
+import mmap
+import os
+import struct
+import time
+
+from record import RECORD_STRUCT, InsectRecord
+
+# Checkpoint del almacén: cabecera | offsets Kafka (JSON) | registros empaquetados de
+# tamaño fijo (RECORD_STRUCT). Al ser de tamaño fijo, los registros se leen con mmap
+# sin decodificar nada.
+MAGIC = b"INCK"
+CHECKPOINT_VERSION = 1
+# magic | versión (u8) | creado en epoch (u32) | registros (u64) | bytes de offsets (u32)
+HEADER_STRUCT = struct.Struct("<4sBIQI")
+
+
+def write_checkpoint(path, records, offsets):
+    """Escribe registros y offsets de forma atómica: archivo temporal, fsync y os.replace.
+
+    `offsets` es {(topic, partición): siguiente offset a consumir}. Devuelve la cantidad
+    de registros escritos.
+    """
+    offsets_json = json.dumps([[topic, partition, offset]
+                               for (topic, partition), offset in sorted(offsets.items())]).encode("utf-8")
+    tmp_path = path + ".tmp"
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER_STRUCT.pack(MAGIC, CHECKPOINT_VERSION, int(time.time()), 0, len(offsets_json)))
+        f.write(offsets_json)
+        pending = []
+        for record in records:
+            pending.append(record)
+            if len(pending) >= 65536:
+                f.write(b"".join(pending))
+                count += len(pending)
+                pending = []
+        f.write(b"".join(pending))
+        count += len(pending)
+
+        # La cantidad de registros se conoce al final: reescribir la cabecera
+        f.seek(0)
+        f.write(HEADER_STRUCT.pack(MAGIC, CHECKPOINT_VERSION, int(time.time()), count, len(offsets_json)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+class Checkpoint:
+    """Checkpoint abierto con mmap; los registros se sirven como InsectRecord sin copiar el archivo"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Checkpoint vacío: {path}") from None
+
+        magic, version, created, count, offsets_size = HEADER_STRUCT.unpack_from(self._map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} no es un checkpoint de insectos")
+        if version != CHECKPOINT_VERSION:
+            self.close()
+            raise ValueError(f"Versión de checkpoint no soportada: {version}")
+
+        start = HEADER_STRUCT.size
+        self.created = created
+        self.count = count
+        self.offsets = {(topic, partition): offset for topic, partition, offset
+                        in json.loads(self._map[start:start + offsets_size])}
+        self._records_start = start + offsets_size
+        if len(self._map) < self._records_start + count * RECORD_STRUCT.size:
+            self.close()
+            raise ValueError(f"Checkpoint truncado: {path}")
+
+    def __len__(self):
+        return self.count
+
+    def records(self):
+        size = RECORD_STRUCT.size
+        position = self._records_start
+        for _ in range(self.count):
+            yield InsectRecord(self._map[position:position + size])
+            position += size
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_checkpoint(path):
+    """Abre el checkpoint si existe (None si todavía no se ha escrito ninguno)"""
+    if not os.path.exists(path):
+        return None
+    return Checkpoint(path)
@@ -0,0 +1,142 @@
+import calendar
+import json
+import struct
+import time
+import uuid
+from datetime import datetime, timezone
+from functools import lru_cache
+
+# Tablas de enumeración compartidas por producer y consumer. El orden define el código
+# en el formato binario: solo se pueden añadir valores al final.
+SPECIES = ("ant", "bee", "butterfly", "spider")
+ROLES = ("worker", "queen", "soldier", "scout")
+EVENTS = ("birth", "death", "predator attack")
+HABITATS = ("forest", "field", "garden", "house")
+
+SPECIES_CODE = {v: i for i, v in enumerate(SPECIES)}
+ROLE_CODE = {v: i for i, v in enumerate(ROLES)}
+EVENT_CODE = {v: i for i, v in enumerate(EVENTS)}
+HABITAT_CODE = {v: i for i, v in enumerate(HABITATS)}
+
+# Cabecera Kafka con la que el producer anuncia la codificación del mensaje
+HEADER_KEY = "encoding"
+JSON_ENCODING = "json"
+BINARY_ENCODING = "insect-bin/1"
+ENCODINGS = {"json": JSON_ENCODING, "binary": BINARY_ENCODING}
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Formato binario v1 (45 bytes, little-endian):
+#   versión, especie, rol, evento, hábitat, edad (u8) | impacto (i8) | densidad (u16)
+#   _id (16 bytes) | eventTime en segundos epoch UTC (u32) | latitud, longitud (f64)
+BINARY_VERSION = 1
+EVENT_STRUCT = struct.Struct("<BBBBBBbH16sIdd")
+
+
+@lru_cache(maxsize=8192)
+def parse_event_time(event_time):
+    """Convierte '%Y-%m-%dT%H:%M:%S Z' a segundos epoch (el sufijo Z indica UTC).
+
+    Los eventos de un mismo segundo comparten la cadena, así que se cachea la conversión.
+    """
+    return calendar.timegm(time.strptime(event_time.split()[0], TIME_FORMAT))
+
+
+@lru_cache(maxsize=8192)
+def format_event_time(epoch):
+    """Inversa de parse_event_time"""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(TIME_FORMAT) + " Z"
+
+
+def id_to_bytes(insect_id):
+    return uuid.UUID(insect_id).bytes
+
+
+def id_from_bytes(raw):
+    h = raw.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def encode_binary(data):
+    """Serializa un evento (dict con la forma del producer) al formato binario v1"""
+    insect = data["insect"]
+    location = data["location"]
+    coordinates = location["coordinates"]
+    try:
+        return EVENT_STRUCT.pack(
+            BINARY_VERSION,
+            SPECIES_CODE[insect["species"]],
+            ROLE_CODE[insect["role"]],
+            EVENT_CODE[data["event"]],
+            HABITAT_CODE[location["habitat"]],
+            insect["age"],
+            data["ecologicalImpact"],
+            data["populationDensity"],
+            id_to_bytes(data["_id"]),
+            parse_event_time(data["eventTime"]),
+            coordinates["latitude"],
+            coordinates["longitude"],
+        )
+    except KeyError as e:
+        raise ValueError(f"Valor sin código en el formato binario: {e}") from None
+
+
+def decode_binary(payload):
+    """Reconstruye el dict del evento a partir del formato binario v1"""
+    (version, species, role, event, habitat, age, impact, density,
+     raw_id, epoch, latitude, longitude) = EVENT_STRUCT.unpack(payload)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Versión de formato binario no soportada: {version}")
+    return {
+        "_id": id_from_bytes(raw_id),
+        "insect": {
+            "species": SPECIES[species],
+            "role": ROLES[role],
+            "age": age
+        },
+        "event": EVENTS[event],
+        "eventTime": format_event_time(epoch),
+        "location": {
+            "habitat": HABITATS[habitat],
+            "coordinates": {
+                "latitude": latitude,
+                "longitude": longitude
+            }
+        },
+        "ecologicalImpact": impact,
+        "populationDensity": density
+    }
+
+
+def encode_event(data, encoding=JSON_ENCODING):
+    if encoding == BINARY_ENCODING:
+        return encode_binary(data)
+    return json.dumps(data).encode("utf-8")
+
+
+def decode_event(payload, encoding=None):
+    """Decodifica un payload; sin codificación explícita se detecta por el primer byte"""
+    if encoding is None:
+        encoding = JSON_ENCODING if payload[:1] == b"{" else BINARY_ENCODING
+    if encoding == BINARY_ENCODING:
+        return decode_binary(payload)
+    if encoding == JSON_ENCODING:
+        return json.loads(payload)
+    raise ValueError(f"Codificación desconocida: {encoding}")
+
+
+def message_headers(encoding):
+    return [(HEADER_KEY, encoding.encode("utf-8"))]
+
+
+def header_encoding(headers):
+    """Codificación anunciada en las cabeceras de un mensaje Kafka (None si no la hay)"""
+    for key, value in headers or ():
+        if key == HEADER_KEY:
+            return value.decode("utf-8") if isinstance(value, bytes) else value
+    return None
+
+
+def decode_message(value, headers=None):
+    """Elige el decodificador según la cabecera del mensaje (lo detecta si no se anuncia)"""
+    return decode_event(value, header_encoding(headers))
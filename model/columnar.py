@@ -0,0 +1,132 @@
+try:
+    import numpy as np
+except ImportError:  # numpy es opcional: solo lo necesita el backend columnar
+    np = None
+
+# Campos de RECORD_STRUCT y su dtype, para leer un InsectRecord empaquetado como numpy
+FIELDS = (
+    ("epoch", "<u4"),
+    ("species", "u1"),
+    ("role", "u1"),
+    ("event", "u1"),
+    ("habitat", "u1"),
+    ("age", "u1"),
+    ("impact", "i1"),
+    ("density", "<u2"),
+    ("latitude", "<f4"),
+    ("longitude", "<f4"),
+)
+RECORD_DTYPE = [("id", "V16")] + list(FIELDS) + [("row", "<u8")]
+
+# Columnas que se guardan: solo las que lee eco_density. El resto de consultas se
+# responde con las postings y el ring de ventanas, así que copiar más no aporta nada
+COLUMNS = tuple((name, dtype) for name, dtype in FIELDS if name in ("epoch", "species", "impact", "density"))
+
+
+class ColumnarStore:
+    """Proyección columnar de eco_density: un array numpy por campo de COLUMNS, indexado por fila.
+
+    Las filas llegan en orden creciente y se agregan por lotes (capacidad que se duplica,
+    así que el append es amortizado). Borrar solo apaga la máscara `alive`; recortar el
+    prefijo avanza `start` y los datos se desplazan al inicio cuando falta espacio.
+    """
+
+    def __init__(self, capacity=1 << 16):
+        if np is None:
+            raise ImportError("El backend columnar requiere numpy (pip install numpy)")
+        self.dtype = np.dtype(RECORD_DTYPE)
+        self.capacity = capacity
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS}
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.start = 0          # índice del primer elemento válido
+        self.end = 0            # índice siguiente al último elemento
+        self.base_row = 0       # fila almacenada en `start`
+        self._pending = []      # registros aún no volcados a los arrays
+
+    def __len__(self):
+        return self.end - self.start + len(self._pending)
+
+    def append(self, record):
+        self._pending.append(record)
+        if len(self._pending) >= 4096:
+            self.flush()
+
+    def flush(self):
+        """Vuelca los registros pendientes a las columnas en una sola operación"""
+        if not self._pending:
+            return
+        batch = np.frombuffer(b"".join(self._pending), dtype=self.dtype)
+        self._pending = []
+        n = len(batch)
+        if self.start == self.end:
+            # Almacén vacío: alinear con la primera fila del lote
+            self.start = self.end = 0
+            self.base_row = int(batch["row"][0])
+        self._reserve(n)
+        end = self.end
+        for name, _ in COLUMNS:
+            self.columns[name][end:end + n] = batch[name]
+        self.alive[end:end + n] = True
+        self.end += n
+
+    def _reserve(self, n):
+        if self.end + n <= self.capacity:
+            return
+        used = self.end - self.start
+        capacity = self.capacity
+        # Si el prefijo recortado deja sitio basta con desplazar; si no, duplicar
+        while used + n > capacity * 3 // 4:
+            capacity *= 2
+        for name, dtype in COLUMNS:
+            column = np.zeros(capacity, dtype=dtype)
+            column[:used] = self.columns[name][self.start:self.end]
+            self.columns[name] = column
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:used] = self.alive[self.start:self.end]
+        self.alive = alive
+        self.capacity = capacity
+        self.start, self.end = 0, used
+
+    def _index(self, row):
+        return self.start + row - self.base_row
+
+    def remove(self, row):
+        i = self._index(row)
+        if i >= self.end:
+            self.flush()
+            i = self._index(row)
+        if self.start <= i < self.end:
+            self.alive[i] = False
+
+    def trim_to(self, row_base):
+        """Descarta las filas anteriores a row_base (ya eliminadas del almacén)"""
+        self.flush()
+        drop = min(max(0, row_base - self.base_row), self.end - self.start)
+        self.start += drop
+        self.base_row += drop
+
+    def _view(self, name):
+        return self.columns[name][self.start:self.end]
+
+    def _alive(self):
+        return self.alive[self.start:self.end]
+
+    # Consultas vectorizadas
+    def first_live_rows(self, limit=None):
+        """Filas vivas en orden de llegada (las primeras `limit`)"""
+        self.flush()
+        alive = self._alive()
+        if not limit:
+            idx = np.flatnonzero(alive)
+        else:
+            # Solo se recorre el prefijo necesario, en tramos que se duplican
+            idx, stop = np.flatnonzero(alive[:limit]), limit
+            while len(idx) < limit and stop < len(alive):
+                stop *= 2
+                idx = np.flatnonzero(alive[:stop])
+            idx = idx[:limit]
+        return idx, (idx + self.base_row).tolist()
+
+    def take(self, idx, names):
+        """Valores de varias columnas para los índices relativos dados, como listas Python"""
+        return {name: self._view(name)[idx].tolist() for name in names}
@@ -1,11 +1,8 @@
-import socket
-import pickle
 from pprint import pprint
 
 from numpy.matrixlib.defmatrix import matrix
 from tabulate import tabulate
 
-from bloomfilter import BloomFilter
 from model.MarkovChainAnalysis import MarkovChainAnalysis
 from model.dgim import DGIM
 from model.hyperloglog import HyperLogLog
@@ -16,20 +13,17 @@ from model.random_walk_utils import construir_grafo_desde_eventos
 from collections import Counter
 
 from model.transition_matrix import Matrix_Transition
+from model.protocol import SOCKET_PATH, QueryClient, QueryError
 
-SOCKET_PATH = "/tmp/insect_query_socket"
+# Conexión persistente: todas las consultas del menú reutilizan el mismo socket
+client = QueryClient(SOCKET_PATH)
+
+# Registros por página al recorrer el almacén completo con un cursor
+PAGE_SIZE = 5000
 
 def send_query(query):
     try:
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        sock.connect(SOCKET_PATH)
-        sock.sendall(pickle.dumps(query))
-
-        response = sock.recv(1024000)  # Buffer grande para recibir muchos datos
-        result = pickle.loads(response)
-
-        sock.close()
-        return result
+        return client.request(query)
     except Exception as e:
         return {"status": "error", "message": f"Error de conexión: {e}"}
 
@@ -113,29 +107,18 @@ def query_habitat_event(habitat, event, limit=10):
         print(f"   Tiempo: {insect['eventTime']}")
 
 def query_bloom_filter(window, specie, rol, even):
-    query = {"type": "bloom_filter", "params": {"window": window}}
+    # El consumer mantiene los filtros por ventana: solo se envía la clave a comprobar
+    bf = f"{specie}_{rol}_{even}"
+    query = {"type": "bloom_contains", "params": {"window": window, "keys": [bf]}}
     result = send_query(query)
 
     if result["status"] != "ok":
         print(f"Error: {result.get('message', 'Desconocido')}")
         return
 
-    data = result["data"]
-    print(data)
-    n = int(sum(len(events) for events in data.values()))
-    print(f"Número total de eventos (n): {n}")
-    bloom = BloomFilter(n, 0.03)
-
-    # Añadir datos corregido
-    for (species, role), events in data.items():
-        for event in events:
-            bloom.add(f"{species}_{role}_{event}")
-
-    bf = bloom.bloom_key(specie, rol, even)
     print(bf)
-
-    if bloom.contains(bf):
-        print(f"'{bf}' es posible que esté en el conjunto.")  # Corregido el mensaje
+    if result["data"]["results"][bf]:
+        print(f"'{bf}' es posible que esté en el conjunto.")
     else:
         print(f"'{bf}' definitivamente no está en el conjunto.")
 
@@ -317,31 +300,29 @@ def query_pagerank(window):
         print(f"- {specie}: {weight:.4f}")
 
 def query_mapreduce(map, reduc):
-    query = {"type": "mapreduce"}
-    result = send_query(query)
-
-    if result["status"] != "ok":
-        print(f"Error: {result.get('message', 'Desconocido')}")
-        return
-
-    data = result["data"]
-    # print(data)
+    # Las páginas del cursor van directamente a los workers de mapeo según llegan
     map_red = MapReduce()
-    final_result = map_red.master_controller(data, int(map), int(reduc))
+    try:
+        pages = client.iter_pages("insects", page_size=PAGE_SIZE)
+        final_result = map_red.run_chunks(pages, int(map), int(reduc))
+    except (QueryError, OSError) as e:
+        print(f"Error: {e}")
+        return
     for key, count in final_result.items():
         print(f"{key}: {count}")
 
 
 def query_markov():
-    query = {"type": "markov"}
-    result = send_query(query)
-
-    if result["status"] != "ok":
-        print(f"Error: {result.get('message', 'Desconocido')}")
+    # Solo se guardan los campos que usa el análisis de transiciones de cada página
+    data = {}
+    try:
+        for page in client.iter_pages("insects", page_size=PAGE_SIZE):
+            for insect in page:
+                data[insect["_id"]] = {"eventTime": insect["eventTime"], "event": insect["event"]}
+    except (QueryError, OSError) as e:
+        print(f"Error: {e}")
         return
 
-    data = result["data"]
-
     mark = Matrix_Transition()
     markov_result = mark.analyze_transitions(data, output_format='markov_chain')
     print("\nResultado como Cadena de Markov:")
@@ -362,6 +343,134 @@ def query_markov():
     print("Ergodic States:", results['ergodic_states'])
 
 
+def query_window(window):
+    result = send_query({"type": "window", "params": {"window": window}})
+    if result["status"] != "ok":
+        print(f"Error: {result.get('message', 'Desconocido')}")
+        return
+
+    data = result["data"]
+    print(f"\n===== ÚLTIMOS {data['seconds']} SEGUNDOS =====")
+    print(f"Total de eventos: {sum(data['species'].values())}")
+
+    pair_data = [[species, role, count] for (species, role), count in data["by_species_role"].items()]
+    print(tabulate(pair_data, headers=["Especie", "Rol", "Cantidad"], tablefmt="heavy_outline"))
+
+    event_data = []
+    for event, species_counts in data["events"].items():
+        for species, count in species_counts.items():
+            event_data.append([event, species, count])
+    print(tabulate(event_data, headers=["Evento", "Especie", "Cantidad"], tablefmt="heavy_outline"))
+
+
+def query_filter(criteria, limit=10):
+    result = send_query({"type": "filter", "params": {"criteria": criteria, "limit": limit}})
+    if result["status"] != "ok":
+        print(f"Error: {result.get('message', 'Desconocido')}")
+        return
+
+    data = result["data"]
+    print("\n===== FILTRO MULTI-ATRIBUTO =====")
+    plan_data = [[step["field"], step["value"], step["candidates"]] for step in data["plan"]]
+    print(tabulate(plan_data, headers=["Campo", "Valor", "Candidatos"], tablefmt="heavy_outline"))
+
+    insect_data = [
+        [insect["_id"], insect["insect"]["species"], insect["insect"]["role"],
+         insect["location"]["habitat"], insect["event"], insect["eventTime"]]
+        for insect in data["results"]
+    ]
+    print(tabulate(insect_data, headers=["ID", "Especie", "Rol", "Hábitat", "Evento", "Tiempo"],
+                   tablefmt="heavy_outline"))
+
+
+def query_range(field, low=None, high=None, limit=10):
+    query = {"type": "range", "params": {"field": field, "low": low, "high": high, "limit": limit}}
+    result = send_query(query)
+    if result["status"] != "ok":
+        print(f"Error: {result.get('message', 'Desconocido')}")
+        return
+
+    data = result["data"]
+    low = "-∞" if data["low"] is None else data["low"]
+    high = "∞" if data["high"] is None else data["high"]
+    print(f"\n===== {field.upper()} EN [{low}, {high}] =====")
+    print(f"Registros en el rango: {data['count']}")
+
+    insect_data = [
+        [insect["_id"], insect["insect"]["species"], insect["ecologicalImpact"],
+         insect["populationDensity"], insect["eventTime"]]
+        for insect in data["results"]
+    ]
+    print(tabulate(insect_data, headers=["ID", "Especie", "Impacto", "Densidad", "Tiempo"],
+                   tablefmt="heavy_outline"))
+
+
+def query_history(start, end, criteria, limit=100):
+    query = {"type": "history", "params": {"start": start, "end": end, "criteria": criteria, "limit": limit}}
+    result = send_query(query)
+    if result["status"] != "ok":
+        print(f"Error: {result.get('message', 'Desconocido')}")
+        return
+
+    data = result["data"]
+    stats = data["stats"]
+    print(f"\n===== HISTÓRICO {start} → {end} =====")
+    if stats:
+        print(f"Segmentos: {stats['segments']}, bloques leídos: {stats['blocks'] - stats['blocks_pruned']}"
+              f"/{stats['blocks']}, registros revisados: {stats['scanned']}")
+
+    insect_data = [
+        [insect["_id"], insect["insect"]["species"], insect["insect"]["role"],
+         insect["location"]["habitat"], insect["event"], insect["eventTime"]]
+        for insect in data["results"]
+    ]
+    print(tabulate(insect_data, headers=["ID", "Especie", "Rol", "Hábitat", "Evento", "Tiempo"],
+                   tablefmt="heavy_outline"))
+
+
+def print_metrics():
+    result = send_query({"type": "metrics"})
+    if result["status"] != "ok":
+        print(f"Error: {result.get('message', 'Desconocido')}")
+        return
+
+    metrics = result["data"]
+
+    print("\n===== MÉTRICAS DEL PIPELINE =====")
+    meter_data = [[name, m["total"], f"{m['per_second']:,.1f}"] for name, m in sorted(metrics["meters"].items())]
+    print(tabulate(meter_data, headers=["Contador", "Total", "Por segundo"], tablefmt="heavy_outline"))
+
+    print("\nLatencias (ms):")
+    hist_data = [
+        [name, h["count"], f"{h['mean'] * 1000:.3f}", f"{h['p50'] * 1000:.3f}",
+         f"{h['p95'] * 1000:.3f}", f"{h['p99'] * 1000:.3f}", f"{h['max'] * 1000:.3f}"]
+        for name, h in sorted(metrics["histograms"].items())
+    ]
+    print(tabulate(hist_data, headers=["Métrica", "N", "Media", "p50", "p95", "p99", "Máx"],
+                   tablefmt="heavy_outline"))
+
+    gauges = metrics.get("gauges")
+    if gauges:
+        print("\nColas del pipeline de ingesta:")
+        print(tabulate(sorted(gauges.items()), headers=["Gauge", "Valor"], tablefmt="heavy_outline"))
+
+    print("\nTamaño del almacén:")
+    store_data = []
+    for name, value in metrics["store"].items():
+        if isinstance(value, dict):
+            store_data.extend([f"{name}[{k}]", v] for k, v in value.items())
+        else:
+            store_data.append([name, value])
+    print(tabulate(store_data, headers=["Estructura", "Entradas"], tablefmt="heavy_outline"))
+
+    cache = metrics.get("cache")
+    if cache:
+        print(f"\nCaché de resultados: {cache['entries']} entradas, {cache['hits']} aciertos, "
+              f"{cache['misses']} fallos ({cache['hit_rate']:.1%})")
+        cache_data = [[kind, c["hits"], c["misses"]] for kind, c in cache["by_type"].items()]
+        print(tabulate(cache_data, headers=["Consulta", "Aciertos", "Fallos"], tablefmt="heavy_outline"))
+
+
 def show_menu():
     print("\n===== CLIENTE DE CONSULTA DE INSECTOS =====")
     print("1. Ver estadísticas generales")
@@ -376,6 +485,11 @@ def show_menu():
     print("10. PageRank")
     print("11. MapReduce")
     print("12. Markov Chain")
+    print("13. Métricas del pipeline")
+    print("14. Conteos en ventana arbitraria")
+    print("15. Filtro por especie, rol, hábitat y evento")
+    print("16. Consulta por rango de impacto o densidad")
+    print("17. Consulta histórica (log en disco)")
     print("0. Salir")
 
 
@@ -383,7 +497,7 @@ def show_menu():
 def main():
     while True:
         show_menu()
-        choice = input("\nSelecciona una opción (0-11): ")
+        choice = input("\nSelecciona una opción (0-17): ")
 
         if choice == "0":
             break
@@ -436,6 +550,36 @@ def main():
             query_mapreduce(map, reduc)
         elif choice == "12":
             query_markov()
+        elif choice == "13":
+            print_metrics()
+        elif choice == "14":
+            window = input("Ventana (1min, 5min, 15min, 1hour o segundos, ej. 37s): ")
+            query_window(window)
+        elif choice == "15":
+            print("Deja en blanco los campos que no quieras filtrar.")
+            criteria = {
+                "species": input("Especie (ant, bee, butterfly, spider): ").strip(),
+                "role": input("Rol (worker, queen, soldier, scout): ").strip(),
+                "habitat": input("Hábitat (forest, field, garden, house): ").strip(),
+                "event": input("Evento (birth, death, predator attack): ").strip(),
+            }
+            limit = int(input("Número máximo de resultados: "))
+            query_filter(criteria, limit)
+        elif choice == "16":
+            field = input("Campo (ecologicalImpact, populationDensity): ").strip()
+            low = input("Valor mínimo (vacío = sin límite): ").strip()
+            high = input("Valor máximo (vacío = sin límite): ").strip()
+            limit = int(input("Número máximo de resultados: "))
+            query_range(field, int(low) if low else None, int(high) if high else None, limit)
+        elif choice == "17":
+            start = input("Desde (YYYY-MM-DDTHH:MM:SS): ").strip()
+            end = input("Hasta (YYYY-MM-DDTHH:MM:SS): ").strip()
+            criteria = {
+                "species": input("Especie (vacío = todas): ").strip(),
+                "event": input("Evento (vacío = todos): ").strip(),
+            }
+            limit = int(input("Número máximo de resultados: "))
+            query_history(start, end, criteria, limit)
         else:
             print("Opción no válida. Inténtalo de nuevo.")
 
@@ -1,13 +1,30 @@
-from confluent_kafka import Consumer
-import json
+import asyncio
 import time
 import threading
-import pickle
-import socket
 import os
-from datetime import datetime, timedelta
-from collections import defaultdict
+import argparse
+import multiprocessing
+import queue
+import signal
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from bisect import bisect_right
+from itertools import islice
 from random_walk_utils import construir_grafo_desde_eventos, random_walk_habitat, visualizar_camino
+from eventfile import iter_payloads
+from codec import (SPECIES, ROLES, EVENTS, HABITATS, SPECIES_CODE, ROLE_CODE, EVENT_CODE, HABITAT_CODE,
+                   format_event_time, header_encoding, id_from_bytes, parse_event_time)
+from record import (RECORD_STRUCT, CATEGORY_OFFSETS, InsectRecord, PostingIndex, RangeIndex,
+                    decode_record, intersect_postings)
+from metrics import MetricsRegistry
+from columnar import ColumnarStore
+from snapshot import CursorRegistry, RowLog, StoreSnapshot
+from checkpoint import read_checkpoint, write_checkpoint
+from segmentlog import SegmentLog
+from protocol import SOCKET_PATH, pack_frame, read_frame
+from transport import TopicPartition, create_consumer, create_producer, parse_transport
+from windows import SlidingWindowCounter, TimeOrderedIndex, now_epoch, window_seconds
+from bloomfilter import RotatingBloomFilter
 
 # Configuración del consumidor
 conf = {
@@ -19,421 +36,1411 @@ conf = {
 
 # Estructura de datos para almacenar los insectos
 class InsectDataStore:
-    def __init__(self):
+    # Campos aceptados por query_filter: índice secundario y tabla de códigos
+    FILTER_FIELDS = {
+        "species": ("insects_by_species", SPECIES_CODE),
+        "role": ("insects_by_role", ROLE_CODE),
+        "habitat": ("insects_by_habitat", HABITAT_CODE),
+        "event": ("insects_by_event", EVENT_CODE),
+    }
+
+    # Campos aceptados por query_range y su índice de rango
+    RANGE_FIELDS = {
+        "ecologicalImpact": "insect_by_ecological_impact",
+        "populationDensity": "insect_population_density",
+    }
+
+    def __init__(self, backend="dict", history_dir=None, dedup_horizon=None, dedup_capacity=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend no válido: {backend}. Usar: {', '.join(BACKENDS)}")
+        # Registros compactos (InsectRecord) por _id de 16 bytes y por número de fila.
+        # Las filas crecen de forma monótona; las eliminadas quedan en None hasta que
+        # la limpieza recorta el prefijo. Los bloques de filas se comparten con los
+        # snapshots (copy-on-write) para que las consultas pesadas no tomen el lock.
         self.insects_by_id = {}
-        self.insects_by_species = defaultdict(dict)
-        self.insects_by_role = defaultdict(dict)
-        self.insects_by_habitat = defaultdict(dict)
-        self.insects_by_event = defaultdict(dict)
-        self.insect_by_ecological_impact = defaultdict(dict)
-        self.insect_population_density = defaultdict(dict)
-
-        # Para ventanas de tiempo
-        self.time_windows = {
-            '1min': defaultdict(int),
-            '5min': defaultdict(int),
-            '15min': defaultdict(int),
-            '1hour': defaultdict(int)
-        }
-
-        # Para guardar datos de insectos por ventana de tiempo
-        self.time_windows_data = {
-            '1min': defaultdict(list),
-            '2min': defaultdict(list),
-            '5min': defaultdict(list),
-        }
-
-        # Datos para análisis de tendencias
-        self.event_trends = {window: defaultdict(lambda: defaultdict(int)) for window in self.time_windows.keys()}
-        self.species_trends = {window: defaultdict(int) for window in self.time_windows.keys()}
+        self.rows = RowLog()
+        self.version = 0
+        self._snapshot = None
+
+        # Índices secundarios: valor -> filas, con conteos exactos por valor
+        self.insects_by_species = PostingIndex()
+        self.insects_by_role = PostingIndex()
+        self.insects_by_habitat = PostingIndex()
+        self.insects_by_event = PostingIndex()
+
+        # Índices de rango (valores ordenados) para consultas por umbral
+        self.insect_by_ecological_impact = RangeIndex()
+        self.insect_population_density = RangeIndex()
+
+        # Ventanas de tiempo: buckets por segundo de la última hora con conteos por
+        # (especie, rol, evento); de ahí salen los conteos, tendencias y datos por ventana
+        self.windows = SlidingWindowCounter(horizon=3600)
+
+        # Filtros de Bloom de claves especie_rol_evento por minuto del evento, en el mismo
+        # horizonte; bloom_contains une las generaciones de la ventana pedida
+        self.bloom = RotatingBloomFilter(len(SPECIES) * len(ROLES) * len(EVENTS), BLOOM_ERROR_RATE,
+                                         slice_seconds=60, horizon=3600)
+        self._bloom_keys = {}
+
+        # Deduplicación por _id: un _id aún en memoria se reconoce por insects_by_id; los que
+        # la limpieza ya eliminó se recuerdan en filtros de Bloom rotatorios (memoria fija)
+        # hasta que su eventTime supera `dedup_horizon` segundos. None = DEDUP_HORIZON,
+        # 0 = sin deduplicación (un _id repetido reemplaza al registro anterior).
+        # `dedup_capacity` son los _id eliminados por franja de 10 minutos de eventTime que
+        # cada filtro admite; una franja que la supera deja de marcar duplicados
+        self.dedup_horizon = DEDUP_HORIZON if dedup_horizon is None else dedup_horizon
+        dedup_capacity = DEDUP_CAPACITY if dedup_capacity is None else dedup_capacity
+        if dedup_capacity < 1:
+            raise ValueError(f"Capacidad de deduplicación no válida: {dedup_capacity}. Debe ser mayor que 0")
+        self.expired_ids = RotatingBloomFilter(dedup_capacity, DEDUP_ERROR_RATE,
+                                               slice_seconds=600,
+                                               horizon=self.dedup_horizon,
+                                               track_keys=False) if self.dedup_horizon else None
+        self._cleanup_cutoff = None  # eventTime por debajo del cual la limpieza pudo eliminar registros
+
+        # Índice de registros ordenado por tiempo para expirar y leer eventos recientes
+        self.time_index = TimeOrderedIndex()
+
+        # Backend columnar opcional (numpy): proyección de los campos de eco_density
+        self.columns = ColumnarStore() if backend == "columnar" else None
+
+        # Log histórico en disco (opcional): todo lo ingerido, más allá de la limpieza
+        self.history = SegmentLog(history_dir) if history_dir else None
 
         # Lock para escritura segura en la estructura de datos
         self.lock = threading.RLock()
 
-    def add_insect(self, insect_data):
-        """Añadir un insecto al almacén de datos con seguridad para concurrencia"""
-        with self.lock:
-            insect_id = insect_data["_id"]
-            species = insect_data["insect"]["species"]
-            role = insect_data["insect"]["role"]
-            habitat = insect_data["location"]["habitat"]
-            event = insect_data["event"]
-            event_time = datetime.strptime(insect_data["eventTime"].split()[0], "%Y-%m-%dT%H:%M:%S")
-            ecological_impact = insect_data["ecologicalImpact"]
-            population_density = insect_data["populationDensity"]
-
-            # Actualizar tablas hash principales
-            self.insects_by_id[insect_id] = insect_data
-            self.insects_by_species[species][insect_id] = insect_data
-            self.insects_by_role[role][insect_id] = insect_data
-            self.insects_by_habitat[habitat][insect_id] = insect_data
-            self.insects_by_event[event][insect_id] = insect_data
-            self.insect_by_ecological_impact[ecological_impact][insect_id] = insect_data
-            self.insect_population_density[population_density][insect_id] = insect_data
-
-            # Actualizar ventanas de tiempo
-            self._update_time_windows(species, role, event, event_time, habitat)
-
-    def _update_time_windows(self, species, role, event, event_time, habitat):
-        """Actualiza los contadores de las ventanas de tiempo"""
-        now = datetime.now()
-
-        # Solo procesar eventos dentro de la última hora
-        if now - event_time > timedelta(hours=1):
-            return
-
-        # Actualizar contadores para cada ventana de tiempo
-        if now - event_time <= timedelta(minutes=1):
-            self.time_windows['1min'][(species, role)] += 1
-            self.event_trends['1min'][event][species] += 1
-            self.species_trends['1min'][species] += 1
-            self.time_windows_data['1min'][(species, role)].append(event)
-
-        if now - event_time <= timedelta(minutes=2):
-            self.time_windows_data['2min'][(species, role)].append(event)
+        # Métricas de ingesta, limpieza y consultas
+        self.metrics = MetricsRegistry()
 
+    def _secondary_indexes(self):
+        return (self.insects_by_species, self.insects_by_role, self.insects_by_habitat,
+                self.insects_by_event, self.insect_by_ecological_impact, self.insect_population_density)
 
-        if now - event_time <= timedelta(minutes=5):
-            self.time_windows['5min'][(species, role)] += 1
-            self.event_trends['5min'][event][species] += 1
-            self.species_trends['5min'][species] += 1
-            self.time_windows_data['5min'][(species, role)].append(event)
-
-        if now - event_time <= timedelta(minutes=15):
-            self.time_windows['15min'][(species, role)] += 1
-            self.event_trends['15min'][event][species] += 1
-            self.species_trends['15min'][species] += 1
-
-        if now - event_time <= timedelta(hours=1):
-            self.time_windows['1hour'][(species, role)] += 1
-            self.event_trends['1hour'][event][species] += 1
-            self.species_trends['1hour'][species] += 1
+    def add_insect(self, insect_data):
+        """Añadir un insecto (dict o InsectRecord) al almacén con seguridad para concurrencia"""
+        with self.lock:
+            record = self._add_insect_locked(insect_data, now_epoch())
+            if record is None:
+                self.metrics.mark("ingest.duplicates")
+            elif self.history is not None:
+                self.history.append_many([record])
+
+    def add_insects(self, batch, log_history=True):
+        """Añadir un lote de insectos adquiriendo el lock una sola vez"""
+        now = now_epoch()
+        added = 0
+        duplicates = 0
+        records = []
+        wait_started = time.perf_counter()
+        with self.lock, self.metrics.timer("ingest.add_insects"):
+            self.metrics.observe("ingest.lock_wait", time.perf_counter() - wait_started)
+            for insect_data in batch:
+                try:
+                    record = self._add_insect_locked(insect_data, now)
+                except (KeyError, TypeError, ValueError) as e:
+                    # Un evento malformado no debe descartar el resto del lote
+                    print(f"Error al procesar mensaje: {e}")
+                    continue
+                if record is None:
+                    duplicates += 1
+                else:
+                    records.append(record)
+                    added += 1
+            if duplicates:
+                self.metrics.mark("ingest.duplicates", duplicates)
+            if log_history and self.history is not None:
+                with self.metrics.timer("ingest.history"):
+                    self.history.append_many(records)
+        return added
+
+    def _add_insect_locked(self, insect_data, now):
+        """Indexa un registro y lo devuelve; None si es un duplicado descartado"""
+        row = self.rows.end
+        if isinstance(insect_data, InsectRecord):
+            record = insect_data
+        else:
+            record = InsectRecord.from_event(insect_data, row)
+        if self.dedup_horizon and self._is_duplicate(record, now):
+            return None
+        if record is insect_data:
+            record = insect_data.with_row(row)
+        (insect_id, event_time, species, role, event, habitat, _, ecological_impact,
+         population_density, _, _, _) = RECORD_STRUCT.unpack(record)
+
+        # Sin deduplicación, un _id repetido reemplaza al registro anterior en todos los índices
+        previous = self.insects_by_id.get(insect_id)
+        if previous is not None:
+            self._remove_record(previous)
+
+        # Actualizar tabla principal e índices secundarios
+        self.insects_by_id[insect_id] = record
+        self.rows.append(record)
+        self.version += 1
+        self.insects_by_species.add(species, row)
+        self.insects_by_role.add(role, row)
+        self.insects_by_habitat.add(habitat, row)
+        self.insects_by_event.add(event, row)
+        self.insect_by_ecological_impact.add(ecological_impact, row)
+        self.insect_population_density.add(population_density, row)
+        self.time_index.add(event_time, record)
+        if self.columns is not None:
+            self.columns.append(record)
+
+        # Actualizar ventanas de tiempo
+        self._update_time_windows(species, role, event, event_time, habitat, now)
+        return record
+
+    def _is_duplicate(self, record, now):
+        if record[:16] in self.insects_by_id:
+            return True
+        # Solo un evento anterior al corte de la última limpieza pudo haberse eliminado ya
+        cutoff = self._cleanup_cutoff
+        return cutoff is not None and record.epoch < cutoff and self.expired_ids.contains(record[:16], now)
+
+    def _remove_record(self, record):
+        """Quita un registro de la tabla principal y descuenta todos sus índices"""
+        (insect_id, _, species, role, event, habitat, _, ecological_impact,
+         population_density, _, _, row) = RECORD_STRUCT.unpack(record)
+        del self.insects_by_id[insect_id]
+        self.rows.clear(row)
+        self.version += 1
+        self.insects_by_species.remove(species)
+        self.insects_by_role.remove(role)
+        self.insects_by_habitat.remove(habitat)
+        self.insects_by_event.remove(event)
+        self.insect_by_ecological_impact.remove(ecological_impact)
+        self.insect_population_density.remove(population_density)
+        if self.columns is not None:
+            self.columns.remove(row)
+
+    def _record_at(self, row):
+        """Registro vivo de una fila, o None si ya se eliminó"""
+        return self.rows.get(row)
+
+    def _is_live(self, row):
+        return self._record_at(row) is not None
+
+    def _is_current(self, record):
+        return self.insects_by_id.get(record[:16]) is record
+
+    def _update_time_windows(self, species, role, event, event_time, habitat, now=None):
+        """Actualiza el bucket del segundo del evento (eventos de más de una hora se ignoran)"""
+        codes = (species, role, event)
+        self.windows.add(event_time, codes, now=now)
+        key = self._bloom_keys.get(codes)
+        if key is None:
+            key = self._bloom_keys[codes] = f"{SPECIES[species]}_{ROLES[role]}_{EVENTS[event]}"
+        self.bloom.add(event_time, key, now_epoch() if now is None else now)
 
     def clean_window(self, window: str):
-        if window in self.time_windows_data:
-            self.time_windows_data[window].clear()
-            return window
-        else:
-            raise ValueError(f"Ventana no válida: {window}. Debe ser '1min', '2min' o '5min'.")
+        """Se mantiene por compatibilidad: el ring buffer expira los segundos por sí solo"""
+        window_seconds(window)
+        return window
 
     def clean_old_data(self, max_age_hours=2):
         """Elimina datos más antiguos que el límite especificado"""
-        with self.lock:
-            now = datetime.now()
-            to_remove = []
-
-            for insect_id, data in self.insects_by_id.items():
-                event_time = datetime.strptime(data["eventTime"].split()[0], "%Y-%m-%dT%H:%M:%S")
-                if now - event_time > timedelta(hours=max_age_hours):
-                    to_remove.append(insect_id)
-
-            # Eliminar registros antiguos
-            for insect_id in to_remove:
-                data = self.insects_by_id[insect_id]
-                species = data["insect"]["species"]
-                role = data["insect"]["role"]
-                habitat = data["location"]["habitat"]
-                event = data["event"]
-
-                del self.insects_by_id[insect_id]
-                if insect_id in self.insects_by_species[species]:
-                    del self.insects_by_species[species][insect_id]
-                if insect_id in self.insects_by_role[role]:
-                    del self.insects_by_role[role][insect_id]
-                if insect_id in self.insects_by_habitat[habitat]:
-                    del self.insects_by_habitat[habitat][insect_id]
-                if insect_id in self.insects_by_event[event]:
-                    del self.insects_by_event[event][insect_id]
-
-            return len(to_remove)
+        with self.lock, self.metrics.timer("cleanup.old_data"):
+            now = now_epoch()
+            cutoff = now - int(max_age_hours * 3600)
+            removed = 0
+
+            # Solo se recorren las entradas expiradas, del extremo antiguo del índice
+            for record in self.time_index.pop_older_than(cutoff):
+                if self._is_current(record):
+                    self._remove_record(record)
+                    removed += 1
+                    if self.expired_ids is not None:
+                        self.expired_ids.add(record.epoch, record[:16], now)
+            if self.expired_ids is not None:
+                self._cleanup_cutoff = max(cutoff, self._cleanup_cutoff or cutoff)
+
+            # Recortar el prefijo de filas eliminadas y compactar los índices secundarios
+            row_base = self.rows.trim()
+            for index in self._secondary_indexes():
+                index.compact(self._is_live, row_base)
+            if self.columns is not None:
+                self.columns.trim_to(row_base)
+
+            return removed
+
+    def _records_for(self, index, value, limit=None, predicate=None):
+        """Registros vivos de un índice secundario, en orden de llegada"""
+        results = []
+        for row in index.rows(value):
+            record = self._record_at(row)
+            if record is None or (predicate and not predicate(record)):
+                continue
+            results.append(record)
+            if limit and len(results) >= limit:
+                break
+        return results
 
     # Métodos de consulta
     def get_stats(self):
         """Obtiene estadísticas generales"""
+        # Los conteos por categoría salen de las postings y las ventanas del ring en ambos
+        # backends: escanear las columnas bajo el lock costaba O(N) (~35 ms con 1M filas)
         with self.lock:
             stats = {
                 "total_insects": len(self.insects_by_id),
-                "by_species": {species: len(insects) for species, insects in self.insects_by_species.items()},
-                "by_role": {role: len(insects) for role, insects in self.insects_by_role.items()},
-                "by_habitat": {habitat: len(insects) for habitat, insects in self.insects_by_habitat.items()},
-                "by_event": {event: len(insects) for event, insects in self.insects_by_event.items()},
-                "time_windows": {
-                    window: dict(counts) for window, counts in self.time_windows.items()
-                },
-                "trends": {
-                    "events": {window: dict(events) for window, events in self.event_trends.items()},
-                    "species": {window: dict(species) for window, species in self.species_trends.items()}
-                }
+                "by_species": {SPECIES[c]: n for c, n in self.insects_by_species.items_counts().items()},
+                "by_role": {ROLES[c]: n for c, n in self.insects_by_role.items_counts().items()},
+                "by_habitat": {HABITATS[c]: n for c, n in self.insects_by_habitat.items_counts().items()},
+                "by_event": {EVENTS[c]: n for c, n in self.insects_by_event.items_counts().items()},
+                **self._window_views(STATS_WINDOWS)
             }
             return stats
 
+    def _window_views(self, windows):
+        """Conteos por (especie, rol), tendencias de eventos y de especies para cada ventana"""
+        seconds = {name: window_seconds(name) for name in windows}
+        counts = self._window_code_counts(list(seconds.values()))
+
+        time_windows, event_trends, species_trends = {}, {}, {}
+        for name, secs in seconds.items():
+            by_pair = defaultdict(int)
+            by_event = defaultdict(lambda: defaultdict(int))
+            by_species = defaultdict(int)
+            for (s, r, e), n in counts[secs].items():
+                species, role, event = SPECIES[s], ROLES[r], EVENTS[e]
+                by_pair[(species, role)] += n
+                by_event[event][species] += n
+                by_species[species] += n
+            time_windows[name] = dict(by_pair)
+            event_trends[name] = {event: dict(c) for event, c in by_event.items()}
+            species_trends[name] = dict(by_species)
+
+        return {
+            "time_windows": time_windows,
+            "trends": {"events": event_trends, "species": species_trends}
+        }
+
+    def _window_code_counts(self, seconds):
+        """{segundos: Counter((código especie, rol, evento) -> n)} desde el ring de buckets"""
+        with self.lock:
+            return self.windows.counts_multi(seconds)
+
+    def window_counts(self, window):
+        """Conteos de una ventana arbitraria (ej. '37s' o 37) en O(segundos de la ventana)"""
+        views = self._window_views([window])
+        return {
+            "window": window,
+            "seconds": window_seconds(window),
+            "by_species_role": views["time_windows"][window],
+            "events": views["trends"]["events"][window],
+            "species": views["trends"]["species"][window],
+        }
+
     def query_by_species(self, species, limit=10):
         """Consulta insectos por especie"""
-        with self.lock:
-            if species in self.insects_by_species:
-                insects = list(self.insects_by_species[species].values())
-                return insects[:limit] if limit else insects
+        if species not in SPECIES_CODE:
             return []
+        with self.lock:
+            records = self._records_for(self.insects_by_species, SPECIES_CODE[species], limit)
+        return [record.to_dict() for record in records]
 
     def query_by_habitat_and_event(self, habitat, event, limit=10):
         """Consulta insectos por hábitat y evento"""
-        with self.lock:
-            results = []
-            if habitat in self.insects_by_habitat:
-                for insect_data in self.insects_by_habitat[habitat].values():
-                    if insect_data["event"] == event:
-                        results.append(insect_data)
-                        if limit and len(results) >= limit:
-                            break
-            return results
+        return self.query_filter({"habitat": habitat, "event": event}, limit)["results"]
 
-    def cantidad(self, window):
+    def plan_filter(self, criteria):
+        """Plan de un filtro multi-atributo: los índices de menor a mayor número de filas vivas.
+
+        Los criterios vacíos o None se ignoran; un valor sin código deja el plan con 0 filas.
+        """
+        plan = []
+        for field, value in criteria.items():
+            if value is None or value == "":
+                continue
+            if field not in self.FILTER_FIELDS:
+                raise ValueError(f"Campo de filtro no válido: {field}. Usar: {', '.join(self.FILTER_FIELDS)}")
+            attr, codes = self.FILTER_FIELDS[field]
+            index = getattr(self, attr)
+            code = codes.get(value)
+            plan.append({
+                "field": field,
+                "value": value,
+                "candidates": index.count(code) if code is not None else 0,
+                "index": index,
+                "code": code,
+            })
+        plan.sort(key=lambda step: step["candidates"])
+        return plan
+
+    def query_filter(self, criteria, limit=10):
+        """Filtro por especie, rol, hábitat y evento combinados.
+
+        Intersecta las listas de filas de los índices empezando por la más selectiva y se
+        detiene al llegar a `limit`. Devuelve los resultados y el plan usado.
+        """
+        plan, records = self.filter_records(criteria, limit)
+        return {
+            "plan": [{k: step[k] for k in ("field", "value", "candidates")} for step in plan],
+            "results": [record.to_dict() for record in records],
+        }
+
+    def filter_records(self, criteria, limit=None):
+        """(plan, registros) de query_filter, sin convertir a dict"""
         with self.lock:
-            if window not in self.time_windows_data:
-                raise ValueError("Ventana no válida. Usar: '1min', '2min', '5min'")
+            plan = self.plan_filter(criteria)
+            if not plan:
+                records = list(islice(self.insects_by_id.values(), limit or None))
+            elif plan[0]["candidates"] == 0:
+                records = []
+            elif len(plan) == 1:
+                records = self._records_for(plan[0]["index"], plan[0]["code"], limit)
             else:
-                especies = set()
-                for (species, _), eventos in self.time_windows_data[window].items():
-                    especies.add(species)
-                return {esp: 1 for esp in especies}
+                rows = intersect_postings([step["index"].rows(step["code"]) for step in plan],
+                                          limit, self._is_live)
+                records = [self._record_at(row) for row in rows]
+        return plan, records
+
+    def query_range(self, field, low=None, high=None, limit=10):
+        """Insectos con ecologicalImpact o populationDensity en [low, high] (extremos opcionales).
+
+        Devuelve el total de registros vivos en el rango y los primeros `limit`, ordenados
+        por valor.
+        """
+        if field not in self.RANGE_FIELDS:
+            raise ValueError(f"Campo de rango no válido: {field}. Usar: {', '.join(self.RANGE_FIELDS)}")
+        index = getattr(self, self.RANGE_FIELDS[field])
+        with self.lock:
+            count = index.count_between(low, high)
+            rows = index.rows_between(low, high, self._is_live, limit)
+            records = [self._record_at(row) for row in rows]
+        return {
+            "field": field,
+            "low": low,
+            "high": high,
+            "count": count,
+            "results": [record.to_dict() for record in records],
+        }
+
+    def query_history(self, start, end, criteria=None, limit=100):
+        """Eventos del log en disco con eventTime en [start, end], sin límite de antigüedad.
+
+        `start` y `end` son epoch o cadenas '%Y-%m-%dT%H:%M:%S'; `criteria` filtra por
+        especie, rol, hábitat y evento como en query_filter.
+        """
+        start, end, records, stats = self.history_records(start, end, criteria, limit)
+        return {"start": start, "end": end, "stats": stats, "results": [r.to_dict() for r in records]}
+
+    def history_records(self, start, end, criteria=None, limit=None):
+        """(inicio, fin, registros, estadísticas) de query_history, sin convertir a dict"""
+        start, end = self._history_bounds(start, end)
+        predicate, matchable = self._category_predicate(criteria)
+        if not matchable:
+            return start, end, [], {}
+
+        # La lectura va por mmap sobre los segmentos, sin tomar el lock del almacén
+        records, stats = self.history.query(start, end, predicate, limit)
+        return start, end, records, stats
+
+    def _history_bounds(self, start, end):
+        if self.history is None:
+            raise ValueError("El log histórico no está activado (arrancar el consumer con --history)")
+        start = parse_event_time(start) if isinstance(start, str) else int(start)
+        end = parse_event_time(end) if isinstance(end, str) else int(end)
+        return start, end
+
+    def _category_predicate(self, criteria):
+        """(predicado sobre los códigos del registro o None, si algún registro puede cumplirlo)"""
+        codes = []
+        for field, value in (criteria or {}).items():
+            if value is None or value == "":
+                continue
+            if field not in self.FILTER_FIELDS:
+                raise ValueError(f"Campo de filtro no válido: {field}. Usar: {', '.join(self.FILTER_FIELDS)}")
+            code = self.FILTER_FIELDS[field][1].get(value)
+            if code is None:
+                return None, False
+            codes.append((CATEGORY_OFFSETS[field], code))
+        predicate = (lambda record: all(record[offset] == code for offset, code in codes)) if codes else None
+        return predicate, True
+
+    def _range_records(self, index, low, high, chunk=4096):
+        """Registros vivos con valor en [low, high], por valor y llegada, leídos por tramos.
+
+        El lock solo se toma para copiar cada tramo; la posición dentro de cada valor es la
+        última fila leída, que sigue siendo válida aunque la limpieza compacte la lista.
+        """
+        with self.lock:
+            values = index.values_between(low, high)
+        for value in values:
+            after = -1
+            while True:
+                with self.lock:
+                    postings = index.postings.get(value)
+                    if postings is None:
+                        break
+                    first = bisect_right(postings, after)
+                    rows = postings[first:first + chunk]
+                    records = [record for record in map(self._record_at, rows) if record is not None]
+                yield from records
+                if len(rows) < chunk:
+                    break
+                after = rows[-1]
+
+    def cursor_records(self, source, params):
+        """Registros en orden estable y total de una fuente paginable por cursor.
+
+        'insects' recorre el snapshot actual (todo el almacén vivo). 'filter', 'history' y
+        'range' aceptan los mismos parámetros que query_filter, query_history y query_range,
+        con límite opcional; se leen a medida que se piden páginas (filter sobre el
+        snapshot, history por mmap, range por tramos del índice), así que su total es None.
+        """
+        if source == "insects":
+            snapshot = self.snapshot()
+            return snapshot.records(), len(snapshot)
+        if source == "filter":
+            predicate, matchable = self._category_predicate(params.get("criteria", {}))
+            records = self.snapshot().records() if matchable else iter(())
+            if predicate is not None:
+                records = filter(predicate, records)
+        elif source == "history":
+            start, end = self._history_bounds(params["start"], params["end"])
+            predicate, matchable = self._category_predicate(params.get("criteria"))
+            records = self.history.scan(start, end, predicate) if matchable else iter(())
+        elif source == "range":
+            field = params["field"]
+            if field not in self.RANGE_FIELDS:
+                raise ValueError(f"Campo de rango no válido: {field}. Usar: {', '.join(self.RANGE_FIELDS)}")
+            records = self._range_records(getattr(self, self.RANGE_FIELDS[field]), params.get("low"),
+                                          params.get("high"))
+        else:
+            raise ValueError(f"Fuente de cursor no válida: {source}. Usar: {', '.join(CURSOR_SOURCES)}")
+        limit = params.get("limit")
+        return (islice(records, limit) if limit else records), None
+
+    def cantidad(self, window):
+        especies = {species for (species, _) in self.get_insects_in_time_window(window)}
+        return {esp: 1 for esp in especies}
 
     def get_insects_in_time_window(self, window):
+        """Eventos de la ventana agrupados por (especie, rol), reconstruidos desde los buckets"""
+        seconds = window_seconds(window)
+        counts = self._window_code_counts([seconds])[seconds]
+        data = defaultdict(list)
+        for (species, role, event), n in counts.items():
+            data[(SPECIES[species], ROLES[role])].extend([EVENTS[event]] * n)
+        return data
+
+    def bloom_contains(self, window, keys):
+        """Pertenencia aproximada de varias claves 'especie_rol_evento' a una ventana.
+
+        Un False es seguro; un True puede ser un falso positivo (tasa BLOOM_ERROR_RATE). La
+        ventana se redondea a minutos completos.
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        seconds = window_seconds(window)
         with self.lock:
-            if window not in self.time_windows_data:
-                raise ValueError("Ventana no válida. Usar: '1min', '2min', '5min'")
-            else:
-                return self.time_windows_data[window]
+            bloom = self.bloom.window(seconds, now_epoch())
+        return {"window": window, "seconds": seconds, "results": dict(zip(keys, bloom.contains_many(keys)))}
 
     def eventos_recientes(self, window_seconds=300):
         """ Devuelve eventos de los últimos X segundos """
-        now = datetime.now()
-        recientes = []
+        cutoff = now_epoch() - window_seconds
+        with self.lock:
+            records = [r for r in self.time_index.newer_than(cutoff) if self._is_current(r)]
+        return [record.to_dict() for record in records]
+
+    def snapshot(self):
+        """Vista consistente de los registros vivos que se lee sin bloquear la ingesta.
+
+        Se publica como mucho un snapshot por versión del almacén; publicarlo solo copia
+        la lista de bloques de filas bajo el lock.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
         with self.lock:
-            for data in self.insects_by_id.values():
-                t_evt = datetime.strptime(data["eventTime"].split()[0], "%Y-%m-%dT%H:%M:%S")
-                if (now - t_evt).total_seconds() <= window_seconds:
-                    recientes.append(data)
-        return recientes
+            snapshot = StoreSnapshot(self.version, len(self.insects_by_id), *self.rows.freeze())
+            self._snapshot = snapshot
+        self.metrics.mark("snapshot.published")
+        return snapshot
 
     def get_insects(self):
-        with self.lock:
-            return self.insects_by_id.copy()
+        # El recorrido y la conversión a dict se hacen sobre el snapshot, fuera del lock
+        return self.snapshot().get_insects()
 
     def query_ecological_impact_and_density(self, limit=10):
         """Consulta insectos con su ecologicalImpact y populationDensity"""
+        if self.columns is not None:
+            return self._eco_density_columnar(limit)
+
+        results = []
+        for record in self.snapshot().records():
+            (insect_id, epoch, species, _, _, _, _, ecological_impact,
+             population_density, _, _, _) = RECORD_STRUCT.unpack(record)
+            result = {
+                "id": id_from_bytes(insect_id),
+                "ecologicalImpact": ecological_impact,
+                "populationDensity": population_density,
+                "species": SPECIES[species],
+                "eventTime": format_event_time(epoch)
+            }
+            results.append(result)
+            if limit and len(results) >= limit:
+                break
+        return results
+
+    def _eco_density_columnar(self, limit):
         with self.lock:
-            results = []
-            for insect_id, data in self.insects_by_id.items():
-                result = {
-                    "id": insect_id,
-                    "ecologicalImpact": data["ecologicalImpact"],
-                    "populationDensity": data["populationDensity"],
-                    "species": data["insect"]["species"],
-                    "eventTime": data["eventTime"]
-                }
-                results.append(result)
-                if limit and len(results) >= limit:
-                    break
-            return results
+            idx, rows = self.columns.first_live_rows(limit)
+            values = self.columns.take(idx, ("impact", "density", "species", "epoch"))
+            ids = [self.rows.get(row)[:16] for row in rows]
+        return [
+            {
+                "id": id_from_bytes(insect_id),
+                "ecologicalImpact": impact,
+                "populationDensity": density,
+                "species": SPECIES[species],
+                "eventTime": format_event_time(epoch)
+            }
+            for insect_id, impact, density, species, epoch in zip(
+                ids, values["impact"], values["density"], values["species"], values["epoch"])
+        ]
+
+    def get_store_sizes(self):
+        """Tamaño de las tablas e índices del almacén"""
+        with self.lock:
+            return {
+                "insects_by_id": len(self.insects_by_id),
+                "rows": len(self.rows),
+                "row_chunks": len(self.rows.chunks),
+                "snapshot_version": self._snapshot.version if self._snapshot is not None else 0,
+                "open_cursors": len(cursors),
+                "species_entries": self.insects_by_species.entries(),
+                "role_entries": self.insects_by_role.entries(),
+                "habitat_entries": self.insects_by_habitat.entries(),
+                "event_entries": self.insects_by_event.entries(),
+                "ecological_impact_entries": self.insect_by_ecological_impact.entries(),
+                "population_density_entries": self.insect_population_density.entries(),
+                "time_index": len(self.time_index),
+                "columnar_rows": len(self.columns) if self.columns is not None else 0,
+                "window_ring": self.windows.occupancy(),
+                "bloom_generations": self.bloom.generations(),
+                "dedup_generations": self.expired_ids.generations() if self.expired_ids is not None else 0,
+                "dedup_saturated": self.expired_ids.saturated() if self.expired_ids is not None else 0,
+            }
+
+    def get_metrics(self):
+        """Métricas del pipeline junto con el tamaño actual del almacén"""
+        metrics = self.metrics.snapshot()
+        metrics["store"] = self.get_store_sizes()
+        metrics["cache"] = result_cache.stats()
+        return metrics
+
+# Backends disponibles para InsectDataStore
+BACKENDS = ("dict", "columnar")
+
+# Fuentes de registros que se pueden recorrer con un cursor
+CURSOR_SOURCES = ("insects", "filter", "history", "range")
+PAGE_SIZE = 5000
+
+# Ventanas que se reportan en get_stats
+STATS_WINDOWS = ('1min', '5min', '15min', '1hour')
 
-# Crear el almacén de datos
+# Tasa de falsos positivos de los filtros de Bloom por ventana
+BLOOM_ERROR_RATE = 0.01
+
+# Deduplicación por _id: segundos de eventTime durante los que se reconoce un _id repetido
+# (más allá de la retención de clean_old_data), _ids esperados por franja de 10 minutos y
+# tasa de falsos positivos de los filtros de los _id ya eliminados. Cada filtro ocupa unos
+# 1.8 bytes por _id de capacidad: 1M cubre ~1.700 eventos/s; a 100k eventos/s hacen falta 60M
+DEDUP_HORIZON = 6 * 3600
+DEDUP_CAPACITY = 1000000
+DEDUP_ERROR_RATE = 0.001
+
+# Crear el almacén de datos (el backend se puede cambiar con --backend)
 data_store = InsectDataStore()
 
-# Socket para comunicación entre procesos
-SOCKET_PATH = "/tmp/insect_query_socket"
+# Consultas que recorren todo el almacén o el disco: van a un pool aparte para no
+# dejar sin hilos a las consultas ligeras
+HEAVY_QUERIES = {"mapreduce", "markov", "random_walk", "history", "cursor_open"}
+
+# Cursores abiertos por los clientes para recibir resultados grandes por páginas
+cursors = CursorRegistry()
 
-# Asegurarse de que el socket no exista previamente
-try:
-    os.unlink(SOCKET_PATH)
-except OSError:
-    if os.path.exists(SOCKET_PATH):
-        raise
 
-# Función para gestionar consultas remotas
-def handle_query_client(conn, data_store):
+def _cursor_page(cursor_id, cursor, page_size):
+    # El lock del cursor evita que dos peticiones pipelined se repartan la misma página
+    with cursor.lock:
+        page = [record.to_dict() for record in cursor.next_page(page_size)]
+        done = cursor.done
+        position = cursor.position
+    if done:
+        cursors.close(cursor_id)
+    return {"cursor": cursor_id, "total": cursor.total, "position": position, "done": done, "data": page}
+
+
+def random_walk_response(eventos, start, steps):
+    """Camino aleatorio por el grafo de hábitats construido con los eventos recientes"""
+    if not eventos:
+        return {"status": "error", "message": "No hay eventos en la ventana"}
+
+    G = construir_grafo_desde_eventos(eventos)
+    print(" Eventos recibidos:", len(eventos))
+    print(" Nodos del grafo:", list(G.nodes()))
+    print(" Aristas del grafo:", list(G.edges()))
+
     try:
-        while True:
-            data = conn.recv(4096)
-            if not data:
-                break
+        camino = random_walk_habitat(G, start, steps)
+        return {"status": "ok", "data": camino}
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
 
-            query = pickle.loads(data)
-            response = {"status": "error", "message": "Query not recognized"}
-
-            if query["type"] == "stats":
-                response = {"status": "ok", "data": data_store.get_stats()}
-            elif query["type"] == "species":
-                species = query["params"]["species"]
-                limit = query["params"].get("limit", 10)
-                insects = data_store.query_by_species(species, limit)
-                response = {"status": "ok", "data": insects}
-            elif query["type"] == "habitat_event":
-                habitat = query["params"]["habitat"]
-                event = query["params"]["event"]
-                limit = query["params"].get("limit", 10)
-                insects = data_store.query_by_habitat_and_event(habitat, event, limit)
-                response = {"status": "ok", "data": insects}
-            elif query["type"] == "bloom_filter":
-                window = query["params"]["window"]
-                data = data_store.get_insects_in_time_window(window)
+
+# Función para resolver una consulta (se ejecuta en un hilo del executor)
+def dispatch_query(query, data_store):
+    try:
+        response = {"status": "error", "message": "Query not recognized"}
+
+        if query["type"] == "stats":
+            response = {"status": "ok", "data": data_store.get_stats()}
+        elif query["type"] == "species":
+            species = query["params"]["species"]
+            limit = query["params"].get("limit", 10)
+            insects = data_store.query_by_species(species, limit)
+            response = {"status": "ok", "data": insects}
+        elif query["type"] == "habitat_event":
+            habitat = query["params"]["habitat"]
+            event = query["params"]["event"]
+            limit = query["params"].get("limit", 10)
+            insects = data_store.query_by_habitat_and_event(habitat, event, limit)
+            response = {"status": "ok", "data": insects}
+        elif query["type"] == "filter":
+            criteria = query["params"].get("criteria", {})
+            limit = query["params"].get("limit", 10)
+            try:
+                response = {"status": "ok", "data": data_store.query_filter(criteria, limit)}
+            except ValueError as e:
+                response = {"status": "error", "message": str(e)}
+        elif query["type"] == "range":
+            params = query["params"]
+            try:
+                data = data_store.query_range(params["field"], params.get("low"), params.get("high"),
+                                              params.get("limit", 10))
                 response = {"status": "ok", "data": data}
-            elif query["type"] == "minwise":
-                window = query["params"]["window"]
-                data = data_store.get_insects_in_time_window(window)
+            except ValueError as e:
+                response = {"status": "error", "message": str(e)}
+        elif query["type"] == "history":
+            params = query["params"]
+            try:
+                data = data_store.query_history(params["start"], params["end"], params.get("criteria"),
+                                                params.get("limit", 100))
                 response = {"status": "ok", "data": data}
-            elif query["type"] == "cantidad":
-                window = query["params"]["window"]
-                cantidad = data_store.cantidad(window)
-                response = {"status": "ok", "data": cantidad}
-            elif query["type"] == "dgim_filter":
-                window = query["params"]["window"]  # Ejemplo: "5min" o "1hour"
-                data6 = data_store.get_insects_in_time_window(window)
-                response = {"status": "ok", "data": data6}
-            elif query["type"] == "random_walk":
-                window = int(query["params"].get("window", 300))
-                start = query["params"]["start"]
-                steps = int(query["params"].get("steps", 5))
-                eventos = data_store.eventos_recientes(window)
-                if not eventos:
-
-                    response = {"status": "error", "message": "No hay eventos en la ventana"}
+            except ValueError as e:
+                response = {"status": "error", "message": str(e)}
+        elif query["type"] == "bloom_filter":
+            window = query["params"]["window"]
+            data = data_store.get_insects_in_time_window(window)
+            response = {"status": "ok", "data": data}
+        elif query["type"] == "bloom_contains":
+            params = query["params"]
+            response = {"status": "ok", "data": data_store.bloom_contains(params["window"], params["keys"])}
+        elif query["type"] == "minwise":
+            window = query["params"]["window"]
+            data = data_store.get_insects_in_time_window(window)
+            response = {"status": "ok", "data": data}
+        elif query["type"] == "cantidad":
+            window = query["params"]["window"]
+            cantidad = data_store.cantidad(window)
+            response = {"status": "ok", "data": cantidad}
+        elif query["type"] == "dgim_filter":
+            window = query["params"]["window"]  # Ejemplo: "5min" o "1hour"
+            data6 = data_store.get_insects_in_time_window(window)
+            response = {"status": "ok", "data": data6}
+        elif query["type"] == "random_walk":
+            window = int(query["params"].get("window", 300))
+            start = query["params"]["start"]
+            steps = int(query["params"].get("steps", 5))
+            response = random_walk_response(data_store.eventos_recientes(window), start, steps)
+        elif query["type"] == "recent_events":
+            window = int(query["params"].get("window", 300))
+            response = {"status": "ok", "data": data_store.eventos_recientes(window)}
+        elif query["type"] == "eco_density":
+            limit = query["params"].get("limit", 10)
+            data = data_store.query_ecological_impact_and_density(limit)
+            response = {"status": "ok", "data": data}
+        elif query["type"] == "mapreduce":
+            data = data_store.get_insects()
+            response = {"status": "ok", "data": data}
+        elif query["type"] == "markov":
+            data = data_store.get_insects()
+            response = {"status": "ok", "data": data}
+        elif query["type"] == "window":
+            window = query["params"]["window"]
+            response = {"status": "ok", "data": data_store.window_counts(window)}
+        elif query["type"] == "metrics":
+            response = {"status": "ok", "data": data_store.get_metrics()}
+        elif query["type"] == "cursor_open":
+            params = query["params"]
+            records, total = data_store.cursor_records(params["source"], params)
+            cursor_id, cursor = cursors.open(records, total)
+            page = _cursor_page(cursor_id, cursor, int(params.get("page_size", PAGE_SIZE)))
+            response = {"status": "ok", "data": page}
+        elif query["type"] == "cursor_next":
+            params = query["params"]
+            cursor_id = params["cursor"]
+            page = _cursor_page(cursor_id, cursors.get(cursor_id), int(params.get("page_size", PAGE_SIZE)))
+            response = {"status": "ok", "data": page}
+        elif query["type"] == "cursor_close":
+            response = {"status": "ok", "data": cursors.close(query["params"]["cursor"])}
+    except (KeyError, TypeError, ValueError) as e:
+        response = {"status": "error", "message": f"Consulta inválida: {e}"}
+    return response
+
+
+# Segundos que una respuesta cacheada se sigue sirviendo aunque el almacén haya cambiado.
+# Solo se cachean estas consultas: son las que los dashboards repiten sin parar.
+CACHE_TOLERANCE = {
+    "stats": 1.0,
+    "eco_density": 1.0,
+    "window": 1.0,
+    "cantidad": 1.0,
+    "bloom_filter": 1.0,
+    "bloom_contains": 1.0,
+    "minwise": 1.0,
+    "dgim_filter": 1.0,
+    "species": 0.5,
+    "habitat_event": 0.5,
+    "filter": 0.5,
+    "range": 0.5,
+}
 
-                else:
 
-                    G = construir_grafo_desde_eventos(eventos)
-                    print(" Eventos recibidos:", len(eventos))
-                    print(" Nodos del grafo:", list(G.nodes()))
-                    print(" Aristas del grafo:", list(G.edges()))
+def _freeze(value):
+    """Convierte parámetros (dicts y listas anidados) en una clave hashable"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
 
-                    try:
 
-                        camino = random_walk_habitat(G, start, steps)
-                        response = {"status": "ok", "data": camino}
+class ResultCache:
+    """Caché LRU de respuestas por (tipo de consulta, parámetros).
 
-                    except ValueError as e:
+    Cada entrada guarda la versión del almacén y el segundo en que se calculó. Sirve
+    mientras el almacén no haya cambiado dentro del mismo segundo (las ventanas dependen
+    del reloj) o, aunque haya cambiado, durante la tolerancia de frescura de su tipo.
+    """
 
-                        response = {"status": "error", "message": str(e)}
-            elif query["type"] == "eco_density":
-                limit = query["params"].get("limit", 10)
-                data = data_store.query_ecological_impact_and_density(limit)
-                response = {"status": "ok", "data": data}
-            elif query["type"] == "mapreduce":
-                data = data_store.get_insects()
-                response = {"status": "ok", "data": data}
-            elif query["type"] == "markov":
-                data = data_store.get_insects()
-                response = {"status": "ok", "data": data}
+    def __init__(self, max_entries=256, tolerance=CACHE_TOLERANCE):
+        self.max_entries = max_entries
+        self.tolerance = tolerance
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def key(self, query):
+        kind = query.get("type")
+        if kind not in self.tolerance:
+            return None
+        try:
+            key = kind, _freeze(query.get("params", {}))
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key, version):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached_version, cached_at, response = entry
+                unchanged = cached_version == version and int(cached_at) == int(now)
+                if unchanged or now - cached_at <= self.tolerance[key[0]]:
+                    self._entries.move_to_end(key)
+                    self.hits[key[0]] += 1
+                    return response
+                del self._entries[key]
+            self.misses[key[0]] += 1
+            return None
+
+    def put(self, key, version, response):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                "entries": len(self._entries),
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "by_type": {kind: {"hits": self.hits[kind], "misses": self.misses[kind]}
+                            for kind in sorted(set(self.hits) | set(self.misses))},
+            }
+
+
+result_cache = ResultCache()
+
+
+def _answer(request_id, query, data_store):
+    """Resuelve la consulta (o la toma de la caché) y serializa el frame de respuesta,
+    ambos fuera del event loop"""
+    started = time.perf_counter()
+    key = result_cache.key(query) if isinstance(query, dict) else None
+    # La versión se lee antes de calcular: si el almacén cambia mientras tanto, la
+    # entrada queda marcada como antigua y no se sirve más allá de su tolerancia
+    version = data_store.version
+    response = result_cache.get(key, version) if key is not None else None
+    if response is None:
+        response = dispatch_query(query, data_store)
+        if key is not None and response.get("status") == "ok":
+            result_cache.put(key, version, response)
+    data_store.metrics.observe(f"query.{query.get('type')}", time.perf_counter() - started)
+    return pack_frame(request_id, response)
+
+
+async def handle_query_client(reader, writer, data_store, executors, answer_query=_answer):
+    """Atiende una conexión: cada frame recibido se resuelve como una tarea independiente,
+    así que varias consultas pueden estar en vuelo y responderse según terminan.
 
-            conn.sendall(pickle.dumps(response))
+    `answer_query(request_id, query, data_store)` resuelve una consulta en un executor y
+    devuelve el frame de respuesta; el coordinador de shards usa el suyo.
+    """
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    async def answer(request_id, query):
+        kind = query.get("type") if isinstance(query, dict) else None
+        executor = executors["heavy" if kind in HEAVY_QUERIES else "light"]
+        try:
+            frame = await loop.run_in_executor(executor, answer_query, request_id, query, data_store)
+        except Exception as e:
+            frame = pack_frame(request_id, {"status": "error", "message": str(e)})
+        # Un frame se escribe entero de una vez: no se mezcla con el de otra tarea
+        writer.write(frame)
+        await writer.drain()
+
+    try:
+        while True:
+            frame = await read_frame(reader)
+            if frame is None:
+                break
+            task = asyncio.create_task(answer(*frame))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
     except Exception as e:
         print(f"Error en manejo de cliente: {e}")
     finally:
-        conn.close()
+        writer.close()
+
+
+async def serve_queries(data_store, path=SOCKET_PATH, answer_query=_answer):
+    executors = {
+        "light": ThreadPoolExecutor(max_workers=4, thread_name_prefix="query"),
+        "heavy": ThreadPoolExecutor(max_workers=2, thread_name_prefix="query-heavy"),
+    }
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: handle_query_client(reader, writer, data_store, executors, answer_query),
+        path=path)
+    print(f"🔌 Servidor de consultas iniciado en {path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=False)
 
 
-# Función para el servidor de consultas
-def query_server(data_store):
-    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    sock.bind(SOCKET_PATH)
-    sock.listen(5)
-    print(f"🔌 Servidor de consultas iniciado en {SOCKET_PATH}")
+# Función para el servidor de consultas (bucle asyncio en su propio hilo)
+def query_server(data_store, path=SOCKET_PATH, answer_query=_answer):
+    # Asegurarse de que el socket no exista previamente
+    try:
+        os.unlink(path)
+    except OSError:
+        if os.path.exists(path):
+            raise
 
     try:
-        while True:
-            conn, addr = sock.accept()
-            thread = threading.Thread(target=handle_query_client, args=(conn, data_store))
-            thread.daemon = True
-            thread.start()
+        asyncio.run(serve_queries(data_store, path, answer_query))
     except KeyboardInterrupt:
         print("🛑 Cerrando servidor de consultas...")
     finally:
-        sock.close()
         try:
-            os.unlink(SOCKET_PATH)
+            os.unlink(path)
         except OSError:
             pass
 
 
-# Función para procesar los mensajes de Kafka
-def process_kafka_messages(data_store):
-    consumer = Consumer(conf)
-    consumer.subscribe(['insect-events'])
+# Tamaño de lote para la ingesta y frecuencia máxima de los mensajes de progreso
+BATCH_SIZE = 5000
+LOG_INTERVAL = 5.0  # Segundos entre mensajes de progreso
+CHECKPOINT_INTERVAL = 60.0  # Segundos entre checkpoints del almacén
+
+
+class ProgressLogger:
+    """Imprime el progreso de la ingesta como mucho una vez cada `interval` segundos"""
+
+    def __init__(self, data_store, interval=LOG_INTERVAL):
+        self.data_store = data_store
+        self.interval = interval
+        self.started = self.last_time = time.perf_counter()
+        self.last_count = 0
+
+    def maybe_log(self, message_count):
+        now = time.perf_counter()
+        if now - self.last_time < self.interval:
+            return
+        rate = (message_count - self.last_count) / (now - self.last_time)
+        print(f"🔄 Procesados {message_count} mensajes ({rate:,.0f} eventos/s)")
+
+        # Mostrar el total de la última ventana sin reconstruir todas las estadísticas
+        with self.data_store.lock:
+            last_minute = self.data_store.windows.total(60)
+        print(f"📊 Últimos minutos: {last_minute} eventos")
+        self.last_time, self.last_count = now, message_count
 
-    # Contador para control de flujo
+
+def _decode_batch(payloads, decode):
+    """Decodifica un lote descartando (y reportando) los mensajes inválidos"""
+    batch = []
+    for payload in payloads:
+        try:
+            batch.append(decode(payload))
+        except Exception as e:
+            print(f"Error al procesar mensaje: {e}")
+    return batch
+
+
+def _ingest_batch(data_store, payloads, decode):
+    """Decodifica e indexa un lote registrando las métricas; devuelve (añadidos, errores)"""
+    if not payloads:
+        return 0, 0
+    metrics = data_store.metrics
+    with metrics.timer("ingest.decode"):
+        batch = _decode_batch(payloads, decode)
+    added = data_store.add_insects(batch) if batch else 0
+    metrics.mark("ingest.messages", added)
+    # Los duplicados descartados se cuentan aparte (ingest.duplicates), no como errores
+    failed = len(payloads) - len(batch)
+    if failed:
+        metrics.mark("ingest.errors", failed)
+    return added, failed
+
+
+def save_checkpoint(data_store, path, offsets):
+    """Guarda el snapshot actual del almacén junto con los offsets ya ingeridos"""
+    with data_store.metrics.timer("checkpoint.write"):
+        count = write_checkpoint(path, data_store.snapshot().records(), offsets)
+    data_store.metrics.mark("checkpoint.records", count)
+    return count
+
+
+def restore_checkpoint(data_store, path):
+    """Carga un checkpoint en el almacén y devuelve sus offsets ({} si no hay checkpoint)"""
+    started = time.perf_counter()
+    checkpoint = read_checkpoint(path)
+    if checkpoint is None:
+        print(f"ℹ️ Sin checkpoint en {path}: se consume desde los offsets confirmados")
+        return {}
+    with checkpoint, data_store.metrics.timer("checkpoint.restore"):
+        # Lo restaurado ya está en el log histórico: no se vuelve a escribir
+        added = data_store.add_insects(checkpoint.records(), log_history=False)
+        offsets = checkpoint.offsets
+    print(f"♻️ Checkpoint {path}: {added} registros restaurados en "
+          f"{time.perf_counter() - started:.2f}s, {len(offsets)} particiones")
+    return offsets
+
+
+# Ingesta desde un archivo de eventos (JSONL o segmento) a máxima velocidad, sin Kafka
+def process_file_messages(data_store, path, batch_size=BATCH_SIZE):
     message_count = 0
-    last_cleanup_time = time.time()
-    last_cleanup_time_1m = time.time()
-    last_cleanup_time_2m = time.time()
-    last_cleanup_time_5m = time.time()
-    cleanup_interval = 1800  # Segundos entre limpiezas
-    cleanup_interval_1m = 60
-    cleanup_interval_2m = 120
-    cleanup_interval_5m = 300
+    errors = 0
+    started = time.perf_counter()
+    progress = ProgressLogger(data_store)
 
     try:
-        while True:
-            msg = consumer.poll(0.1)  # Poll más rápido para mensajes de alto volumen
-
-            # Limpiar datos viejos periódicamente
-            if time.time() - last_cleanup_time > cleanup_interval:
-                removed = data_store.clean_old_data()
-                print(f"🧹 Limpieza realizada: {removed} registros antiguos eliminados")
-                last_cleanup_time = time.time()
-
-            if time.time() - last_cleanup_time_1m > cleanup_interval_1m:
-                removed = data_store.clean_window("1min")
-                print(f"🧹 Limpieza realizada: {removed} registros antiguos eliminados")
-                last_cleanup_time_1m = time.time()
-
-            if time.time() - last_cleanup_time_2m > cleanup_interval_2m:
-                removed = data_store.clean_window("2min")
-                print(f"🧹 Limpieza realizada: {removed} registros antiguos eliminados")
-                last_cleanup_time_2m = time.time()
-
-            if time.time() - last_cleanup_time_5m > cleanup_interval_5m:
-                removed = data_store.clean_window("5min")
-                print(f"🧹 Limpieza realizada: {removed} registros antiguos eliminados")
-                last_cleanup_time_5m = time.time()
-
-            if msg is None:
+        payloads = []
+        for payload in iter_payloads(path):
+            payloads.append(payload)
+            if len(payloads) < batch_size:
                 continue
+            count, failed = _ingest_batch(data_store, payloads, decode_record)
+            message_count += count
+            errors += failed
+            payloads = []
+            progress.maybe_log(message_count)
+
+        count, failed = _ingest_batch(data_store, payloads, decode_record)
+        message_count += count
+        errors += failed
+    except KeyboardInterrupt:
+        print("🛑 Interrupción por el usuario. Deteniendo la lectura del archivo...")
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Archivo {path}: {message_count} mensajes en {elapsed:.2f}s "
+          f"({message_count / max(elapsed, 1e-9):,.0f} eventos/s, {errors} errores)")
+    return message_count
+
+
+def _ignore_sigint():
+    # Ctrl+C llega a todo el grupo de procesos: el que decide cuándo parar es el poller
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _decode_messages(items):
+    """Decodifica un lote de (valor, codificación) en un worker: (registros, fallidos, segundos)"""
+    started = time.perf_counter()
+    records = _decode_batch(items, lambda item: decode_record(*item))
+    return records, len(items) - len(records), time.perf_counter() - started
+
+
+# Lotes en vuelo entre el poller y el indexer y procesos de decodificación por defecto
+PIPELINE_BATCHES = 8
+DECODE_WORKERS = 2
+
+
+class IngestPipeline:
+    """Ingesta en etapas: poller -> workers de decodificación -> indexer.
+
+    El poller envía cada lote a decodificar y deja el future en una cola acotada; un
+    único hilo indexer los saca en orden, los añade al almacén y ejecuta el mantenimiento
+    (limpieza, checkpoints) entre lotes, así que nada de eso frena el polling. Cuando la cola
+    se llena el poller pausa el consumer y lo reanuda al vaciarse hasta la mitad.
+
+    Los offsets solo avanzan con los lotes ya indexados. Si un lote entero falla (un worker
+    muere, el log histórico no puede escribir...) el indexer se detiene y guarda el error:
+    el poller lo relanza y no se escribe ni se confirma ningún checkpoint posterior.
+    """
+
+    def __init__(self, data_store, offsets, decode_workers=DECODE_WORKERS, max_batches=PIPELINE_BATCHES,
+                 maintenance=None):
+        self.data_store = data_store
+        self.offsets = offsets              # siguiente offset a leer de lo ya indexado
+        self.maintenance = maintenance
+        self.message_count = 0
+        self.max_batches = max_batches
+        self.error = None
+        self._aborted = False
+        self.pending = queue.Queue(max_batches)
+        if decode_workers:
+            # spawn: el proceso ya tiene hilos (servidor de consultas) y fork no es seguro con ellos
+            self.executor = ProcessPoolExecutor(decode_workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=_ignore_sigint)
+        else:
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix="decode")
+        self.indexer = threading.Thread(target=self._index_loop, name="indexer", daemon=True)
+        self.indexer.start()
 
-            if msg.error():
-                print(f"Error de consumidor: {msg.error()}")
+    def check(self):
+        """Relanza en el poller el error que detuvo al indexer"""
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, item):
+        # Si el indexer se detuvo la cola ya no se vacía: no bloquear para siempre
+        while True:
+            self.check()
+            try:
+                self.pending.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def submit(self, items, offsets):
+        self.check()
+        self._put((self.executor.submit(_decode_messages, items), offsets))
+
+    @property
+    def full(self):
+        return self.pending.qsize() >= self.max_batches
+
+    @property
+    def drained(self):
+        return self.pending.qsize() <= self.max_batches // 2
+
+    def publish_depths(self, paused):
+        """Lotes decodificándose, lotes decodificados esperando al indexer y estado del poller"""
+        futures = [future for future, _ in list(self.pending.queue) if future is not None]
+        decoded = sum(future.done() for future in futures)
+        metrics = self.data_store.metrics
+        metrics.gauge("pipeline.decode_queue", len(futures) - decoded)
+        metrics.gauge("pipeline.index_queue", decoded)
+        metrics.gauge("pipeline.paused", int(paused))
+
+    def _index_loop(self):
+        metrics = self.data_store.metrics
+        while True:
+            try:
+                future, offsets = self.pending.get(timeout=0.5)
+            except queue.Empty:
+                # Sin lotes el mantenimiento sigue corriendo (limpieza, checkpoints)
+                if self.maintenance:
+                    self.maintenance()
                 continue
+            if future is None or self._aborted:
+                return
+            try:
+                # Los mensajes que no se pueden decodificar ya vienen descartados y contados;
+                # aquí solo llegan fallos del lote entero
+                records, failed, seconds = future.result()
+                metrics.observe("ingest.decode", seconds)
+                added = self.data_store.add_insects(records) if records else 0
+                metrics.mark("ingest.messages", added)
+                if failed:
+                    metrics.mark("ingest.errors", failed)
+                self.message_count += added
+                self.offsets.update(offsets)
+                if self.maintenance:
+                    self.maintenance()
+            except Exception as e:
+                print(f"❌ Error al indexar un lote, se detiene la ingesta: {e!r}")
+                metrics.mark("pipeline.failures")
+                self.error = e
+                return
+
+    def close(self):
+        """Indexa lo que queda en la cola y para el indexer y los workers.
 
+        Relanza el error si algún lote no se pudo indexar; en ese caso no hay que escribir
+        checkpoint.
+        """
+        try:
+            self._put((None, None))
+            self.indexer.join()
+            self.check()
+        except Exception:
+            self.abort()
+            raise
+        self.executor.shutdown()
+
+    def abort(self):
+        """Detiene el pipeline descartando los lotes pendientes sin indexarlos"""
+        self._aborted = True
+        while True:
             try:
-                message_count += 1
-                data = json.loads(msg.value().decode('utf-8'))
+                future, _ = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if future is not None:
+                future.cancel()
+        try:
+            self.pending.put_nowait((None, None))
+        except queue.Full:
+            pass
+        self.indexer.join(timeout=5)
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
-                # Añadir al almacén de datos
-                data_store.add_insect(data)
 
-                # Solo mostrar cada 1000 mensajes para no saturar la terminal
-                if message_count % 1 == 0:
-                    print(
-                        f"🔄 Procesados {message_count} mensajes. Último: {data['insect']['species']} ({data['event']})")
+# Función para procesar los mensajes de Kafka
+def process_kafka_messages(data_store, source_file=None, batch_size=BATCH_SIZE,
+                           checkpoint_path=None, checkpoint_interval=CHECKPOINT_INTERVAL, transport="kafka",
+                           decode_workers=DECODE_WORKERS, pipeline_batches=PIPELINE_BATCHES):
+    if source_file:
+        return process_file_messages(data_store, source_file, batch_size)
+
+    # Con checkpoints los offsets se confirman a mano, solo después de escribir el
+    # checkpoint que los contiene; así estado y offsets nunca se desalinean
+    offsets = restore_checkpoint(data_store, checkpoint_path) if checkpoint_path else {}
+    consumer_conf = dict(conf, **{'enable.auto.commit': False}) if checkpoint_path else conf
+    consumer = create_consumer(transport, consumer_conf)
+
+    # Particiones asignadas ahora mismo: solo sus offsets se escriben en el checkpoint y se
+    # confirman. Tras un rebalanceo las demás son de otro consumer (otro shard)
+    owned = set()
+
+    def on_assign(consumer, partitions):
+        # Reanudar justo después de lo que ya contiene el checkpoint restaurado
+        for partition in partitions:
+            offset = offsets.get((partition.topic, partition.partition))
+            if offset is not None:
+                partition.offset = offset
+            owned.add((partition.topic, partition.partition))
+        consumer.assign(partitions)
+
+    def on_revoke(consumer, partitions):
+        # Confirmar un offset viejo de una partición revocada haría retroceder al nuevo dueño
+        for partition in partitions:
+            key = (partition.topic, partition.partition)
+            owned.discard(key)
+            offsets.pop(key, None)
+            pending = checkpointed["commit"]
+            if pending:
+                pending.pop(key, None)
+
+    consumer.subscribe(['insect-events'], on_assign=on_assign, on_revoke=on_revoke)
+
+    # Estado del mantenimiento, que corre en el hilo indexer entre lotes. Lo restaurado ya
+    # está en el checkpoint: no se reescribe hasta que haya ingesta nueva
+    checkpointed = {"version": data_store.version, "time": time.time(), "commit": None}
+    cleanup = {"time": time.time(), "interval": 1800}  # Segundos entre limpiezas
+    progress = ProgressLogger(data_store)
+
+    def checkpoint():
+        # Sin ingesta desde el último checkpoint no hay nada nuevo que escribir
+        if checkpointed["version"] == data_store.version:
+            return
+        checkpointed["version"] = data_store.version
+        # Un lote en vuelo de una partición ya revocada puede haber vuelto a anotar su offset
+        current = {key: offset for key, offset in list(offsets.items()) if key in owned}
+        count = save_checkpoint(data_store, checkpoint_path, current)
+        # El consumer solo se usa desde el poller: allí se confirman estos offsets
+        checkpointed["commit"] = current
+        print(f"💾 Checkpoint {checkpoint_path}: {count} registros")
+
+    def commit_checkpointed():
+        committed, checkpointed["commit"] = checkpointed["commit"], None
+        if committed:
+            assigned = {(partition.topic, partition.partition) for partition in consumer.assignment()}
+            partitions = [TopicPartition(topic, partition, offset)
+                          for (topic, partition), offset in committed.items() if (topic, partition) in assigned]
+            if partitions:
+                consumer.commit(offsets=partitions, asynchronous=False)
+
+    def maintenance():
+        if time.time() - cleanup["time"] > cleanup["interval"]:
+            removed = data_store.clean_old_data()
+            print(f"🧹 Limpieza realizada: {removed} registros antiguos eliminados")
+            cleanup["time"] = time.time()
+
+        if checkpoint_path and time.time() - checkpointed["time"] > checkpoint_interval:
+            checkpoint()
+            checkpointed["time"] = time.time()
+
+        progress.maybe_log(pipeline.message_count)
+
+    pipeline = IngestPipeline(data_store, offsets, decode_workers, pipeline_batches, maintenance)
+    paused = False
 
-                    # Mostrar algunas estadísticas de las ventanas de tiempo
-                    stats = data_store.get_stats()
-                    print(f"📊 Últimos minutos: {sum(stats['time_windows']['1min'].values())} eventos")
-                    # print(f"📊 Últimos 5 minutos: {sum(stats['time_windows']['5min'].values())} eventos")
+    try:
+        while True:
+            pipeline.check()
+            # Backpressure: con la cola llena se deja de leer sin dejar de llamar a consume
+            if not paused and pipeline.full:
+                consumer.pause(consumer.assignment())
+                data_store.metrics.mark("pipeline.pauses")
+                paused = True
+            elif paused and pipeline.drained:
+                consumer.resume(consumer.assignment())
+                paused = False
+            pipeline.publish_depths(paused)
+            commit_checkpointed()
+
+            # Consumir en lotes: un lock y una actualización de índices por lote
+            msgs = consumer.consume(num_messages=batch_size, timeout=0.1)
+            if not msgs:
+                continue
 
-            except Exception as e:
-                print(f"Error al procesar mensaje: {e}")
+            items = []
+            batch_offsets = {}
+            for msg in msgs:
+                if msg.error():
+                    print(f"Error de consumidor: {msg.error()}")
+                    continue
+                items.append((msg.value(), header_encoding(msg.headers())))
+                batch_offsets[(msg.topic(), msg.partition())] = msg.offset() + 1
+            if items:
+                pipeline.submit(items, batch_offsets)
 
     except KeyboardInterrupt:
         print("🛑 Interrupción por el usuario. Cerrando consumer...")
-    finally:
+    except BaseException:
+        # Un lote sin indexar: ni checkpoint ni commit, se reanuda desde el último bueno
+        pipeline.abort()
         consumer.close()
+        raise
+
+    try:
+        pipeline.close()
+    except BaseException:
+        consumer.close()
+        raise
+    if checkpoint_path:
+        checkpoint()
+        commit_checkpointed()
+    consumer.close()
+
+
+def positive_int(text):
+    """Tipo de argparse para enteros mayores que 0"""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"debe ser mayor que 0: {text}")
+    return value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Consumidor de eventos de insectos")
+    parser.add_argument("--source", default=None,
+                        help="Archivo .jsonl o .seg a ingerir en lugar de Kafka")
+    parser.add_argument("--backend", choices=BACKENDS, default="dict",
+                        help="Backend del almacén: dict, o columnar (añade una proyección numpy para eco_density)")
+    parser.add_argument("--transport", default="kafka",
+                        help="Origen de los eventos: kafka, memory (con un producer en el mismo "
+                             "proceso) o ring[:ruta] (archivo compartido con producer.py)")
+    parser.add_argument("--produce-rate", type=int, default=20000,
+                        help="Eventos por segundo del producer integrado con --transport memory (0 = sin límite)")
+    parser.add_argument("--history", default=None,
+                        help="Directorio del log histórico en disco (segmentos por hora)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Archivo de checkpoint: se restaura al arrancar y se reescribe "
+                             "periódicamente junto con los offsets confirmados (kafka, memory o ring)")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL,
+                        help="Segundos entre checkpoints")
+    parser.add_argument("--decode-workers", type=int, default=DECODE_WORKERS,
+                        help="Procesos que decodifican los lotes (0 = un hilo del propio consumer)")
+    parser.add_argument("--pipeline-batches", type=int, default=PIPELINE_BATCHES,
+                        help="Lotes en vuelo entre el poller y el indexer antes de pausar el consumer")
+    parser.add_argument("--dedup-horizon", type=int, default=DEDUP_HORIZON,
+                        help="Segundos de eventTime durante los que se descarta un _id repetido "
+                             "(0 = sin deduplicación: el repetido reemplaza al anterior)")
+    parser.add_argument("--dedup-capacity", type=positive_int, default=DEDUP_CAPACITY,
+                        help="_id por franja de 10 minutos de eventTime que admite cada filtro de "
+                             "deduplicación (eventos/s esperados x 600); por encima no se marcan duplicados")
+    return parser
+
+
+def parse_args():
+    return build_parser().parse_args()
 
 
 # Iniciar hilos para procesamiento paralelo
 if __name__ == "__main__":
+    args = parse_args()
+    if (args.backend != "dict" or args.history or args.dedup_horizon != DEDUP_HORIZON
+            or args.dedup_capacity != DEDUP_CAPACITY):
+        data_store = InsectDataStore(backend=args.backend, history_dir=args.history,
+                                     dedup_horizon=args.dedup_horizon, dedup_capacity=args.dedup_capacity)
+
     # Hilo para el servidor de consultas
     query_thread = threading.Thread(target=query_server, args=(data_store,))
     query_thread.daemon = True
     query_thread.start()
 
+    if parse_transport(args.transport)[0] == "memory" and not args.source:
+        # El broker en memoria no cruza procesos: el producer corre en un hilo de este.
+        # Se importa aquí para que los workers y los shards no carguen producer.py ni Faker
+        from producer import run_batched
+        producer_thread = threading.Thread(
+            target=run_batched, args=(create_producer(args.transport, {}),),
+            kwargs={"rate": args.produce_rate, "batch_size": 5000, "report_interval": 0},
+            daemon=True)
+        producer_thread.start()
+
     # Hilo para procesamiento Kafka en el hilo principal
-    process_kafka_messages(data_store)
\ No newline at end of file
+    process_kafka_messages(data_store, source_file=args.source,
+                           checkpoint_path=args.checkpoint, checkpoint_interval=args.checkpoint_interval,
+                           transport=args.transport, decode_workers=args.decode_workers,
+                           pipeline_batches=args.pipeline_batches)
+
+    if args.source:
+        # El archivo ya se ingirió; seguir atendiendo consultas hasta Ctrl+C
+        try:
+            query_thread.join()
+        except KeyboardInterrupt:
+            print("🛑 Interrupción por el usuario. Cerrando consumer...")
@@ -0,0 +1,82 @@
+import mmap
+import os
+import struct
+
+# Formato de segmento binario:
+#   cabecera: MAGIC (4 bytes) + versión (1 byte)
+#   registros: longitud little-endian (4 bytes) + payload
+SEGMENT_MAGIC = b"INSG"
+SEGMENT_VERSION = 1
+_HEADER = struct.Struct("<4sB")
+_LENGTH = struct.Struct("<I")
+
+
+def file_format(path):
+    """Deduce el formato del archivo a partir de su extensión: 'jsonl' o 'segment'"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".json", ".ndjson"):
+        return "jsonl"
+    if ext in (".seg", ".bin"):
+        return "segment"
+    raise ValueError(f"Extensión no soportada: {ext}. Usar .jsonl o .seg")
+
+
+class EventFileWriter:
+    """Escribe payloads ya serializados en un archivo JSONL o de segmento binario"""
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.format = fmt or file_format(path)
+        self.count = 0
+        self._file = open(path, "wb", buffering=1 << 20)
+        if self.format == "segment":
+            self._file.write(_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION))
+
+    def write(self, payload):
+        if self.format == "segment":
+            self._file.write(_LENGTH.pack(len(payload)))
+            self._file.write(payload)
+        else:
+            self._file.write(payload)
+            self._file.write(b"\n")
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_payloads(path, fmt=None):
+    """Recorre los payloads de un archivo de eventos sin decodificarlos"""
+    fmt = fmt or file_format(path)
+
+    if fmt == "jsonl":
+        with open(path, "rb", buffering=1 << 20) as f:
+            for line in f:
+                line = line.rstrip(b"\r\n")
+                if line:
+                    yield line
+        return
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version = _HEADER.unpack_from(mm, 0)
+            if magic != SEGMENT_MAGIC:
+                raise ValueError(f"{path} no es un segmento de eventos válido")
+            if version != SEGMENT_VERSION:
+                raise ValueError(f"Versión de segmento no soportada: {version}")
+
+            offset = _HEADER.size
+            end = len(mm)
+            while offset + _LENGTH.size <= end:
+                (length,) = _LENGTH.unpack_from(mm, offset)
+                offset += _LENGTH.size
+                yield mm[offset:offset + length]
+                offset += length
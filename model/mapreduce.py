@@ -55,7 +55,14 @@ class MapReduce:
         all_insects = list(insects_dict.values())
         chunk_size = len(all_insects) // num_map_tasks + 1
         chunks = [all_insects[i:i + chunk_size] for i in range(0, len(all_insects), chunk_size)]
+        return self.run_chunks(chunks, num_map_tasks, num_reduce_tasks)
 
+    def run_chunks(self, chunks, num_map_tasks, num_reduce_tasks):
+        """Ejecuta el MapReduce sobre un iterable de lotes de insectos.
+
+        Los workers arrancan antes de leer el primer lote, así que los lotes se pueden ir
+        recibiendo (por ejemplo, páginas de un cursor) mientras se procesan los anteriores.
+        """
         map_queue = multiprocessing.Queue()
         reduce_queue = multiprocessing.Queue()
         result_queue = multiprocessing.Queue()
@@ -72,20 +79,20 @@ class MapReduce:
             reduce_workers.append(worker)
             worker.start()
 
-        for chunk in chunks:
-            map_queue.put(chunk)
-
-        for _ in range(num_map_tasks):
-            map_queue.put(None)
+        try:
+            for chunk in chunks:
+                if chunk:
+                    map_queue.put(chunk)
+        finally:
+            # Aunque falle la lectura de lotes, los workers deben terminar
+            for _ in range(num_map_tasks):
+                map_queue.put(None)
 
-        for worker in map_workers:
-            worker.join()
+            for worker in map_workers:
+                worker.join()
 
-        for _ in range(num_reduce_tasks):
-            reduce_queue.put(None)
-
-        for worker in reduce_workers:
-            worker.join()
+            for _ in range(num_reduce_tasks):
+                reduce_queue.put(None)
 
         final_result = defaultdict(int)
         for _ in range(num_reduce_tasks):
@@ -93,4 +100,7 @@ class MapReduce:
             for key, count in result.items():
                 final_result[key] += count
 
-        return dict(final_result)
\ No newline at end of file
+        for worker in reduce_workers:
+            worker.join()
+
+        return dict(final_result)
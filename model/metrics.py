@@ -0,0 +1,164 @@
+import bisect
+import threading
+import time
+from collections import defaultdict, deque
+
+# Límites de los buckets de latencia en segundos: 1µs, 2µs, 4µs ... ~1.1 horas
+LATENCY_BUCKETS = tuple(1e-6 * 2 ** i for i in range(33))
+
+
+class Histogram:
+    """Histograma de latencias con buckets exponenciales de base 2"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Cota superior del bucket que contiene el percentil q (0-100)"""
+        if not self.count:
+            return 0.0
+        target = q / 100 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target and c:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": list(self.counts),
+        }
+
+    @classmethod
+    def from_snapshots(cls, snapshots, bounds=LATENCY_BUCKETS):
+        """Histograma equivalente a haber observado todas las muestras de varios snapshots"""
+        histogram = cls(bounds)
+        for snapshot in snapshots:
+            histogram.counts = [a + b for a, b in zip(histogram.counts, snapshot["buckets"])]
+            histogram.count += snapshot["count"]
+            histogram.total += snapshot["sum"]
+            histogram.max = max(histogram.max, snapshot["max"])
+        return histogram
+
+
+class RateMeter:
+    """Cuenta eventos y estima la tasa por segundo sobre los últimos `window` segundos"""
+
+    def __init__(self, window=10):
+        self.window = window
+        self.total = 0
+        self.buckets = deque()  # (segundo, cantidad)
+        self.started = time.time()
+
+    def mark(self, n=1, now=None):
+        now = int(now or time.time())
+        self.total += n
+        if self.buckets and self.buckets[-1][0] == now:
+            self.buckets[-1][1] += n
+        else:
+            self.buckets.append([now, n])
+        self._expire(now)
+
+    def _expire(self, now):
+        while self.buckets and self.buckets[0][0] <= now - self.window:
+            self.buckets.popleft()
+
+    def rate(self, now=None):
+        now = int(now or time.time())
+        self._expire(now)
+        # Durante los primeros segundos la ventana efectiva es más corta
+        span = min(self.window, max(1, now - int(self.started)))
+        return sum(n for _, n in self.buckets) / span
+
+    def snapshot(self):
+        return {"total": self.total, "per_second": self.rate()}
+
+
+class MetricsRegistry:
+    """Registro de métricas de ingesta y consultas, seguro entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.meters = defaultdict(RateMeter)
+        self.histograms = defaultdict(Histogram)
+        self.gauges = {}
+
+    def mark(self, name, n=1):
+        with self._lock:
+            self.meters[name].mark(n)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.histograms[name].observe(seconds)
+
+    def gauge(self, name, value):
+        """Fija el valor actual de una magnitud instantánea (profundidad de una cola...)"""
+        with self._lock:
+            self.gauges[name] = value
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "meters": {name: m.snapshot() for name, m in self.meters.items()},
+                "histograms": {name: h.snapshot() for name, h in self.histograms.items()},
+                "gauges": dict(self.gauges),
+            }
+
+
+def merge_snapshots(snapshots):
+    """Une los snapshots de varios MetricsRegistry (uno por shard): los contadores y sus
+    tasas y los gauges se suman y los histogramas se combinan bucket a bucket"""
+    meters, histograms, gauges = defaultdict(list), defaultdict(list), defaultdict(int)
+    for snapshot in snapshots:
+        for name, meter in snapshot["meters"].items():
+            meters[name].append(meter)
+        for name, histogram in snapshot["histograms"].items():
+            histograms[name].append(histogram)
+        for name, value in snapshot.get("gauges", {}).items():
+            gauges[name] += value
+    return {
+        "meters": {name: {"total": sum(m["total"] for m in parts),
+                          "per_second": sum(m["per_second"] for m in parts)}
+                   for name, parts in meters.items()},
+        "histograms": {name: Histogram.from_snapshots(parts).snapshot()
+                       for name, parts in histograms.items()},
+        "gauges": dict(gauges),
+    }
+
+
+class _Timer:
+    """Context manager que registra la duración del bloque en un histograma"""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.registry.observe(self.name, self.elapsed)
@@ -1,25 +1,33 @@
-from confluent_kafka import Producer
-import json, random, time, uuid
-from datetime import datetime
+import argparse, calendar, json, multiprocessing, random, time, uuid
+from datetime import datetime, timedelta
 from faker import Faker
 
+from codec import (SPECIES, ROLES, EVENTS, HABITATS, EVENT_STRUCT, BINARY_VERSION,
+                   JSON_ENCODING, BINARY_ENCODING, ENCODINGS, encode_event, message_headers)
+from eventfile import EventFileWriter
+from transport import create_producer, parse_transport
+
 fake = Faker()
 
-species = ["ant", "bee", "butterfly", "spider"]
-roles = ["worker", "queen", "soldier", "scout"]
-events = ["birth", "death", "predator attack"]
-habitats = ["forest", "field", "garden", "house"]
+species = list(SPECIES)
+roles = list(ROLES)
+events = list(EVENTS)
+habitats = list(HABITATS)
+
+TOPIC = 'insect-events'
 
-def generate_insect():
+def generate_insect(event_time=None):
+    # El id sale de `random` para que una semilla reproduzca también los _id
+    event_time = event_time or datetime.now()
     return {
-        "_id": str(uuid.uuid4()),
+        "_id": str(uuid.UUID(int=random.getrandbits(128), version=4)),
         "insect": {
             "species": random.choice(species),
             "role": random.choice(roles),
             "age": random.randint(1, 10)
         },
         "event": random.choice(events),
-        "eventTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%S Z"),
+        "eventTime": event_time.strftime("%Y-%m-%dT%H:%M:%S Z"),
         "location": {
             "habitat": random.choice(habitats),
             "coordinates": {
@@ -36,26 +44,314 @@ conf = {
     'client.id': 'insect-simulator'
 }
 
-producer = Producer(conf)
+# Ajustes de batching de librdkafka para el modo de alto rendimiento
+batch_conf = {
+    'linger.ms': 20,
+    'batch.size': 1048576,
+    'batch.num.messages': 100000,
+    'compression.type': 'lz4',
+    'queue.buffering.max.messages': 2000000,
+    'queue.buffering.max.kbytes': 2097152,
+    'acks': 1,
+}
+
+
+class EventPools:
+    """Valores pre-generados para construir eventos en lote sin llamar a Faker por evento"""
+
+    def __init__(self, pool_size=4096):
+        # Cada entrada guarda el fragmento JSON ya serializado, los códigos del formato binario
+        # y la especie/hábitat en bytes para usarlos como clave de partición.
+        self.insects = [
+            (s.encode('utf-8'), json.dumps({"species": s, "role": r, "age": age}), si, ri, age)
+            for si, s in enumerate(species) for ri, r in enumerate(roles) for age in range(1, 11)
+        ]
+        self.events = [(json.dumps(e), ei) for ei, e in enumerate(events)]
+        self.locations = []
+        for _ in range(pool_size):
+            hi = random.randrange(len(habitats))
+            latitude, longitude = float(fake.latitude()), float(fake.longitude())
+            self.locations.append((habitats[hi].encode('utf-8'), json.dumps({
+                "habitat": habitats[hi],
+                "coordinates": {
+                    "latitude": latitude,
+                    "longitude": longitude
+                }
+            }), hi, latitude, longitude))
+        self.impacts = [(str(i), i) for i in range(-50, 51)]
+        self.densities = [(str(d), d) for d in range(1, 1001)]
+
+        # Prefijo UUID por proceso (10 bytes); los últimos 6 bytes son un contador. Sale de
+        # `random` para que dos ejecuciones con la misma --seed generen los mismos _id
+        self._id_prefix = uuid.UUID(int=random.getrandbits(128), version=4).bytes[:10]
+        self._counter = 0
+
+    def build_batch(self, n, key_by=None, encoding=JSON_ENCODING):
+        """Construye n eventos como tuplas (clave, payload); key_by: None, 'species' o 'habitat'"""
+        if key_by not in PARTITION_KEYS:
+            raise ValueError(f"Clave de partición no válida: {key_by}. Usar: {PARTITION_KEYS}")
+
+        now = datetime.now().replace(microsecond=0)
+        start = self._counter
+        self._counter += n
+        rows = zip(
+            range(start, start + n),
+            random.choices(self.insects, k=n),
+            random.choices(self.events, k=n),
+            random.choices(self.locations, k=n),
+            random.choices(self.impacts, k=n),
+            random.choices(self.densities, k=n))
+
+        batch = []
+        if encoding == BINARY_ENCODING:
+            epoch = calendar.timegm(now.timetuple())
+            prefix = self._id_prefix
+            pack = EVENT_STRUCT.pack
+            for i, insect, event, location, impact, density in rows:
+                batch.append((_partition_key(key_by, insect, location), pack(
+                    BINARY_VERSION, insect[2], insect[3], event[1], location[2], insect[4],
+                    impact[1], density[1], prefix + i.to_bytes(6, 'big'), epoch,
+                    location[3], location[4])))
+            return batch
+
+        event_time = json.dumps(now.strftime("%Y-%m-%dT%H:%M:%S Z"))
+        h = self._id_prefix.hex()
+        prefix = f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-"
+        for i, insect, event, location, impact, density in rows:
+            batch.append((_partition_key(key_by, insect, location), (
+                f'{{"_id": "{prefix}{i:012x}", "insect": {insect[1]}, "event": {event[0]}, '
+                f'"eventTime": {event_time}, "location": {location[1]}, '
+                f'"ecologicalImpact": {impact[0]}, "populationDensity": {density[0]}}}'
+            ).encode('utf-8')))
+        return batch
+
+
+PARTITION_KEYS = (None, "species", "habitat")
+
+
+def _partition_key(key_by, insect, location):
+    if key_by == "species":
+        return insect[0]
+    if key_by == "habitat":
+        return location[0]
+    return None
+
+
+def produce_batch(producer, batch, topic=TOPIC, headers=None):
+    """Encola un lote completo; si la cola local se llena, espera a que se libere"""
+    for key, value in batch:
+        while True:
+            try:
+                producer.produce(topic, key=key, value=value, headers=headers)
+                break
+            except BufferError:
+                producer.poll(0.05)
+    producer.poll(0)
+
+
+def run_batched(producer, rate=0, batch_size=10000, duration=0, report_interval=1.0,
+                key_by=None, progress=None, encoding=JSON_ENCODING):
+    """Modo de alto rendimiento: genera eventos en lotes y reporta los eventos/s logrados.
+
+    `progress` es un multiprocessing.Value opcional donde se publica el total enviado,
+    usado por el proceso padre en el modo con varios workers.
+    """
+    pools = EventPools()
+    headers = message_headers(encoding)
+    sent = 0
+    started = time.perf_counter()
+    last_report, last_sent = started, 0
+
+    try:
+        while True:
+            batch = pools.build_batch(batch_size, key_by, encoding)
+            produce_batch(producer, batch, headers=headers)
+            sent += len(batch)
+            if progress is not None:
+                progress.value = sent
+            now = time.perf_counter()
+
+            if rate:
+                # Dormir lo necesario para no superar la tasa objetivo
+                ahead = sent / rate - (now - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+                    now = time.perf_counter()
+
+            if report_interval and now - last_report >= report_interval:
+                print(f"📈 {(sent - last_sent) / (now - last_report):,.0f} eventos/s (total {sent:,})")
+                last_report, last_sent = now, sent
+
+            if duration and now - started >= duration:
+                break
+    except KeyboardInterrupt:
+        print("🛑 Interrupción por el usuario. Cerrando producer...")
+    finally:
+        producer.flush()
+        elapsed = time.perf_counter() - started
+        print(f"✅ {sent:,} eventos enviados en {elapsed:.2f}s ({sent / elapsed:,.0f} eventos/s)")
+
+    return sent
+
+
+def _sharded_worker(worker_id, seed, progress, rate, batch_size, duration, key_by, encoding, transport):
+    """Proceso worker: su propio Producer, su propia semilla y su porción del flujo"""
+    # Tras el fork todos heredan el mismo estado de random; cada worker debe divergir
+    seed_generators(seed + worker_id if seed is not None else None)
+    producer = create_producer(transport, {**conf, **batch_conf, 'client.id': f"{conf['client.id']}-{worker_id}"})
+    run_batched(producer, rate=rate, batch_size=batch_size, duration=duration,
+                report_interval=0, key_by=key_by, progress=progress, encoding=encoding)
+
+
+def run_sharded(workers, rate=0, batch_size=10000, duration=0, key_by="species", seed=None,
+                report_interval=1.0, encoding=JSON_ENCODING, transport="kafka"):
+    """Lanza `workers` procesos productores y reporta los eventos/s agregados"""
+    if parse_transport(transport)[0] == "memory":
+        raise ValueError("El transporte memory no cruza procesos: usar kafka o ring con --workers")
+    progress = [multiprocessing.Value('q', 0, lock=False) for _ in range(workers)]
+    worker_rate = rate / workers if rate else 0
+    processes = [
+        multiprocessing.Process(
+            target=_sharded_worker,
+            args=(i, seed, progress[i], worker_rate, batch_size, duration, key_by, encoding, transport),
+            daemon=True)
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+
+    started = time.perf_counter()
+    last_report, last_sent = started, 0
+    try:
+        while any(p.is_alive() for p in processes):
+            time.sleep(report_interval)
+            now = time.perf_counter()
+            sent = sum(v.value for v in progress)
+            print(f"📈 {workers} workers: {(sent - last_sent) / (now - last_report):,.0f} eventos/s (total {sent:,})")
+            last_report, last_sent = now, sent
+    except KeyboardInterrupt:
+        # Los workers reciben la misma señal y hacen flush por su cuenta
+        print("🛑 Interrupción por el usuario. Esperando a los workers...")
+    finally:
+        for p in processes:
+            p.join()
+
+    elapsed = time.perf_counter() - started
+    sent = sum(v.value for v in progress)
+    print(f"✅ {workers} workers: {sent:,} eventos enviados en {elapsed:.2f}s ({sent / elapsed:,.0f} eventos/s)")
+    return sent
+
+
+def seed_generators(seed):
+    """Fija la semilla de random y Faker para generar siempre el mismo flujo (None = aleatoria)"""
+    random.seed(seed)
+    Faker.seed(seed)
+
+
+def write_event_file(path, count, start=None, interval=0.001, report_every=100000,
+                     encoding=JSON_ENCODING):
+    """Genera `count` eventos con generate_insect y los escribe a JSONL o segmento binario"""
+    start = start or datetime.now().replace(microsecond=0)
+    started = time.perf_counter()
+
+    with EventFileWriter(path) as writer:
+        if encoding == BINARY_ENCODING and writer.format != "segment":
+            raise ValueError("La codificación binaria solo puede escribirse en archivos .seg")
+        for i in range(count):
+            data = generate_insect(start + timedelta(seconds=i * interval))
+            writer.write(encode_event(data, encoding))
+            if report_every and writer.count % report_every == 0:
+                print(f"📝 {writer.count:,} eventos escritos")
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {count:,} eventos escritos en {path} en {elapsed:.2f}s ({count / elapsed:,.0f} eventos/s)")
+    return count
+
+
+def run_interactive(producer, key_by=None, encoding=JSON_ENCODING):
+    """Modo original: un evento cada 0.2-0.5 s"""
+    headers = message_headers(encoding)
+    try:
+        while True:
+            data = generate_insect()
+
+            try:
+                payload = encode_event(data, encoding)
+            except (TypeError, ValueError) as e:
+                print("❌ Error serializando el evento:", e)
+                print("🔎 Datos problemáticos:", data)
+                continue  # Salta este mensaje y sigue con el siguiente
+
+            if key_by == "species":
+                key = data["insect"]["species"]
+            elif key_by == "habitat":
+                key = data["location"]["habitat"]
+            else:
+                key = None
+            producer.produce(TOPIC, key=key, value=payload, headers=headers)
+            print("✅ Evento enviado:", data)
+            producer.poll(0)  # Libera mensajes encolados
+            time.sleep(random.uniform(0.2, 0.5))
+
+    except KeyboardInterrupt:
+        print("🛑 Interrupción por el usuario. Cerrando producer...")
+
+    finally:
+        producer.flush()  # Asegura envío de mensajes pendientes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulador de eventos de insectos")
+    parser.add_argument("--rate", type=int, default=None,
+                        help="Eventos por segundo en modo por lotes (0 = sin límite)")
+    parser.add_argument("--batch", type=int, default=None,
+                        help="Eventos por lote en modo por lotes")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="Segundos a ejecutar en modo por lotes (0 = indefinido)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Semilla para random y Faker (flujo reproducible)")
+    parser.add_argument("--output", default=None,
+                        help="Escribe los eventos a un archivo .jsonl o .seg en lugar de Kafka")
+    parser.add_argument("--count", type=int, default=1000000,
+                        help="Número de eventos a escribir con --output")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None,
+                        help="Tiempo del primer evento con --output (ISO 8601, por defecto ahora)")
+    parser.add_argument("--interval", type=float, default=0.001,
+                        help="Segundos simulados entre eventos consecutivos con --output")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Procesos productores en paralelo (modo por lotes)")
+    parser.add_argument("--key", choices=["species", "habitat", "none"], default=None,
+                        help="Clave de partición de los mensajes (por defecto 'species' con --workers > 1)")
+    parser.add_argument("--format", choices=sorted(ENCODINGS), default="json",
+                        help="Codificación de los eventos: JSON o binaria compacta")
+    parser.add_argument("--transport", default="kafka",
+                        help="Destino de los eventos: kafka, o ring[:ruta] (archivo compartido con "
+                             "el consumer, sin broker)")
+    return parser.parse_args()
 
-try:
-    while True:
-        data = generate_insect()
 
-        try:
-            json_str = json.dumps(data)
-        except TypeError as e:
-            print("❌ Error serializando a JSON:", e)
-            print("🔎 Datos problemáticos:", data)
-            continue  # Salta este mensaje y sigue con el siguiente
+if __name__ == "__main__":
+    args = parse_args()
 
-        producer.produce('insect-events', value=json_str.encode('utf-8'))
-        print("✅ Evento enviado:", data)
-        producer.poll(0)  # Libera mensajes encolados
-        time.sleep(random.uniform(0.2, 0.5))
+    encoding = ENCODINGS[args.format]
 
-except KeyboardInterrupt:
-    print("🛑 Interrupción por el usuario. Cerrando producer...")
+    if args.seed is not None:
+        seed_generators(args.seed)
 
-finally:
-    producer.flush()  # Asegura envío de mensajes pendientes
\ No newline at end of file
+    if args.output:
+        write_event_file(args.output, args.count, start=args.start, interval=args.interval,
+                         encoding=encoding)
+    elif args.workers > 1:
+        key_by = "species" if args.key is None else (None if args.key == "none" else args.key)
+        run_sharded(args.workers, rate=args.rate or 0, batch_size=args.batch or 10000,
+                    duration=args.duration, key_by=key_by, seed=args.seed, encoding=encoding,
+                    transport=args.transport)
+    elif args.rate is None and args.batch is None:
+        producer = create_producer(args.transport, conf)
+        run_interactive(producer, key_by=None if args.key in (None, "none") else args.key,
+                        encoding=encoding)
+    else:
+        key_by = None if args.key in (None, "none") else args.key
+        producer = create_producer(args.transport, {**conf, **batch_conf})
+        run_batched(producer, rate=args.rate or 0, batch_size=args.batch or 10000,
+                    duration=args.duration, key_by=key_by, encoding=encoding)
@@ -0,0 +1,125 @@
+import itertools
+import pickle
+import socket
+import struct
+
+# Protocolo del servidor de consultas sobre el socket Unix: cada mensaje es un frame
+#   id de petición (u32) | longitud del payload (u64) | payload (pickle)
+# El id permite tener varias peticiones en vuelo por conexión: las respuestas llegan en
+# el orden en que terminan, no en el que se enviaron.
+SOCKET_PATH = "/tmp/insect_query_socket"
+FRAME_HEADER = struct.Struct("<IQ")
+
+
+def pack_frame(request_id, message):
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return FRAME_HEADER.pack(request_id, len(payload)) + payload
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionError("Conexión cerrada a mitad de un frame")
+        received += n
+    return buffer
+
+
+def recv_frame(sock):
+    """Lee un frame completo de un socket bloqueante: (id de petición, mensaje)"""
+    request_id, size = FRAME_HEADER.unpack(_recv_exactly(sock, FRAME_HEADER.size))
+    return request_id, pickle.loads(_recv_exactly(sock, size))
+
+
+async def read_frame(reader):
+    """Versión asyncio de recv_frame; None si el cliente cerró la conexión entre frames"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except EOFError:
+        return None
+    request_id, size = FRAME_HEADER.unpack(header)
+    return request_id, pickle.loads(await reader.readexactly(size))
+
+
+class QueryError(Exception):
+    """El servidor respondió a una consulta con status 'error'"""
+
+
+class QueryClient:
+    """Cliente del servidor de consultas con una conexión persistente.
+
+    `request` envía una consulta y espera su respuesta; `pipeline` envía varias seguidas
+    y devuelve las respuestas en el orden de las consultas.
+    """
+
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self._sock = None
+        self._ids = itertools.count(1)
+
+    def _connect(self):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(self.path)
+        return self._sock
+
+    def submit(self, queries):
+        """Envía las consultas sin esperar respuesta; devuelve sus ids para `collect`"""
+        sock = self._connect()
+        ids = [next(self._ids) for _ in queries]
+        try:
+            sock.sendall(b"".join(pack_frame(i, q) for i, q in zip(ids, queries)))
+        except Exception:
+            self.close()
+            raise
+        return ids
+
+    def collect(self, ids):
+        """Espera las respuestas de las consultas enviadas con `submit`, en el orden de `ids`"""
+        try:
+            responses = {}
+            while len(responses) < len(ids):
+                request_id, response = recv_frame(self._sock)
+                responses[request_id] = response
+            return [responses[i] for i in ids]
+        except Exception:
+            # Una conexión a medio leer no se puede reutilizar
+            self.close()
+            raise
+
+    def pipeline(self, queries):
+        return self.collect(self.submit(queries))
+
+    def request(self, query):
+        return self.pipeline([query])[0]
+
+    def iter_pages(self, source, page_size=5000, **params):
+        """Recorre una fuente de registros del servidor página a página mediante un cursor.
+
+        Cada página es una lista de eventos; si el recorrido se abandona antes del final,
+        el cursor se cierra en el servidor.
+        """
+        response = self.request({"type": "cursor_open",
+                                 "params": dict(params, source=source, page_size=page_size)})
+        while True:
+            if response["status"] != "ok":
+                raise QueryError(response.get("message", "Desconocido"))
+            page = response["data"]
+            try:
+                yield page["data"]
+            except GeneratorExit:
+                if not page["done"]:
+                    self.request({"type": "cursor_close", "params": {"cursor": page["cursor"]}})
+                raise
+            if page["done"]:
+                return
+            response = self.request({"type": "cursor_next",
+                                     "params": {"cursor": page["cursor"], "page_size": page_size}})
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
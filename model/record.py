@@ -0,0 +1,288 @@
+import struct
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+from codec import (SPECIES, ROLES, EVENTS, HABITATS, SPECIES_CODE, ROLE_CODE, EVENT_CODE, HABITAT_CODE,
+                   EVENT_STRUCT, BINARY_VERSION, BINARY_ENCODING, JSON_ENCODING,
+                   decode_event, format_event_time, id_from_bytes, id_to_bytes, parse_event_time)
+
+# Registro empaquetado (44 bytes): _id (16) | epoch (u32) | especie, rol, evento, hábitat,
+# edad (u8) | impacto (i8) | densidad (u16) | latitud, longitud (f32) | fila (u64)
+RECORD_STRUCT = struct.Struct("<16sIBBBBBbHffQ")
+
+# Posición del código de cada campo categórico dentro del registro
+CATEGORY_OFFSETS = {"species": 20, "role": 21, "event": 22, "habitat": 23}
+
+
+class InsectRecord(bytes):
+    """Evento almacenado como bytes empaquetados: sin dicts anidados ni cadenas por evento.
+
+    Los campos categóricos son códigos de las tablas de codec, el tiempo es un epoch
+    entero y las coordenadas son float32. `row` es el número de fila asignado por el
+    almacén, usado por los índices secundarios.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_event(cls, data, row=0):
+        """Construye el registro desde el dict con la forma del producer"""
+        insect = data["insect"]
+        location = data["location"]
+        coordinates = location["coordinates"]
+        try:
+            return cls(RECORD_STRUCT.pack(
+                id_to_bytes(data["_id"]),
+                parse_event_time(data["eventTime"]),
+                SPECIES_CODE[insect["species"]],
+                ROLE_CODE[insect["role"]],
+                EVENT_CODE[data["event"]],
+                HABITAT_CODE[location["habitat"]],
+                insect["age"],
+                data["ecologicalImpact"],
+                data["populationDensity"],
+                coordinates["latitude"],
+                coordinates["longitude"],
+                row,
+            ))
+        except KeyError as e:
+            raise ValueError(f"Valor sin código en el registro compacto: {e}") from None
+
+    @classmethod
+    def from_binary(cls, payload, row=0):
+        """Construye el registro directamente desde el formato binario v1, sin pasar por dict"""
+        (version, species, role, event, habitat, age, impact, density,
+         raw_id, epoch, latitude, longitude) = EVENT_STRUCT.unpack(payload)
+        if version != BINARY_VERSION:
+            raise ValueError(f"Versión de formato binario no soportada: {version}")
+        return cls(RECORD_STRUCT.pack(raw_id, epoch, species, role, event, habitat, age,
+                                      impact, density, latitude, longitude, row))
+
+    def with_row(self, row):
+        return InsectRecord(self[:-8] + row.to_bytes(8, "little"))
+
+    def fields(self):
+        return RECORD_STRUCT.unpack(self)
+
+    @property
+    def id(self):
+        return bytes(self[:16])
+
+    @property
+    def epoch(self):
+        return int.from_bytes(self[16:20], "little")
+
+    @property
+    def species_code(self):
+        return self[20]
+
+    @property
+    def role_code(self):
+        return self[21]
+
+    @property
+    def event_code(self):
+        return self[22]
+
+    @property
+    def habitat_code(self):
+        return self[23]
+
+    @property
+    def species(self):
+        return SPECIES[self[20]]
+
+    @property
+    def event(self):
+        return EVENTS[self[22]]
+
+    @property
+    def impact(self):
+        return RECORD_STRUCT.unpack_from(self)[7]
+
+    @property
+    def density(self):
+        return int.from_bytes(self[26:28], "little")
+
+    @property
+    def row(self):
+        return int.from_bytes(self[36:44], "little")
+
+    @property
+    def insect_id(self):
+        return id_from_bytes(self[:16])
+
+    @property
+    def event_time(self):
+        return format_event_time(self.epoch)
+
+    def to_dict(self):
+        """Dict con la misma forma que el evento original del producer"""
+        (raw_id, epoch, species, role, event, habitat, age, impact, density,
+         latitude, longitude, _) = RECORD_STRUCT.unpack(self)
+        return {
+            "_id": id_from_bytes(raw_id),
+            "insect": {
+                "species": SPECIES[species],
+                "role": ROLES[role],
+                "age": age
+            },
+            "event": EVENTS[event],
+            "eventTime": format_event_time(epoch),
+            "location": {
+                "habitat": HABITATS[habitat],
+                "coordinates": {
+                    "latitude": round(latitude, 5),
+                    "longitude": round(longitude, 5)
+                }
+            },
+            "ecologicalImpact": impact,
+            "populationDensity": density
+        }
+
+
+def decode_record(payload, encoding=None):
+    """Decodifica un payload directamente a InsectRecord (el binario no crea dicts)"""
+    if encoding is None:
+        encoding = JSON_ENCODING if payload[:1] == b"{" else BINARY_ENCODING
+    if encoding == BINARY_ENCODING:
+        return InsectRecord.from_binary(payload)
+    return InsectRecord.from_event(decode_event(payload, encoding))
+
+
+class PostingIndex:
+    """Índice valor -> filas ordenadas (array de u64) con borrado perezoso.
+
+    Las filas se añaden en orden creciente, así que cada lista queda ordenada. Borrar
+    solo descuenta el conteo del valor; las filas muertas se filtran al leer y se
+    compactan cuando superan a las vivas.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.counts = {}
+        self._dead = 0
+
+    def add(self, value, row):
+        postings = self.postings.get(value)
+        if postings is None:
+            postings = self.postings[value] = array("Q")
+            self.counts[value] = 0
+        postings.append(row)
+        self.counts[value] += 1
+
+    def remove(self, value):
+        self.counts[value] -= 1
+        self._dead += 1
+
+    def count(self, value):
+        return self.counts.get(value, 0)
+
+    def keys(self):
+        return [value for value, count in self.counts.items() if count > 0]
+
+    def items_counts(self):
+        return {value: count for value, count in self.counts.items() if count > 0}
+
+    def rows(self, value):
+        return self.postings.get(value, ())
+
+    def entries(self):
+        return sum(len(p) for p in self.postings.values())
+
+    def needs_compaction(self):
+        return self._dead > sum(self.counts.values())
+
+    def compact(self, is_live, min_row=0):
+        """Quita filas anteriores a min_row (por bisect) y las filas muertas"""
+        for value, postings in self.postings.items():
+            start = bisect_left(postings, min_row)
+            if start:
+                del postings[:start]
+            if self.needs_compaction():
+                self.postings[value] = array("Q", (row for row in postings if is_live(row)))
+        self._dead = 0
+        for value in [v for v, c in self.counts.items() if c <= 0]:
+            del self.counts[value]
+            del self.postings[value]
+
+
+class RangeIndex(PostingIndex):
+    """PostingIndex que además mantiene sus valores ordenados para consultas por rango.
+
+    Los valores distintos son pocos (impacto -50..50, densidad 1..1000), así que un rango
+    se resuelve con dos bisect sobre la lista de valores y solo se leen las listas de
+    filas de los valores que caen dentro.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sorted_values = []
+
+    def add(self, value, row):
+        if value not in self.postings:
+            insort(self.sorted_values, value)
+        super().add(value, row)
+
+    def values_between(self, low=None, high=None):
+        """Valores presentes en [low, high]; un extremo None deja el rango abierto"""
+        values = self.sorted_values
+        start = 0 if low is None else bisect_left(values, low)
+        end = len(values) if high is None else bisect_right(values, high)
+        return values[start:end]
+
+    def count_between(self, low=None, high=None):
+        return sum(self.counts[value] for value in self.values_between(low, high))
+
+    def rows_between(self, low=None, high=None, is_live=None, limit=None):
+        """Filas vivas con valor en [low, high], ordenadas por valor y luego por llegada"""
+        results = []
+        for value in self.values_between(low, high):
+            if not self.counts[value]:
+                continue
+            for row in self.postings[value]:
+                if is_live is None or is_live(row):
+                    results.append(row)
+                    if limit and len(results) >= limit:
+                        return results
+        return results
+
+    def compact(self, is_live, min_row=0):
+        super().compact(is_live, min_row)
+        self.sorted_values = sorted(self.postings)
+
+
+def intersect_postings(lists, limit=None, is_live=None):
+    """Intersección leapfrog de listas de filas ordenadas.
+
+    Las listas se ordenan de menor a mayor y cada una avanza con búsqueda binaria hasta
+    el candidato actual, así que se saltan bloques completos sin recorrerlos. Se detiene
+    en cuanto hay `limit` filas (vivas según `is_live`).
+    """
+    if not lists:
+        return []
+    lists = sorted(lists, key=len)
+    if not lists[0]:
+        return []
+
+    cursors = [0] * len(lists)
+    results = []
+    target = lists[0][0]
+    while True:
+        matched = True
+        for j, postings in enumerate(lists):
+            c = bisect_left(postings, target, cursors[j])
+            cursors[j] = c
+            if c == len(postings):
+                return results
+            if postings[c] != target:
+                # Esta lista no tiene el candidato: saltar al siguiente valor que sí tiene
+                target = postings[c]
+                matched = False
+                break
+        if matched:
+            if is_live is None or is_live(target):
+                results.append(target)
+                if limit and len(results) >= limit:
+                    return results
+            target += 1
@@ -0,0 +1,215 @@
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+from record import RECORD_STRUCT, InsectRecord
+
+# Log histórico en disco: un segmento por partición de tiempo de evento.
+#   segmento: MAGIC (4) | versión (u8) | inicio de la partición (u32) | segundos (u32)
+#             y a continuación registros empaquetados de tamaño fijo (RECORD_STRUCT)
+#   índice (.idx): zone map por bloque de BLOCK_RECORDS registros, epoch mínimo y máximo
+LOG_MAGIC = b"INSL"
+LOG_VERSION = 1
+_HEADER = struct.Struct("<4sBII")
+_ZONE = struct.Struct("<II")
+_RECORD_SIZE = RECORD_STRUCT.size
+
+BLOCK_RECORDS = 1024
+PARTITION_SECONDS = 3600
+MAX_OPEN_SEGMENTS = 4
+
+
+def _epoch_at(buffer, position):
+    return int.from_bytes(buffer[position + 16:position + 20], "little")
+
+
+def _block_zone(buffer, start, count):
+    """(epoch mínimo, epoch máximo) de `count` registros a partir de la posición `start`"""
+    epochs = [_epoch_at(buffer, start + i * _RECORD_SIZE) for i in range(count)]
+    return min(epochs), max(epochs)
+
+
+class _SegmentWriter:
+    """Segmento abierto para añadir registros; mantiene el zone map del bloque en curso"""
+
+    def __init__(self, path, partition_start, partition_seconds):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) < _HEADER.size
+        if new:
+            with open(path, "wb") as f:
+                f.write(_HEADER.pack(LOG_MAGIC, LOG_VERSION, partition_start, partition_seconds))
+            with open(path + ".idx", "wb"):
+                pass
+
+        # Descartar un registro a medio escribir si el proceso se cortó
+        size = os.path.getsize(path)
+        self.count = (size - _HEADER.size) // _RECORD_SIZE
+        if _HEADER.size + self.count * _RECORD_SIZE != size:
+            os.truncate(path, _HEADER.size + self.count * _RECORD_SIZE)
+
+        zones = _read_zones(path + ".idx")
+        blocks = self.count // BLOCK_RECORDS
+        self.zone_min = self.zone_max = None
+        if len(zones) != blocks or self.count % BLOCK_RECORDS:
+            # Reconstruir los zone maps que falten (y el del bloque abierto) desde los datos
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                zones = zones[:blocks]
+                for b in range(len(zones), blocks):
+                    zones.append(_block_zone(buffer, _HEADER.size + b * BLOCK_RECORDS * _RECORD_SIZE, BLOCK_RECORDS))
+                tail = self.count % BLOCK_RECORDS
+                if tail:
+                    self.zone_min, self.zone_max = _block_zone(
+                        buffer, _HEADER.size + blocks * BLOCK_RECORDS * _RECORD_SIZE, tail)
+            with open(path + ".idx", "wb") as f:
+                f.write(b"".join(_ZONE.pack(*zone) for zone in zones))
+
+        self._file = open(path, "ab", buffering=1 << 20)
+        self._index = open(path + ".idx", "ab")
+
+    def append(self, record):
+        epoch = _epoch_at(record, 0)
+        self._file.write(record)
+        if self.zone_min is None:
+            self.zone_min = self.zone_max = epoch
+        elif epoch < self.zone_min:
+            self.zone_min = epoch
+        elif epoch > self.zone_max:
+            self.zone_max = epoch
+        self.count += 1
+        if not self.count % BLOCK_RECORDS:
+            self._index.write(_ZONE.pack(self.zone_min, self.zone_max))
+            self.zone_min = self.zone_max = None
+
+    def flush(self):
+        self._file.flush()
+        self._index.flush()
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+
+def _read_zones(index_path):
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, "rb") as f:
+        data = f.read()
+    usable = len(data) - len(data) % _ZONE.size
+    return list(_ZONE.iter_unpack(data[:usable]))
+
+
+class SegmentLog:
+    """Log append-only de eventos en segmentos por partición de tiempo.
+
+    Cada evento va al segmento de la partición de su eventTime; los segmentos menos usados
+    se cierran cuando hay más de MAX_OPEN_SEGMENTS abiertos (eventos atrasados). Las
+    consultas históricas abren los segmentos con mmap, descartan particiones fuera del
+    rango por nombre y bloques completos por su zone map, y solo leen lo que queda.
+    """
+
+    def __init__(self, directory, partition_seconds=PARTITION_SECONDS):
+        self.directory = directory
+        self.partition_seconds = partition_seconds
+        self._writers = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, partition_start):
+        return os.path.join(self.directory, f"insects-{partition_start:010d}.log")
+
+    def _writer(self, partition_start):
+        writer = self._writers.get(partition_start)
+        if writer is None:
+            writer = _SegmentWriter(self._path(partition_start), partition_start, self.partition_seconds)
+            self._writers[partition_start] = writer
+            if len(self._writers) > MAX_OPEN_SEGMENTS:
+                _, oldest = self._writers.popitem(last=False)
+                oldest.close()
+        else:
+            self._writers.move_to_end(partition_start)
+        return writer
+
+    def append_many(self, records):
+        """Añade registros al segmento de su partición y los deja visibles para las consultas"""
+        if not records:
+            return
+        seconds = self.partition_seconds
+        with self._lock:
+            partition, writer = None, None
+            for record in records:
+                start = _epoch_at(record, 0) // seconds * seconds
+                if start != partition:
+                    partition, writer = start, self._writer(start)
+                writer.append(record)
+            for writer in self._writers.values():
+                writer.flush()
+
+    def partitions(self):
+        """Inicio de cada partición con segmento en disco, en orden"""
+        starts = []
+        for name in os.listdir(self.directory):
+            if name.startswith("insects-") and name.endswith(".log"):
+                starts.append(int(name[len("insects-"):-len(".log")]))
+        return sorted(starts)
+
+    def query(self, start, end, predicate=None, limit=None):
+        """Registros con epoch en [start, end] que cumplen `predicate`.
+
+        Devuelve (registros, estadísticas); con `limit` se detiene al alcanzarlo, sin él
+        lee todos los bloques que no se hayan podido descartar.
+        """
+        stats = {}
+        records = self.scan(start, end, predicate, stats)
+        try:
+            results = list(islice(records, limit or None))
+        finally:
+            records.close()
+        return results, stats
+
+    def scan(self, start, end, predicate=None, stats=None):
+        """Generador de los registros de `query`, en orden de partición y llegada.
+
+        El mmap de cada segmento sigue abierto mientras se recorre, así que los registros
+        se copian uno a uno según se piden; `stats` (un dict) se va rellenando por el camino.
+        """
+        stats = {} if stats is None else stats
+        stats.update({"segments": 0, "blocks": 0, "blocks_pruned": 0, "scanned": 0, "matched": 0})
+        with self._lock:
+            for writer in self._writers.values():
+                writer.flush()
+
+        for partition in self.partitions():
+            if partition > end or partition + self.partition_seconds <= start:
+                continue
+            path = self._path(partition)
+            if os.path.getsize(path) <= _HEADER.size:
+                continue
+            stats["segments"] += 1
+            zones = _read_zones(path + ".idx")
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                count = (len(buffer) - _HEADER.size) // _RECORD_SIZE
+                for b in range((count + BLOCK_RECORDS - 1) // BLOCK_RECORDS):
+                    stats["blocks"] += 1
+                    if b < len(zones) and (zones[b][1] < start or zones[b][0] > end):
+                        stats["blocks_pruned"] += 1
+                        continue
+                    first = b * BLOCK_RECORDS
+                    position = _HEADER.size + first * _RECORD_SIZE
+                    for _ in range(min(BLOCK_RECORDS, count - first)):
+                        stats["scanned"] += 1
+                        epoch = _epoch_at(buffer, position)
+                        if start <= epoch <= end:
+                            record = InsectRecord(buffer[position:position + _RECORD_SIZE])
+                            if predicate is None or predicate(record):
+                                stats["matched"] += 1
+                                yield record
+                        position += _RECORD_SIZE
+
+    def close(self):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
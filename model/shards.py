@@ -0,0 +1,338 @@
+import heapq
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict
+from itertools import islice
+
+from consumer import (CURSOR_SOURCES, PAGE_SIZE, InsectDataStore, build_parser, process_kafka_messages,
+                      query_server, random_walk_response)
+from metrics import MetricsRegistry, merge_snapshots
+from protocol import SOCKET_PATH, QueryClient, pack_frame
+from snapshot import CursorRegistry
+from transport import parse_transport
+
+# Consumer particionado: N procesos en el mismo grupo de Kafka, cada uno con las particiones
+# de 'insect-events' que le asigna el broker y su propio InsectDataStore (un shard). Un
+# coordinador atiende el socket de consultas habitual, reparte cada consulta entre los shards
+# y une los resultados: los conteos se suman, los histogramas se combinan bucket a bucket y
+# las listas con límite se concatenan y se recortan.
+#
+#   python shards.py --shards 4 [opciones de consumer.py]
+#
+# El topic necesita al menos tantas particiones como shards; los que sobren quedan sin datos.
+
+
+def shard_socket(index, base=SOCKET_PATH):
+    """Socket de consultas propio de un shard"""
+    return f"{base}.shard-{index}"
+
+
+def _add_counts(total, part):
+    """Suma recursivamente los números de `part` sobre `total`; lo demás se toma del primero"""
+    for key, value in part.items():
+        if isinstance(value, dict):
+            _add_counts(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+        else:
+            total.setdefault(key, value)
+    return total
+
+
+def _first(rows, limit):
+    return rows[:limit] if limit else rows
+
+
+# Funciones de unión por tipo de consulta: (params, [data de cada shard]) -> data
+def merge_counts(params, parts):
+    merged = {}
+    for part in parts:
+        _add_counts(merged, part)
+    return merged
+
+
+def merge_lists(params, parts):
+    return _first([row for part in parts for row in part], params.get("limit", 10))
+
+
+def merge_concat(params, parts):
+    # Listas sin límite (eventos recientes): se concatenan completas
+    return [row for part in parts for row in part]
+
+
+def merge_filter(params, parts):
+    candidates = defaultdict(int)
+    for part in parts:
+        for step in part["plan"]:
+            candidates[(step["field"], step["value"])] += step["candidates"]
+    plan = [{"field": field, "value": value, "candidates": n} for (field, value), n in candidates.items()]
+    plan.sort(key=lambda step: step["candidates"])
+    return {"plan": plan, "results": merge_lists(params, [part["results"] for part in parts])}
+
+
+def merge_range(params, parts):
+    # Cada shard devuelve sus resultados ordenados por valor: basta una mezcla ordenada
+    field = params["field"]
+    results = heapq.merge(*(part["results"] for part in parts), key=lambda row: row[field])
+    merged = dict(parts[0])
+    merged["count"] = sum(part["count"] for part in parts)
+    merged["results"] = list(islice(results, params.get("limit", 10) or None))
+    return merged
+
+
+def merge_history(params, parts):
+    results = sorted((row for part in parts for row in part["results"]), key=lambda row: row["eventTime"])
+    return {
+        "start": parts[0]["start"],
+        "end": parts[0]["end"],
+        "stats": merge_counts(params, [part["stats"] for part in parts]),
+        "results": _first(results, params.get("limit", 100)),
+    }
+
+
+def merge_grouped(params, parts):
+    merged = defaultdict(list)
+    for part in parts:
+        for key, events in part.items():
+            merged[key].extend(events)
+    return merged
+
+
+def merge_union(params, parts):
+    merged = {}
+    for part in parts:
+        merged.update(part)
+    return merged
+
+
+def merge_membership(params, parts):
+    # Una clave está en la ventana si está en la de algún shard
+    merged = dict(parts[0])
+    merged["results"] = {key: any(part["results"][key] for part in parts) for key in parts[0]["results"]}
+    return merged
+
+
+def merge_window(params, parts):
+    merged = merge_counts(params, parts)
+    merged["window"], merged["seconds"] = parts[0]["window"], parts[0]["seconds"]
+    return merged
+
+
+MERGERS = {
+    "stats": merge_counts,
+    "species": merge_lists,
+    "habitat_event": merge_lists,
+    "eco_density": merge_lists,
+    "recent_events": merge_concat,
+    "filter": merge_filter,
+    "range": merge_range,
+    "history": merge_history,
+    "bloom_filter": merge_grouped,
+    "bloom_contains": merge_membership,
+    "minwise": merge_grouped,
+    "dgim_filter": merge_grouped,
+    "cantidad": merge_union,
+    "mapreduce": merge_union,
+    "markov": merge_union,
+    "window": merge_window,
+}
+
+
+class ShardedRecords:
+    """Registros de un cursor abierto en cada shard, leídos shard a shard página a página"""
+
+    def __init__(self, coordinator, pages, page_size):
+        self.coordinator = coordinator
+        self.pages = pages
+        self.page_size = page_size
+        self.open = {shard: page["cursor"] for shard, page in enumerate(pages) if not page["done"]}
+
+    def __iter__(self):
+        for shard, page in enumerate(self.pages):
+            yield from page["data"]
+            while not page["done"]:
+                response = self.coordinator.request(shard, {
+                    "type": "cursor_next", "params": {"cursor": page["cursor"], "page_size": self.page_size}})
+                if response["status"] != "ok":
+                    raise ValueError(f"Shard {shard}: {response.get('message')}")
+                page = response["data"]
+                yield from page["data"]
+            self.open.pop(shard, None)
+
+    def close(self):
+        for shard, cursor_id in list(self.open.items()):
+            self.coordinator.request(shard, {"type": "cursor_close", "params": {"cursor": cursor_id}})
+        self.open.clear()
+
+
+class ShardCoordinator:
+    """Reparte las consultas entre los shards y une sus respuestas.
+
+    Cada hilo del executor tiene sus propias conexiones con los shards; una consulta se
+    envía a todos antes de esperar ninguna respuesta, así que los shards trabajan en paralelo.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.metrics = MetricsRegistry()
+        self.cursors = CursorRegistry()
+        self._sources = {}
+        self._local = threading.local()
+
+    def _clients(self):
+        clients = getattr(self._local, "clients", None)
+        if clients is None:
+            clients = self._local.clients = [QueryClient(path) for path in self.paths]
+        return clients
+
+    def scatter(self, query):
+        clients = self._clients()
+        ids = [client.submit([query]) for client in clients]
+        return [client.collect(request_ids)[0] for client, request_ids in zip(clients, ids)]
+
+    def request(self, shard, query):
+        return self._clients()[shard].request(query)
+
+    def gather(self, query):
+        """Datos de cada shard, o la primera respuesta de error"""
+        responses = self.scatter(query)
+        for response in responses:
+            if response["status"] != "ok":
+                return response, None
+        return None, [response["data"] for response in responses]
+
+    def dispatch(self, query):
+        kind = query["type"]
+        params = query.get("params", {})
+
+        if kind == "random_walk":
+            error, parts = self.gather({"type": "recent_events", "params": {"window": params.get("window", 300)}})
+            if error:
+                return error
+            eventos = merge_concat(params, parts)
+            return random_walk_response(eventos, params["start"], int(params.get("steps", 5)))
+        if kind == "metrics":
+            return self.get_metrics()
+        if kind == "cursor_open":
+            return self.open_cursor(params)
+        if kind == "cursor_next":
+            cursor_id = params["cursor"]
+            return {"status": "ok", "data": self._cursor_page(cursor_id, self.cursors.get(cursor_id),
+                                                              int(params.get("page_size", PAGE_SIZE)))}
+        if kind == "cursor_close":
+            return {"status": "ok", "data": self.close_cursor(params["cursor"])}
+
+        merge = MERGERS.get(kind)
+        if merge is None:
+            return {"status": "error", "message": "Query not recognized"}
+        error, parts = self.gather(query)
+        return error or {"status": "ok", "data": merge(params, parts)}
+
+    def get_metrics(self):
+        error, parts = self.gather({"type": "metrics", "params": {}})
+        if error:
+            return error
+        metrics = merge_snapshots(parts + [self.metrics.snapshot()])
+        metrics["store"] = merge_counts({}, [part["store"] for part in parts])
+        # Las versiones de snapshot son contadores de cada shard: sumarlas no significa nada
+        metrics["store"]["snapshot_version"] = [part["store"]["snapshot_version"] for part in parts]
+        cache = merge_counts({}, [part["cache"] for part in parts])
+        lookups = cache["hits"] + cache["misses"]
+        cache["hit_rate"] = cache["hits"] / lookups if lookups else 0.0
+        metrics["cache"] = cache
+        metrics["shards"] = len(parts)
+        return {"status": "ok", "data": metrics}
+
+    def open_cursor(self, params):
+        if params["source"] not in CURSOR_SOURCES:
+            raise ValueError(f"Fuente de cursor no válida: {params['source']}. Usar: {', '.join(CURSOR_SOURCES)}")
+        page_size = int(params.get("page_size", PAGE_SIZE))
+        error, pages = self.gather({"type": "cursor_open", "params": params})
+        if error:
+            return error
+        source = ShardedRecords(self, pages, page_size)
+        limit = params.get("limit") if params["source"] != "insects" else None
+        # Las fuentes que se leen bajo demanda no conocen su total (None)
+        totals = [page["total"] for page in pages]
+        total = None if None in totals else sum(totals)
+        records = islice(source, limit) if limit else source
+        cursor_id, cursor = self.cursors.open(records, min(total, limit) if limit and total is not None else total)
+        # Los cursores que el registro ya descartó por inactividad no necesitan cerrarse aquí:
+        # los de los shards expiran solos
+        for stale in [i for i in self._sources if i not in self.cursors]:
+            del self._sources[stale]
+        self._sources[cursor_id] = source
+        return {"status": "ok", "data": self._cursor_page(cursor_id, cursor, page_size)}
+
+    def _cursor_page(self, cursor_id, cursor, page_size):
+        with cursor.lock:
+            page = cursor.next_page(page_size)
+            done = cursor.done
+            position = cursor.position
+        if done:
+            self.close_cursor(cursor_id)
+        return {"cursor": cursor_id, "total": cursor.total, "position": position, "done": done, "data": page}
+
+    def close_cursor(self, cursor_id):
+        source = self._sources.pop(cursor_id, None)
+        if source is not None:
+            source.close()
+        return self.cursors.close(cursor_id)
+
+
+def answer_query(request_id, query, coordinator):
+    """Equivalente a consumer._answer para el coordinador"""
+    started = time.perf_counter()
+    try:
+        response = coordinator.dispatch(query)
+    except (KeyError, TypeError, ValueError) as e:
+        response = {"status": "error", "message": f"Consulta inválida: {e}"}
+    except OSError as e:
+        response = {"status": "error", "message": f"Shard no disponible: {e}"}
+    coordinator.metrics.observe(f"coordinator.query.{query.get('type')}", time.perf_counter() - started)
+    return pack_frame(request_id, response)
+
+
+def run_shard(index, args):
+    """Proceso de un shard: su almacén, su servidor de consultas y su consumer de Kafka"""
+    history = os.path.join(args.history, f"shard-{index}") if args.history else None
+    data_store = InsectDataStore(backend=args.backend, history_dir=history, dedup_horizon=args.dedup_horizon,
+                                 dedup_capacity=args.dedup_capacity)
+    threading.Thread(target=query_server, args=(data_store, shard_socket(index)), daemon=True).start()
+    checkpoint = f"{args.checkpoint}.shard-{index}" if args.checkpoint else None
+    process_kafka_messages(data_store, checkpoint_path=checkpoint, checkpoint_interval=args.checkpoint_interval,
+                           transport=args.transport, decode_workers=args.decode_workers,
+                           pipeline_batches=args.pipeline_batches)
+
+
+def main():
+    parser = build_parser()
+    parser.description = "Consumer particionado en varios procesos con un coordinador de consultas"
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 2,
+                        help="Procesos consumer, cada uno con sus particiones y su almacén")
+    args = parser.parse_args()
+    if args.source or parse_transport(args.transport)[0] != "kafka":
+        # Los transportes locales tienen una sola partición: no hay nada que repartir
+        parser.error("El consumer particionado solo funciona con --transport kafka y sin --source")
+
+    processes = [multiprocessing.Process(target=run_shard, args=(i, args), name=f"shard-{i}")
+                 for i in range(args.shards)]
+    for p in processes:
+        p.start()
+    print(f"🧩 {args.shards} shards arrancados")
+
+    try:
+        query_server(ShardCoordinator([shard_socket(i) for i in range(args.shards)]),
+                     SOCKET_PATH, answer_query)
+    finally:
+        # Los shards reciben el mismo Ctrl+C y escriben su checkpoint antes de salir
+        for p in processes:
+            p.join(timeout=30)
+            if p.is_alive():
+                p.terminate()
+
+
+if __name__ == "__main__":
+    main()
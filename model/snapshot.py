@@ -0,0 +1,178 @@
+import itertools
+import threading
+import time
+
+CHUNK_BITS = 12
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+
+
+class RowLog:
+    """Filas del almacén en bloques de tamaño fijo, con copy-on-write frente a snapshots.
+
+    Añadir al final nunca altera lo que ve un snapshot, porque este guarda hasta qué fila
+    llega. Solo borrar (poner la fila a None) modifica un bloque, y si el bloque es
+    compartido con un snapshot ya publicado se copia antes. Publicar un snapshot cuesta
+    O(filas / CHUNK_SIZE): solo se copia la lista de bloques.
+    """
+
+    def __init__(self):
+        self.base = 0       # fila del primer elemento de chunks[0] (múltiplo de CHUNK_SIZE)
+        self.start = 0      # primera fila no recortada; las anteriores ya se eliminaron
+        self.end = 0        # siguiente fila a asignar
+        self.chunks = []
+        self._owner = []    # época en la que cada bloque pasó a ser privado del almacén
+        self.epoch = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, record):
+        """Añade un registro y devuelve su número de fila"""
+        row = self.end
+        if not row & CHUNK_MASK:
+            self.chunks.append([])
+            self._owner.append(self.epoch)
+        self.chunks[-1].append(record)
+        self.end += 1
+        return row
+
+    def get(self, row):
+        if self.start <= row < self.end:
+            i = row - self.base
+            return self.chunks[i >> CHUNK_BITS][i & CHUNK_MASK]
+        return None
+
+    def clear(self, row):
+        """Marca la fila como eliminada, copiando antes el bloque si lo comparte un snapshot"""
+        i = row - self.base
+        c = i >> CHUNK_BITS
+        if self._owner[c] != self.epoch:
+            self.chunks[c] = list(self.chunks[c])
+            self._owner[c] = self.epoch
+        self.chunks[c][i & CHUNK_MASK] = None
+
+    def trim(self):
+        """Avanza `start` sobre el prefijo eliminado y suelta los bloques completos que quedan atrás"""
+        while self.start < self.end and self.get(self.start) is None:
+            self.start += 1
+        drop = (self.start - self.base) >> CHUNK_BITS
+        if drop:
+            del self.chunks[:drop]
+            del self._owner[:drop]
+            self.base += drop << CHUNK_BITS
+        return self.start
+
+    def freeze(self):
+        """Bloques y límites para un snapshot; a partir de aquí los bloques son compartidos"""
+        self.epoch += 1
+        return tuple(self.chunks), self.base, self.start, self.end
+
+
+class StoreSnapshot:
+    """Vista inmutable y versionada de los registros vivos del almacén.
+
+    Se lee sin el lock del almacén: los bloques que referencia no vuelven a modificarse
+    (los borrados posteriores trabajan sobre copias) y las filas añadidas después de
+    `end` quedan fuera de la vista.
+    """
+
+    __slots__ = ("version", "count", "_chunks", "_base", "_start", "_end")
+
+    def __init__(self, version, count, chunks, base, start, end):
+        self.version = version
+        self.count = count
+        self._chunks = chunks
+        self._base = base
+        self._start = start
+        self._end = end
+
+    def __len__(self):
+        return self.count
+
+    def records(self):
+        """Registros vivos en orden de llegada"""
+        first, last = self._start - self._base, self._end - self._base
+        for c, chunk in enumerate(self._chunks):
+            offset = c << CHUNK_BITS
+            if offset + CHUNK_SIZE <= first:
+                continue
+            if offset >= last:
+                break
+            for record in chunk[max(first - offset, 0):min(last - offset, CHUNK_SIZE)]:
+                if record is not None:
+                    yield record
+
+    def get_insects(self):
+        """Dict _id -> evento con la misma forma que InsectDataStore.get_insects"""
+        return {record.insect_id: record.to_dict() for record in self.records()}
+
+
+class Cursor:
+    """Recorrido paginado y en orden estable de un iterable de registros"""
+
+    _END = object()
+
+    def __init__(self, records, total=None):
+        self.total = total
+        self.position = 0
+        self.touched = time.monotonic()
+        self.lock = threading.Lock()
+        self._records = iter(records)
+        self._next = next(self._records, self._END)
+
+    @property
+    def done(self):
+        return self._next is self._END
+
+    def next_page(self, size):
+        """Siguientes `size` registros (o menos si se acaban)"""
+        if self._next is self._END or size < 1:
+            return []
+        page = [self._next]
+        page.extend(itertools.islice(self._records, size - 1))
+        self._next = next(self._records, self._END)
+        self.position += len(page)
+        self.touched = time.monotonic()
+        return page
+
+
+class CursorRegistry:
+    """Cursores abiertos por los clientes; los que llevan `ttl` segundos sin usarse se descartan"""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._cursors = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def open(self, records, total=None):
+        cursor = Cursor(records, total)
+        with self._lock:
+            self._expire()
+            cursor_id = next(self._ids)
+            self._cursors[cursor_id] = cursor
+        return cursor_id, cursor
+
+    def get(self, cursor_id):
+        with self._lock:
+            cursor = self._cursors.get(cursor_id)
+        if cursor is None:
+            raise ValueError(f"Cursor desconocido o expirado: {cursor_id}")
+        return cursor
+
+    def close(self, cursor_id):
+        with self._lock:
+            return self._cursors.pop(cursor_id, None) is not None
+
+    def _expire(self):
+        limit = time.monotonic() - self.ttl
+        for cursor_id in [i for i, c in self._cursors.items() if c.touched < limit]:
+            del self._cursors[cursor_id]
+
+    def __contains__(self, cursor_id):
+        with self._lock:
+            return cursor_id in self._cursors
+
+    def __len__(self):
+        return len(self._cursors)
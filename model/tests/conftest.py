@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del modelo se importan por nombre, como desde model/ (ej. `from record import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+from record import PostingIndex, RangeIndex
+
+
+def test_posting_compaction_drops_dead_and_trimmed_rows():
+    index = PostingIndex()
+    for row in range(100):
+        index.add(row % 3, row)
+    dead = {row for row in range(100) if row % 2 == 0 or row < 30}
+    for row in dead:
+        index.remove(row % 3)
+    assert index.needs_compaction()
+
+    index.compact(lambda row: row not in dead, min_row=30)
+    live = [row for row in range(100) if row not in dead]
+    for value in range(3):
+        assert list(index.rows(value)) == [row for row in live if row % 3 == value]
+        assert index.count(value) == len(index.rows(value))
+    assert index.entries() == len(live)
+    assert not index.needs_compaction()
+
+
+def test_posting_compaction_forgets_empty_values():
+    index = PostingIndex()
+    index.add("a", 0)
+    index.add("b", 1)
+    index.remove("a")
+    index.compact(lambda row: row != 0)
+    assert index.keys() == ["b"]
+    assert "a" not in index.postings
+
+
+def test_range_index_after_compaction():
+    index = RangeIndex()
+    for row, value in enumerate([5, -3, 8, 5, 0, -3, 12]):
+        index.add(value, row)
+    assert index.sorted_values == [-3, 0, 5, 8, 12]
+    assert index.rows_between(0, 8) == [4, 0, 3, 2]
+
+    # Borrar todo el valor 8 y la fila 0 (valor 5)
+    dead = {0, 2}
+    index.remove(5)
+    index.remove(8)
+    index.compact(lambda row: row not in dead)
+    assert index.sorted_values == [-3, 0, 5, 12]
+    # Con pocas filas muertas no se reescriben las listas: se filtran al leer
+    assert index.rows_between(0, 8, is_live=lambda row: row not in dead) == [4, 3]
+    assert index.count_between() == 5
+    assert index.rows_between(limit=2) == [1, 5]
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from checkpoint import read_checkpoint
+from consumer import InsectDataStore, restore_checkpoint, save_checkpoint
+from record import RECORD_STRUCT, InsectRecord
+from windows import now_epoch
+
+OLD = 3 * 3600  # más que el max_age_hours=2 de clean_old_data
+
+
+def make_record(n, epoch):
+    return InsectRecord(RECORD_STRUCT.pack(n.to_bytes(16, "big"), epoch, n % 4, n % 4, n % 3, n % 4,
+                                           n % 30, n % 101 - 50, n % 1000 + 1, 40.0, -3.0, 0))
+
+
+def fill(store, count, start=0):
+    # Los registros pares son antiguos y la limpieza los elimina; los impares siguen vivos
+    now = now_epoch()
+    store.add_insects([make_record(n, now - OLD - n if n % 2 == 0 else now - 10)
+                       for n in range(start, start + count)])
+
+
+def payload(record):
+    """Registro sin la fila, que cambia al restaurar"""
+    return record[:-8]
+
+
+def test_snapshot_isolated_from_clear_and_trim():
+    store = InsectDataStore()
+    fill(store, 20000)
+    snapshot = store.snapshot()
+    expected = list(snapshot.records())
+    assert len(expected) == len(snapshot) == 20000
+
+    def writer():
+        store.clean_old_data(max_age_hours=2)
+        fill(store, 5000, start=20000)
+        store.clean_old_data(max_age_hours=2)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while thread.is_alive():
+        assert list(snapshot.records()) == expected
+    thread.join()
+
+    # El snapshot sigue intacto y uno nuevo refleja los borrados y el recorte
+    assert list(snapshot.records()) == expected
+    assert store.rows.start > 0
+    live = list(store.snapshot().records())
+    assert len(live) == 12500
+    assert all(int.from_bytes(record[:16], "big") % 2 for record in live)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "store.ckpt")
+    store = InsectDataStore()
+    fill(store, 5000)
+    store.clean_old_data(max_age_hours=2)
+    offsets = {("insect-events", 0): 1234, ("insect-events", 1): 99}
+    assert save_checkpoint(store, path, offsets) == 2500
+
+    restored = InsectDataStore()
+    assert restore_checkpoint(restored, path) == offsets
+    assert [payload(r) for r in restored.snapshot().records()] == [payload(r) for r in store.snapshot().records()]
+    assert restored.get_stats()["by_species"] == store.get_stats()["by_species"]
+
+
+def test_truncated_checkpoint_is_rejected(tmp_path):
+    path = str(tmp_path / "store.ckpt")
+    store = InsectDataStore()
+    fill(store, 100)
+    save_checkpoint(store, path, {})
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 1)
+    with pytest.raises(ValueError):
+        read_checkpoint(path)
@@ -0,0 +1,109 @@
+import pytest
+
+from transport import RING_POSITIONS, RingConsumer, RingFile, RingProducer, TopicPartition
+
+TOPIC = "insect-events"
+
+
+def open_ring(tmp_path, capacity=4096):
+    path = str(tmp_path / "ring")
+    RingFile(path, capacity).close()
+    return path
+
+
+def consumer(path):
+    c = RingConsumer(path, {"group.id": "test", "enable.auto.commit": False})
+    c.subscribe([TOPIC])
+    return c
+
+
+def send(producer, values):
+    for value in values:
+        producer.produce(TOPIC, value=value)
+    assert producer.flush(1) == 0
+
+
+def test_ring_wraps_around(tmp_path):
+    path = open_ring(tmp_path, capacity=1024)
+    producer, c = RingProducer(path), consumer(path)
+    received = []
+    # Varias vueltas al área de datos: cada mensaje ocupa 16 + 50 bytes
+    for batch in range(20):
+        values = [bytes([batch, i]) * 25 for i in range(10)]
+        send(producer, values)
+        messages = c.consume(100, timeout=0.1)
+        received.extend(m.value() for m in messages)
+        c.commit()
+        assert [m.offset() for m in messages] == list(range(batch * 10, batch * 10 + 10))
+    assert received == [bytes([b, i]) * 25 for b in range(20) for i in range(10)]
+    c.close()
+
+
+def test_ring_full_raises_buffer_error_until_commit(tmp_path):
+    path = open_ring(tmp_path, capacity=1024)
+    producer, c = RingProducer(path), consumer(path)
+    value = b"x" * 100
+    written = producer.ring.append_many([(None, value, None)] * 100)
+    assert 0 < written < 100
+    # Sin confirmar no hay sitio, aunque el consumer ya haya leído
+    assert len(c.consume(100, timeout=0.1)) == written
+    assert producer.ring.append_many([(None, value, None)]) == 0
+    with pytest.raises(BufferError):
+        for _ in range(2000):
+            producer.produce(TOPIC, value=value)
+    c.commit()
+    assert producer.ring.append_many([(None, value, None)]) == 1
+    c.close()
+
+
+def test_commit_offsets_and_resume(tmp_path):
+    path = open_ring(tmp_path)
+    producer, c = RingProducer(path), consumer(path)
+    send(producer, [b"%d" % i for i in range(30)])
+    first = c.consume(10, timeout=0.1)
+    second = c.consume(10, timeout=0.1)
+    assert len(first) == len(second) == 10
+    # Confirmar solo el primer lote aunque ya se haya leído el segundo
+    c.commit(offsets=[TopicPartition(TOPIC, 0, first[-1].offset() + 1)])
+    assert c.ring.committed()[0] == 10
+    c.close()
+
+    c = consumer(path)
+    assert [m.value() for m in c.consume(5, timeout=0.1)] == [b"%d" % i for i in range(10, 15)]
+    c.close()
+
+
+def test_commit_matches_position_of(tmp_path):
+    path = open_ring(tmp_path)
+    producer, c = RingProducer(path), consumer(path)
+    send(producer, [b"v" * (i % 7) for i in range(50)])
+    ends = [c.consume(7, timeout=0.1)[-1].offset() + 1 for _ in range(5)]
+    for end in ends:
+        expected = c.ring.position_of(end)
+        c.commit(offsets=[TopicPartition(TOPIC, 0, end)])
+        assert c.ring.committed() == expected
+    # Las posiciones ya confirmadas se olvidan
+    assert all(seq >= ends[-1] for seq in c._positions)
+    c.close()
+
+
+def test_seek_to_offset(tmp_path):
+    path = open_ring(tmp_path)
+    producer, c = RingProducer(path), consumer(path)
+    send(producer, [b"%d" % i for i in range(20)])
+    c.assign([TopicPartition(TOPIC, 0, 12)])
+    assert [m.offset() for m in c.consume(3, timeout=0.1)] == [12, 13, 14]
+    # Un offset sin posición recordada se busca recorriendo desde lo confirmado
+    c.commit(offsets=[TopicPartition(TOPIC, 0, 13)])
+    assert c.ring.committed() == c.ring.position_of(13)
+    c.close()
+
+
+def test_remembered_positions_are_bounded(tmp_path):
+    path = open_ring(tmp_path, capacity=1 << 20)
+    producer, c = RingProducer(path), consumer(path)
+    send(producer, [b"m"] * (RING_POSITIONS + 50))
+    while c.consume(1, timeout=0):
+        pass
+    assert len(c._positions) == RING_POSITIONS
+    c.close()
@@ -0,0 +1,536 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+
+try:
+    from confluent_kafka import Producer as KafkaProducer, Consumer as KafkaConsumer, TopicPartition
+    from confluent_kafka import OFFSET_INVALID
+except ImportError:  # confluent_kafka es opcional: solo lo necesita el transporte kafka
+    KafkaProducer = KafkaConsumer = None
+    OFFSET_INVALID = -1001
+
+    class TopicPartition:
+        """Sustituto de confluent_kafka.TopicPartition para los transportes locales"""
+
+        def __init__(self, topic, partition=0, offset=OFFSET_INVALID):
+            self.topic = topic
+            self.partition = partition
+            self.offset = offset
+
+        def __repr__(self):
+            return f"TopicPartition({self.topic!r}, {self.partition}, {self.offset})"
+
+# Transportes disponibles: "kafka", "memory" (un solo proceso) o "ring[:ruta]" (archivo
+# mmap compartido entre procesos). Los locales imitan la API de confluent_kafka que usan
+# producer.py y consumer.py: produce/poll/flush y subscribe/consume/commit/close.
+TRANSPORTS = ("kafka", "memory", "ring")
+RING_PATH = "/tmp/insect-events.ring"
+RING_SIZE = 64 << 20
+LOCAL_QUEUE = 1000  # Mensajes que un producer local acumula antes de escribirlos
+RING_POSITIONS = 1024  # Lotes leídos cuya posición recuerda un RingConsumer para confirmarlos
+
+
+def parse_transport(spec):
+    """'kafka' | 'memory' | 'ring' | 'ring:/ruta' -> (nombre, ruta del ring o None)"""
+    name, _, path = spec.partition(":")
+    if name not in TRANSPORTS:
+        raise ValueError(f"Transporte no válido: {spec}. Usar: kafka, memory, ring o ring:/ruta")
+    if name == "ring":
+        return name, path or RING_PATH
+    if path:
+        raise ValueError(f"El transporte {name} no acepta ruta: {spec}")
+    return name, None
+
+
+def create_producer(spec, conf):
+    name, path = parse_transport(spec)
+    if name == "kafka":
+        if KafkaProducer is None:
+            raise ImportError("El transporte kafka requiere confluent_kafka (pip install confluent-kafka)")
+        return KafkaProducer(conf)
+    if name == "memory":
+        return MemoryProducer(memory_broker())
+    return RingProducer(path)
+
+
+def create_consumer(spec, conf):
+    name, path = parse_transport(spec)
+    if name == "kafka":
+        if KafkaConsumer is None:
+            raise ImportError("El transporte kafka requiere confluent_kafka (pip install confluent-kafka)")
+        return KafkaConsumer(conf)
+    if name == "memory":
+        return MemoryConsumer(memory_broker(), conf)
+    return RingConsumer(path, conf)
+
+
+class Message:
+    """Mensaje con los accesores de confluent_kafka.Message"""
+
+    __slots__ = ("_topic", "_partition", "_offset", "_key", "_value", "_headers")
+
+    def __init__(self, topic, partition, offset, key, value, headers):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._headers = headers
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return self._headers
+
+    def error(self):
+        return None
+
+
+def _to_bytes(value):
+    if value is None or isinstance(value, bytes):
+        return value
+    return value.encode("utf-8") if isinstance(value, str) else bytes(value)
+
+
+class _LocalConsumer:
+    """Asignación, auto-commit y on_assign comunes a los consumers locales (partición 0)"""
+
+    def __init__(self, conf):
+        self.group = conf.get("group.id", "default")
+        self.auto_commit = conf.get("enable.auto.commit", True) not in (False, "false")
+        self.topic = None
+        self._on_assign = None
+        self._assigned = False
+        self._paused = False
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        # Con una única partición nunca hay rebalanceo: on_revoke no llega a llamarse
+        self.topic = topics[0]
+        self._on_assign = on_assign
+        self._assigned = False
+
+    def _ensure_assigned(self):
+        if self._assigned:
+            return
+        partitions = [TopicPartition(self.topic, 0, OFFSET_INVALID)]
+        if self._on_assign is not None:
+            self._on_assign(self, partitions)
+        if not self._assigned:
+            self.assign(partitions)
+
+    def assign(self, partitions):
+        for partition in partitions:
+            self._seek(partition.offset)
+        self._assigned = True
+
+    def assignment(self):
+        return [TopicPartition(self.topic, 0)] if self._assigned else []
+
+    def pause(self, partitions):
+        # Con una sola partición pausar cualquiera es pausar el consumer entero
+        if partitions:
+            self._paused = True
+
+    def resume(self, partitions):
+        if partitions:
+            self._paused = False
+
+    def consume(self, num_messages=1, timeout=-1):
+        self._ensure_assigned()
+        if self._paused:
+            time.sleep(min(timeout, 0.1) if timeout is not None and timeout >= 0 else 0.1)
+            return []
+        deadline = time.monotonic() + (timeout if timeout is not None and timeout >= 0 else 1e9)
+        while True:
+            messages = self._read(num_messages)
+            if messages or time.monotonic() >= deadline:
+                break
+            self._wait(deadline)
+        if messages and self.auto_commit:
+            self.commit(asynchronous=True)
+        return messages
+
+    def poll(self, timeout=-1):
+        messages = self.consume(1, timeout)
+        return messages[0] if messages else None
+
+
+class MemoryBroker:
+    """Broker en memoria para un solo proceso: un log por topic con offsets por grupo.
+
+    Los mensajes confirmados por todos los grupos se descartan; si hay más de
+    `max_messages` pendientes, produce lanza BufferError como la cola de librdkafka.
+    """
+
+    def __init__(self, max_messages=1000000):
+        self.max_messages = max_messages
+        self._logs = defaultdict(list)
+        self._base = defaultdict(int)          # offset del primer mensaje retenido
+        self._committed = defaultdict(dict)    # topic -> {grupo: offset}
+        self._cond = threading.Condition()
+
+    def end_offset(self, topic):
+        return self._base[topic] + len(self._logs[topic])
+
+    def append(self, topic, messages):
+        with self._cond:
+            log = self._logs[topic]
+            if len(log) + len(messages) > self.max_messages:
+                self._trim(topic)
+                if len(log) + len(messages) > self.max_messages:
+                    raise BufferError("Cola local llena")
+            log.extend(messages)
+            self._cond.notify_all()
+
+    def read(self, topic, offset, max_messages):
+        with self._cond:
+            base = self._base[topic]
+            start = max(offset, base) - base
+            return base + start, self._logs[topic][start:start + max_messages]
+
+    def wait(self, topic, offset, timeout):
+        with self._cond:
+            if self.end_offset(topic) <= offset:
+                self._cond.wait(timeout)
+
+    def committed(self, topic, group):
+        return self._committed[topic].get(group)
+
+    def commit(self, topic, group, offset):
+        with self._cond:
+            self._committed[topic][group] = offset
+            if min(self._committed[topic].values()) - self._base[topic] >= 65536:
+                self._trim(topic)
+
+    def _trim(self, topic):
+        committed = self._committed[topic]
+        if not committed:
+            return
+        drop = min(committed.values()) - self._base[topic]
+        if drop > 0:
+            del self._logs[topic][:drop]
+            self._base[topic] += drop
+
+
+_default_broker = None
+
+
+def memory_broker():
+    """Broker en memoria compartido por todos los producers y consumers del proceso"""
+    global _default_broker
+    if _default_broker is None:
+        _default_broker = MemoryBroker()
+    return _default_broker
+
+
+class MemoryProducer:
+    def __init__(self, broker):
+        self.broker = broker
+        self._pending = defaultdict(list)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def produce(self, topic, value=None, key=None, headers=None, **kwargs):
+        if self._count >= LOCAL_QUEUE:
+            self.poll(0)
+            if self._count >= LOCAL_QUEUE:
+                raise BufferError("Cola local llena")
+        self._pending[topic].append((_to_bytes(key), _to_bytes(value), headers))
+        self._count += 1
+
+    def poll(self, timeout=0):
+        for topic, messages in list(self._pending.items()):
+            try:
+                self.broker.append(topic, messages)
+            except BufferError:
+                if timeout:
+                    time.sleep(timeout)
+                return 0
+            del self._pending[topic]
+            self._count -= len(messages)
+        return 0
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._count and (deadline is None or time.monotonic() < deadline):
+            self.poll(0.01)
+        return self._count
+
+
+class MemoryConsumer(_LocalConsumer):
+    def __init__(self, broker, conf):
+        super().__init__(conf)
+        self.broker = broker
+        self.reset = conf.get("auto.offset.reset", "latest")
+        self.position = 0
+
+    def _seek(self, offset):
+        if offset is None or offset < 0:
+            committed = self.broker.committed(self.topic, self.group)
+            if committed is not None:
+                offset = committed
+            elif self.reset in ("earliest", "smallest", "beginning"):
+                offset = 0
+            else:
+                offset = self.broker.end_offset(self.topic)
+        self.position = offset
+
+    def _read(self, num_messages):
+        offset, entries = self.broker.read(self.topic, self.position, num_messages)
+        messages = [Message(self.topic, 0, offset + i, key, value, headers)
+                    for i, (key, value, headers) in enumerate(entries)]
+        self.position = offset + len(entries)
+        return messages
+
+    def _wait(self, deadline):
+        self.broker.wait(self.topic, self.position, max(0.0, min(0.1, deadline - time.monotonic())))
+
+    def commit(self, message=None, offsets=None, asynchronous=True):
+        if offsets:
+            for partition in offsets:
+                self.broker.commit(partition.topic, self.group, partition.offset)
+        else:
+            self.broker.commit(self.topic, self.group, self.position)
+
+    def close(self):
+        if self.auto_commit and self._assigned:
+            self.commit()
+
+
+# Ring en archivo: cabecera | área de datos circular de `capacity` bytes.
+# Las posiciones son contadores de bytes crecientes (posición física = pos % capacity)
+# y cada mensaje lleva su número de secuencia, que hace de offset.
+RING_MAGIC = b"INRB"
+RING_VERSION = 1
+_RING_HEADER = struct.Struct("<4sB3xQQQQQ")  # magic, versión, capacidad, head, next_seq, pos y seq confirmados
+_RING_DATA = 64
+_HEAD, _NEXT_SEQ, _COMMITTED_POS, _COMMITTED_SEQ = 16, 24, 32, 40
+_U64 = struct.Struct("<Q")
+_RING_RECORD = struct.Struct("<QIHH")  # secuencia, longitud de value, key y headers
+
+
+def _encode_headers(headers):
+    parts = []
+    for key, value in headers or ():
+        key, value = _to_bytes(key), _to_bytes(value) or b""
+        parts.append(struct.pack("<B", len(key)) + key + struct.pack("<H", len(value)) + value)
+    return b"".join(parts)
+
+
+def _decode_headers(data):
+    headers, i = [], 0
+    while i < len(data):
+        klen = data[i]
+        key = data[i + 1:i + 1 + klen].decode("utf-8")
+        i += 1 + klen
+        (vlen,) = struct.unpack_from("<H", data, i)
+        headers.append((key, bytes(data[i + 2:i + 2 + vlen])))
+        i += 2 + vlen
+    return headers or None
+
+
+class RingFile:
+    """Buffer circular en un archivo mapeado con mmap, compartido entre procesos.
+
+    Los producers escriben bajo flock exclusivo y publican el nuevo `head` después de los
+    datos. El espacio desde la posición confirmada (commit) en adelante nunca se pisa: si
+    el consumer no confirma, el ring se llena y produce lanza BufferError.
+    """
+
+    def __init__(self, path, capacity=RING_SIZE):
+        self.path = path
+        self._file = open(path, "a+b")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._file.fileno()).st_size < _RING_DATA:
+                self._file.truncate(0)
+                header = _RING_HEADER.pack(RING_MAGIC, RING_VERSION, capacity, 0, 0, 0, 0)
+                self._file.write(header.ljust(_RING_DATA, b"\0"))
+                self._file.truncate(_RING_DATA + capacity)
+                self._file.flush()
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, self.capacity, *_ = _RING_HEADER.unpack_from(self._map)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            self.close()
+            raise ValueError(f"{path} no es un ring de eventos compatible")
+
+    def _get(self, field):
+        return _U64.unpack_from(self._map, field)[0]
+
+    def _set(self, field, value):
+        _U64.pack_into(self._map, field, value)
+
+    def _write(self, pos, data):
+        i = pos % self.capacity
+        first = min(len(data), self.capacity - i)
+        self._map[_RING_DATA + i:_RING_DATA + i + first] = data[:first]
+        if first < len(data):
+            self._map[_RING_DATA:_RING_DATA + len(data) - first] = data[first:]
+
+    def _read(self, pos, size):
+        i = pos % self.capacity
+        first = min(size, self.capacity - i)
+        data = self._map[_RING_DATA + i:_RING_DATA + i + first]
+        if first < size:
+            data += self._map[_RING_DATA:_RING_DATA + size - first]
+        return data
+
+    def append_many(self, messages):
+        """Escribe (key, value, headers) en orden; devuelve cuántos cupieron"""
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            head, seq = self._get(_HEAD), self._get(_NEXT_SEQ)
+            free = self.capacity - (head - self._get(_COMMITTED_POS))
+            written = 0
+            for key, value, headers in messages:
+                key, value, headers = key or b"", value or b"", _encode_headers(headers)
+                record = _RING_RECORD.pack(seq, len(value), len(key), len(headers)) + key + headers + value
+                if len(record) > free:
+                    break
+                self._write(head, record)
+                head += len(record)
+                free -= len(record)
+                seq += 1
+                written += 1
+            # Publicar después de escribir los datos: un lector nunca ve un mensaje a medias
+            self._set(_NEXT_SEQ, seq)
+            self._set(_HEAD, head)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        return written
+
+    def read(self, pos, max_messages):
+        """Mensajes desde `pos`: lista de (seq, key, value, headers) y la posición siguiente"""
+        head = self._get(_HEAD)
+        messages = []
+        while pos < head and len(messages) < max_messages:
+            seq, vlen, klen, hlen = _RING_RECORD.unpack(self._read(pos, _RING_RECORD.size))
+            body = self._read(pos + _RING_RECORD.size, klen + hlen + vlen)
+            messages.append((seq, body[:klen] or None, body[klen + hlen:], _decode_headers(body[klen:klen + hlen])))
+            pos += _RING_RECORD.size + klen + hlen + vlen
+        return messages, pos
+
+    def committed(self):
+        return self._get(_COMMITTED_SEQ), self._get(_COMMITTED_POS)
+
+    def commit(self, seq, pos):
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            self._set(_COMMITTED_SEQ, seq)
+            self._set(_COMMITTED_POS, pos)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def position_of(self, seq):
+        """Posición del mensaje `seq`, buscando desde lo confirmado (lo anterior ya no está)"""
+        committed_seq, pos = self.committed()
+        head = self._get(_HEAD)
+        while committed_seq < seq and pos < head:
+            _, vlen, klen, hlen = _RING_RECORD.unpack(self._read(pos, _RING_RECORD.size))
+            pos += _RING_RECORD.size + klen + hlen + vlen
+            committed_seq += 1
+        return committed_seq, pos
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class RingProducer:
+    def __init__(self, path):
+        self.ring = RingFile(path)
+        self._pending = []
+
+    def __len__(self):
+        return len(self._pending)
+
+    def produce(self, topic, value=None, key=None, headers=None, **kwargs):
+        if len(self._pending) >= LOCAL_QUEUE:
+            self.poll(0)
+            if len(self._pending) >= LOCAL_QUEUE:
+                raise BufferError("Ring lleno: el consumer no ha confirmado los mensajes anteriores")
+        self._pending.append((_to_bytes(key), _to_bytes(value), headers))
+
+    def poll(self, timeout=0):
+        if self._pending:
+            written = self.ring.append_many(self._pending)
+            del self._pending[:written]
+            if self._pending and timeout:
+                time.sleep(timeout)
+        return 0
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending and (deadline is None or time.monotonic() < deadline):
+            self.poll(0.01)
+        return len(self._pending)
+
+
+class RingConsumer(_LocalConsumer):
+    """Consumer de un ring: un único grupo, cuyo offset confirmado vive en la cabecera"""
+
+    def __init__(self, path, conf):
+        super().__init__(conf)
+        self.ring = RingFile(path)
+        self.seq, self.pos = self.ring.committed()
+        # Secuencia siguiente a cada lote leído -> su posición en el ring, para confirmar
+        # offsets de lotes anteriores sin recorrer los mensajes (position_of)
+        self._positions = {}
+
+    def _seek(self, offset):
+        if offset is None or offset < 0:
+            self.seq, self.pos = self.ring.committed()
+        else:
+            self.seq, self.pos = self.ring.position_of(offset)
+
+    def _read(self, num_messages):
+        entries, self.pos = self.ring.read(self.pos, num_messages)
+        if entries:
+            self.seq = entries[-1][0] + 1
+            self._positions[self.seq] = self.pos
+            if len(self._positions) > RING_POSITIONS:
+                del self._positions[next(iter(self._positions))]
+        return [Message(self.topic, 0, seq, key, value, headers) for seq, key, value, headers in entries]
+
+    def _wait(self, deadline):
+        time.sleep(max(0.0, min(0.005, deadline - time.monotonic())))
+
+    def commit(self, message=None, offsets=None, asynchronous=True):
+        if offsets:
+            for partition in offsets:
+                pos = self._positions.get(partition.offset)
+                if pos is None:
+                    self.ring.commit(*self.ring.position_of(partition.offset))
+                else:
+                    self.ring.commit(partition.offset, pos)
+                # Lo anterior a lo confirmado ya no se vuelve a confirmar
+                for seq in [seq for seq in self._positions if seq < partition.offset]:
+                    del self._positions[seq]
+        else:
+            self.ring.commit(self.seq, self.pos)
+
+    def close(self):
+        if self.auto_commit and self._assigned:
+            self.commit()
+        self.ring.close()
@@ -0,0 +1,151 @@
+import bisect
+import calendar
+import time
+from collections import Counter, deque
+
+# Ventanas con nombre que se aceptan en las consultas, en segundos
+NAMED_WINDOWS = {
+    '1min': 60,
+    '2min': 120,
+    '5min': 300,
+    '15min': 900,
+    '1hour': 3600,
+}
+
+# Segundos que un eventTime puede ir por delante del reloj local (desfase entre máquinas).
+# Más allá se descarta: un evento del futuro reclamaría slots del ring aún vivos
+MAX_FUTURE_SKEW = 5
+
+
+def now_epoch():
+    """Segundo actual en la misma base que los eventTime (hora local marcada como Z)"""
+    return calendar.timegm(time.localtime())
+
+
+def window_seconds(window):
+    """Convierte '5min', '37s', '37' o 37 a segundos"""
+    if isinstance(window, int):
+        seconds = window
+    elif window in NAMED_WINDOWS:
+        seconds = NAMED_WINDOWS[window]
+    else:
+        text = str(window).strip().lower()
+        if text.endswith('s'):
+            text = text[:-1]
+        if not text.isdigit():
+            raise ValueError(f"Ventana no válida: {window}. Usar {', '.join(NAMED_WINDOWS)} o segundos (ej. '37s')")
+        seconds = int(text)
+    if seconds <= 0:
+        raise ValueError(f"Ventana no válida: {window}. Debe ser mayor que 0 segundos")
+    return seconds
+
+
+class SlidingWindowCounter:
+    """Ring buffer de buckets por segundo, indexado por el tiempo del evento.
+
+    Cada bucket cuenta claves arbitrarias (aquí (especie, rol, evento)). Añadir es O(1),
+    una ventana de W segundos se responde recorriendo W buckets y la memoria queda
+    acotada a `horizon` buckets: los segundos que salen del horizonte se reutilizan.
+    """
+
+    def __init__(self, horizon=3600):
+        self.horizon = horizon
+        self._stamps = [None] * horizon
+        self._buckets = [None] * horizon
+
+    def add(self, epoch, key, n=1, now=None):
+        now = now_epoch() if now is None else now
+        if epoch <= now - self.horizon or epoch > now + MAX_FUTURE_SKEW:
+            return False
+
+        i = epoch % self.horizon
+        stamp = self._stamps[i]
+        if stamp != epoch:
+            if stamp is not None and stamp > epoch:
+                # El slot ya pertenece a un segundo más reciente
+                return False
+            self._stamps[i] = epoch
+            self._buckets[i] = {}
+        bucket = self._buckets[i]
+        bucket[key] = bucket.get(key, 0) + n
+        return True
+
+    def counts(self, seconds, now=None):
+        """Conteos por clave en los últimos `seconds` segundos"""
+        return self.counts_multi([seconds], now)[seconds]
+
+    def counts_multi(self, windows, now=None):
+        """Conteos para varias ventanas en una sola pasada sobre los buckets"""
+        now = now_epoch() if now is None else now
+        pending = sorted({min(w, self.horizon) for w in windows})
+        result = {}
+        total = Counter()
+
+        # Recorrer del segundo más reciente hacia atrás y tomar una copia en cada límite
+        for age in range(pending[-1]):
+            second = now - age
+            i = second % self.horizon
+            if self._stamps[i] == second:
+                total.update(self._buckets[i])
+            while pending and age + 1 == pending[0]:
+                result[pending.pop(0)] = Counter(total)
+
+        return {w: result[min(w, self.horizon)] for w in windows}
+
+    def total(self, seconds, now=None):
+        return sum(self.counts(seconds, now).values())
+
+    def occupancy(self):
+        """Buckets vivos y claves totales almacenadas en el ring"""
+        live = [b for b in self._buckets if b]
+        return {"buckets": len(live), "keys": sum(len(b) for b in live)}
+
+
+class TimeOrderedIndex:
+    """Índice ordenado por tiempo de evento, agrupado en buckets [epoch, elementos].
+
+    Los eventos llegan casi en orden, así que insertar es un append en el caso común y
+    solo los eventos atrasados pagan una búsqueda binaria. Agrupar por segundo cuesta un
+    puntero por elemento. La expiración saca buckets del extremo antiguo y las consultas
+    recientes leen solo la cola que necesitan.
+    """
+
+    def __init__(self):
+        self._buckets = deque()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, epoch, item):
+        buckets = self._buckets
+        if not buckets or epoch > buckets[-1][0]:
+            buckets.append([epoch, [item]])
+        elif epoch == buckets[-1][0]:
+            buckets[-1][1].append(item)
+        else:
+            # [epoch] compara antes que cualquier [epoch, elementos] del mismo segundo
+            pos = bisect.bisect_left(buckets, [epoch])
+            if pos < len(buckets) and buckets[pos][0] == epoch:
+                buckets[pos][1].append(item)
+            else:
+                buckets.insert(pos, [epoch, [item]])
+        self._size += 1
+
+    def pop_older_than(self, cutoff):
+        """Saca y devuelve los elementos con epoch < cutoff, del más antiguo al más nuevo"""
+        buckets = self._buckets
+        expired = []
+        while buckets and buckets[0][0] < cutoff:
+            expired.extend(buckets.popleft()[1])
+        self._size -= len(expired)
+        return expired
+
+    def newer_than(self, cutoff):
+        """Elementos con epoch >= cutoff, del más antiguo al más nuevo, leyendo solo la cola"""
+        tail = []
+        for epoch, items in reversed(self._buckets):
+            if epoch < cutoff:
+                break
+            tail.append(items)
+        return [item for items in reversed(tail) for item in items]